@@ -1,10 +1,14 @@
 import os
 from celery import Celery
 
+from .celery_routing import configure as configure_routing
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fixdesk.settings')
 
 app = Celery('fixdesk')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+configure_routing(app)
+
 app.autodiscover_tasks()
\ No newline at end of file
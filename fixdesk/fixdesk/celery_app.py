@@ -1,6 +1,8 @@
 import os
 from celery import Celery
 
+from fixdesk.celery_routing import PRIORITY_TRANSPORT_OPTIONS, configure as configure_routing
+
 BROKER_URL = os.getenv("CELERY_BROKER_URL")
 RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", BROKER_URL)
 
@@ -23,7 +25,7 @@ celery.conf.update(
     worker_prefetch_multiplier=1,
 
     # Must be > max task runtime (in seconds)
-    broker_transport_options={"visibility_timeout": 3600},
+    broker_transport_options={"visibility_timeout": 3600, **PRIORITY_TRANSPORT_OPTIONS},
 
     # Prevent memory creep
     worker_max_tasks_per_child=500,
@@ -31,3 +33,6 @@ celery.conf.update(
     # Don't store results forever
     result_expires=3600,
 )
+
+# auth / mail / maintenance queues with priorities; see fixdesk/celery_routing.py
+configure_routing(celery)
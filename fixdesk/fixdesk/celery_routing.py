@@ -0,0 +1,79 @@
+"""
+Queues and routing shared by the Celery apps in celery.py and celery_app.py.
+
+  auth         verification codes, invitations and the outbox relay that
+               publishes them; small, latency-critical, never behind bulk mail
+  mail         every other notification
+  maintenance  long CPU-bound jobs (re-encryption)
+
+Within a queue, lower priority numbers are delivered first (Redis transport).
+See celery.md for the worker command per queue.
+"""
+from kombu import Queue
+
+AUTH_QUEUE = "auth"
+MAIL_QUEUE = "mail"
+MAINTENANCE_QUEUE = "maintenance"
+
+QUEUES = (
+    Queue(AUTH_QUEUE),
+    Queue(MAIL_QUEUE),
+    Queue(MAINTENANCE_QUEUE),
+)
+
+# Priority tiers (Redis: 0 is served first)
+PRIORITY_AUTH = 0
+PRIORITY_MAIL = 3
+PRIORITY_BULK = 6
+PRIORITY_MAINTENANCE = 9
+
+# notify events, and legacy fixdesk_api.tasks.send_mail types, that gate a
+# login or signup
+AUTH_MAIL_TYPES = {"verify", "activate"}
+AUTH_EVENTS = {"verification.created", "invitation.created"}
+# notify events that fan out one message per assignee
+BULK_EVENTS = {"task.created", "task.status", "comment.created"}
+
+ROUTES = {
+    "fixdesk_api.tasks.relay_outbox": (AUTH_QUEUE, PRIORITY_AUTH),
+    "fixdesk_api.tasks.notify": (MAIL_QUEUE, PRIORITY_MAIL),
+    # Legacy, draining only; remove with the tasks (see fixdesk_api/tasks.py)
+    "fixdesk_api.tasks.send_mail": (MAIL_QUEUE, PRIORITY_MAIL),
+    "fixdesk_api.tasks.send_batch": (MAIL_QUEUE, PRIORITY_BULK),
+    "rugby.tasks.send_event": (MAIL_QUEUE, PRIORITY_MAIL),
+    "rugby.tasks.send_mail": (MAIL_QUEUE, PRIORITY_MAIL),
+    "rugby.tasks.flush_digest": (MAIL_QUEUE, PRIORITY_BULK),
+    "rugby.tasks.flush_overdue_digests": (MAINTENANCE_QUEUE, PRIORITY_MAINTENANCE),
+    "fixdesk_api.tasks.reencrypt": (MAINTENANCE_QUEUE, PRIORITY_MAINTENANCE),
+}
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    kwargs = kwargs or {}
+    if name == "fixdesk_api.tasks.notify" and kwargs.get("event") in AUTH_EVENTS:
+        queue, priority = AUTH_QUEUE, PRIORITY_AUTH
+    elif name == "fixdesk_api.tasks.notify" and kwargs.get("event") in BULK_EVENTS:
+        queue, priority = MAIL_QUEUE, PRIORITY_BULK
+    elif name == "fixdesk_api.tasks.send_mail" and kwargs.get("type") in AUTH_MAIL_TYPES:
+        queue, priority = AUTH_QUEUE, PRIORITY_AUTH
+    elif name in ROUTES:
+        queue, priority = ROUTES[name]
+    else:
+        return None
+    return {"queue": queue, "priority": priority}
+
+
+# Redis transport options that make the priorities above take effect
+PRIORITY_TRANSPORT_OPTIONS = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+}
+
+
+def configure(app):
+    app.conf.update(
+        task_queues=QUEUES,
+        task_default_queue=MAIL_QUEUE,
+        task_routes=(route_task,),
+    )
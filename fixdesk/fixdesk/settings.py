@@ -5,6 +5,8 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 
+from fixdesk.celery_routing import PRIORITY_TRANSPORT_OPTIONS
+
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -84,6 +86,24 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
+# Encryption/keyring counters and latency histograms (see fixdesk/utils/metrics.py);
+# point at a StatsD/Prometheus adapter in production, or NullMetrics to disable.
+METRICS_BACKEND = os.getenv('METRICS_BACKEND', 'fixdesk.utils.metrics.InMemoryMetrics')
+
+# Per-request encryption stats in the log and a Server-Timing header. Debug
+# aid only: off unless METRICS_MIDDLEWARE=true, whatever DEBUG says.
+METRICS_MIDDLEWARE = os.getenv('METRICS_MIDDLEWARE', 'false').lower() in ('1', 'true', 'yes')
+
+if METRICS_MIDDLEWARE:
+    MIDDLEWARE.insert(0, 'fixdesk.utils.metrics.MetricsMiddleware')
+
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {'console': {'class': 'logging.StreamHandler'}},
+        'loggers': {'fixdesk.metrics': {'handlers': ['console'], 'level': 'INFO'}},
+    }
+
 ROOT_URLCONF = 'fixdesk.urls'
 
 TEMPLATES = [
@@ -136,6 +156,10 @@ DATABASES["rugby"]["OPTIONS"] = {
     "options": "-c search_path=rugby,public"
 }
 
+# Second connection to the default database, used only to commit new
+# keyrings independently of the request's transaction (fixdesk_api/keys.py)
+DATABASES["keyring"] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+
 DATABASE_ROUTERS = ['fixdesk.db_router.TenantRouter']
 
 # Password validation
@@ -208,20 +232,68 @@ CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+# Queues and routes are set in fixdesk/celery_routing.py, with the transport
+# options that make Redis honour their priorities (0 is served first). The
+# visibility timeout must exceed the longest task (see celery_app.py).
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600, **PRIORITY_TRANSPORT_OPTIONS}
+
+# Concurrent SMTP sessions per batch (fixdesk/utils/delivery.py) and
+# messages/sec allowed per SMTP host
+MAIL_DELIVERY_CONCURRENCY = int(os.getenv('MAIL_DELIVERY_CONCURRENCY', 4))
+MAIL_RATE_LIMITS = {
+    'smtp.gmail.com': 20,
+    'smtp.office365.com': 30,
+    'smtp.zoho.com': 10,
+}
 
-# Production
-# CACHES = {
-#     "default": {
-#         "BACKEND": "django_redis.cache.RedisCache",
-#         "LOCATION": "rediss://fixdesk-redis-kxcigr.serverless.use1.cache.amazonaws.com:6379",
-#         "OPTIONS": {
-#             "CLIENT_CLASS": "django_redis.client.DefaultClient",
-#         }
-#     }
-# }
+# Publishes committed outbox rows (fixdesk_api/outbox.py); needs `celery beat`
+CELERY_BEAT_SCHEDULE = {
+    'relay-outbox': {
+        'task': 'fixdesk_api.tasks.relay_outbox',
+        'schedule': 2.0,
+        'options': {'expires': 10},
+    },
+    # Safety net for rugby digests whose scheduled flush was lost (rugby/tasks.py)
+    'flush-overdue-digests': {
+        'task': 'rugby.tasks.flush_overdue_digests',
+        'schedule': 300.0,
+        'options': {'expires': 60},
+    },
+}
+
+# Rugby digest windows in seconds, per "<type>_<action>" event. Repeat events
+# about one object within the window reach each recipient as a single digest;
+# event types not listed are mailed immediately.
+RUGBY_DIGEST_WINDOWS = {
+    'issue_comment': 300,
+    'task_comment': 300,
+    'leaverequest_comment': 300,
+    'facilityrequest_comment': 300,
+    'procurementrequest_comment': 300,
+    'issue_status': 120,
+    'task_status': 120,
+}
 
-# dev
-CACHES = {
+# The cache must be shared by web and Celery workers: the mail rate limit and
+# the rugby recipient index coordinate through it (fixdesk/utils/caches.py).
+# Production sets CACHE_URL (e.g. rediss://fixdesk-redis-kxcigr.serverless.use1.cache.amazonaws.com:6379);
+# otherwise the Celery broker's Redis is used, and LocMemCache only for dev.
+CACHE_URL = os.getenv('CACHE_URL') or CELERY_BROKER_URL
+
+if CACHE_URL and CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": "fixdesk",
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            }
+        }
+    }
+else:
+    # dev
+    CACHES = {
         "default": {
             "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         }
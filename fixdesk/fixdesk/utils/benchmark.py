@@ -0,0 +1,118 @@
+import json
+import platform
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+# Keys measure() returns; anything else a case reports is printed after them
+MEASURE_KEYS = ("us_per_op", "median_us_per_op", "ops_per_sec", "number", "repeat")
+
+
+def measure(fn, *, number=100, repeat=5, setup=None):
+    """
+    Times fn() `number` times per round over `repeat` rounds and returns
+    per-call figures. setup() runs before every call, outside the timing.
+    """
+    rounds = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        for _ in range(number):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            fn()
+            elapsed += time.perf_counter() - start
+        rounds.append(elapsed / number)
+
+    best = min(rounds)
+    return {
+        "us_per_op": round(best * 1e6, 3),
+        "median_us_per_op": round(statistics.median(rounds) * 1e6, 3),
+        "ops_per_sec": round(1 / best, 1) if best else None,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def environment():
+    return {
+        "timestamp": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "database": connection.vendor,
+        "debug": settings.DEBUG,
+    }
+
+
+def save_results(path, suite, results):
+    with open(path, "w") as f:
+        json.dump({"suite": suite, "environment": environment(), "results": results}, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Returns [(name, baseline_us, current_us, ratio)] for cases that got
+    slower than baseline by more than threshold (0.2 = 20%).
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get("us_per_op"):
+            continue
+        ratio = current["us_per_op"] / previous["us_per_op"]
+        if ratio > 1 + threshold:
+            regressions.append((name, previous["us_per_op"], current["us_per_op"], ratio))
+    return regressions
+
+
+class BenchmarkCommand(BaseCommand):
+    """
+    Base for bench_* management commands: subclasses implement run() and
+    return {case: measure(...)}; saving and baseline checks are shared.
+    """
+    suite = None
+
+    def add_arguments(self, parser):
+        parser.add_argument("--save", help="Write results as JSON to this path.")
+        parser.add_argument("--baseline", help="Compare against a JSON file written by --save.")
+        parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown vs baseline (0.2 = 20%%).")
+
+    def run(self, **options):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        results = self.run(**options)
+
+        width = max(len(name) for name in results)
+        for name, r in results.items():
+            extra = "  ".join(f"{k}={v}" for k, v in r.items() if k not in MEASURE_KEYS)
+            self.stdout.write(f"{name:<{width}}  {r['us_per_op']:>12.1f} us/op  {r['ops_per_sec'] or 0:>12.0f} ops/s  {extra}".rstrip())
+
+        if options["save"]:
+            save_results(options["save"], self.suite, results)
+            self.stdout.write(f"Saved results to {options['save']}")
+
+        if options["baseline"]:
+            regressions = find_regressions(results, load_results(options["baseline"]), options["threshold"])
+            for name, before, after, ratio in regressions:
+                self.stderr.write(f"REGRESSION {name}: {before:.1f} -> {after:.1f} us/op ({ratio:.2f}x)")
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark(s) regressed beyond {options['threshold']:.0%}")
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
@@ -0,0 +1,32 @@
+"""
+Whether the default cache is shared by every web and Celery process.
+
+The mail rate limit (fixdesk/utils/delivery.py) and the rugby recipient
+index version (rugby/recipients.py) coordinate workers through the cache.
+On a per-process backend such as LocMemCache each worker only sees its own
+counters, so both refuse to rely on it; check_shared_cache() warns at
+startup when settings ask for them anyway.
+"""
+from django.conf import settings
+from django.core import checks
+
+PROCESS_LOCAL_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+def is_shared(alias="default"):
+    return settings.CACHES[alias]["BACKEND"] not in PROCESS_LOCAL_BACKENDS
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs=None, **kwargs):
+    if is_shared() or not getattr(settings, "MAIL_RATE_LIMITS", None):
+        return []
+    return [checks.Warning(
+        "MAIL_RATE_LIMITS is ignored: the default cache is per process, so each worker would "
+        "send at the full rate. Set CACHE_URL (or a Redis CELERY_BROKER_URL).",
+        obj=settings.CACHES["default"]["BACKEND"],
+        id="fixdesk.W001",
+    )]
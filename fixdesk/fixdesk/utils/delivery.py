@@ -0,0 +1,161 @@
+"""
+Concurrent delivery of a batch of messages over the SMTP pool.
+
+smtplib is blocking, so deliver_sync() runs up to MAIL_DELIVERY_CONCURRENCY
+sends at once, each on its own pooled session, pacing them through the
+relay's rate limit (MAIL_RATE_LIMITS, messages/sec per SMTP host). While one
+session waits on the server, the others keep sending, so a batch takes
+roughly len(messages) / concurrency round trips instead of len(messages).
+The sends run on one thread pool per process, shared by every batch, so a
+Celery thread-pool worker does not start threads (or an event loop) per task.
+
+The rate limit is shared by every worker through the cache, so the relay
+sees one steady stream just under its cap rather than each process bursting
+on its own. It needs a cache all workers share (see fixdesk/utils/caches.py);
+on a per-process cache the limits are not applied at all.
+"""
+import logging
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from fixdesk.utils import caches, metrics, smtp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+# SMTP sends in flight per process, across all batches; more queue for a thread
+MAX_THREADS = 32
+
+# Retry delays for transient failures: full jitter over an exponential ceiling
+BACKOFF_BASE = 30  # seconds
+BACKOFF_CAP = 30 * 60
+
+# Fraction of a provider's published cap to actually use
+RATE_HEADROOM = 0.9
+
+_throttled = metrics.Metric("mail.throttled")
+
+
+def backoff(retries, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Seconds to wait before retry number `retries` + 1."""
+    return random.uniform(0, min(cap, base * 2 ** retries))
+
+
+class SharedRateLimiter:
+    """
+    Token bucket kept in the cache so all workers draw from one budget.
+    Time is cut into windows of about 100 ms (longer for slow rates), each
+    holding rate * window tokens, taken with an atomic cache.incr. A sender that
+    finds the window spent sleeps until the next one, so the combined rate
+    never exceeds `rate` and never idles while tokens are left.
+    """
+
+    def __init__(self, key, rate):
+        self.key = key
+        self.rate = rate
+        # Whole tokens per window, window sized so per_window / window == rate
+        self.per_window = max(1, round(rate * 0.1))
+        self.window = self.per_window / rate
+
+    def _take(self):
+        now = time.time()
+        slot = int(now / self.window)
+        key = f"mail-rate:{self.key}:{slot}"
+        cache.add(key, 0, timeout=max(2, math.ceil(self.window * 2)))
+        try:
+            taken = cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr; count this send as the first
+            cache.set(key, 1, timeout=max(2, math.ceil(self.window * 2)))
+            taken = 1
+        if taken <= self.per_window:
+            return 0
+        return (slot + 1) * self.window - now
+
+    def wait(self):
+        while delay := self._take():
+            _throttled.incr()
+            time.sleep(delay)
+
+
+_limiters = {}
+_unshared = set()  # hosts already warned about
+
+
+def rate_limiter(host):
+    rate = getattr(settings, "MAIL_RATE_LIMITS", {}).get(host)
+    if not rate:
+        return None
+    if not caches.is_shared():
+        # N workers each holding a full bucket would send at N x the cap
+        if host not in _unshared:
+            _unshared.add(host)
+            logger.warning("Not rate limiting mail to %s: the default cache is not shared between workers", host)
+        return None
+    rate *= RATE_HEADROOM
+    limiter = _limiters.get(host)
+    if limiter is None or limiter.rate != rate:
+        limiter = _limiters[host] = SharedRateLimiter(host, rate)
+    return limiter
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """This process's send threads, started on first use (again after a fork)."""
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="smtp")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def deliver_sync(messages, *, pool=None, concurrency=None, limiter=None):
+    """
+    Sends messages over up to `concurrency` sessions at once and returns one
+    outcome per message, in order: None if accepted, else the exception.
+    Blocks until all are sent; safe to call from any thread, including one
+    running an event loop.
+    """
+    pool = pool or smtp.get_pool()
+    concurrency = min(concurrency or getattr(settings, "MAIL_DELIVERY_CONCURRENCY", DEFAULT_CONCURRENCY), len(messages))
+    limiter = limiter or rate_limiter(pool.host)
+    outcomes = [None] * len(messages)
+    if not messages:
+        return outcomes
+
+    # Keep a session per sender between batches instead of reconnecting
+    pool.size = max(pool.size, concurrency)
+
+    pending = iter(enumerate(messages))
+    pending_lock = threading.Lock()
+
+    def sender():
+        # Senders share one iterator, so each message is handed out once
+        while True:
+            with pending_lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            i, msg = item
+            if limiter:
+                limiter.wait()
+            outcomes[i] = pool.send_messages([msg])[0]
+
+    executor = get_executor()
+    for future in [executor.submit(sender) for _ in range(concurrency)]:
+        future.result()
+    return outcomes
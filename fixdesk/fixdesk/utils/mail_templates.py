@@ -0,0 +1,85 @@
+"""
+Registry of notification templates keyed by (app, type, action).
+
+Each app declares its templates once with register(); the first render (or
+warm_up() at worker start) compiles every registered template and keeps it
+for the life of the process, so rendering a notification is a dict lookup
+plus Template.render(). check_templates() is a Django system check that
+fails startup when a registered template is missing or does not compile.
+"""
+import logging
+
+from django.core import checks
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+
+logger = logging.getLogger(__name__)
+
+_registry = {}  # (app, type, action) -> template name
+_compiled = {}  # (app, type, action) -> compiled template
+
+
+class UnknownTemplate(LookupError):
+    pass
+
+
+def register(app, templates):
+    """
+    templates maps (type, action) -> template name; action is None for apps
+    that only key on type.
+    """
+    for (type, action), name in templates.items():
+        _registry[(app, type, action)] = name
+        _compiled.pop((app, type, action), None)
+
+
+def registered(app=None):
+    return {key: name for key, name in _registry.items() if app is None or key[0] == app}
+
+
+def get(app, type, action=None):
+    key = (app, type, action)
+    template = _compiled.get(key)
+    if template is None:
+        try:
+            name = _registry[key]
+        except KeyError:
+            raise UnknownTemplate(f"No notification template registered for {key}") from None
+        template = _compiled[key] = get_template(name)
+    return template
+
+
+def render(app, type, action, context):
+    return get(app, type, action).render(context)
+
+
+def warm_up():
+    """Compiles every registered template; returns how many were compiled."""
+    for app, type, action in _registry:
+        get(app, type, action)
+    return len(_compiled)
+
+
+def clear():
+    _compiled.clear()
+
+
+@checks.register(checks.Tags.templates)
+def check_templates(app_configs=None, **kwargs):
+    errors = []
+    for key, name in sorted(_registry.items(), key=lambda item: tuple(map(str, item[0]))):
+        try:
+            get_template(name)
+        except TemplateDoesNotExist:
+            errors.append(checks.Error(
+                f"Notification template {name!r} does not exist.",
+                obj=":".join(str(k) for k in key if k is not None),
+                id="fixdesk.E001",
+            ))
+        except TemplateSyntaxError as e:
+            errors.append(checks.Error(
+                f"Notification template {name!r} does not compile: {e}",
+                obj=":".join(str(k) for k in key if k is not None),
+                id="fixdesk.E002",
+            ))
+    return errors
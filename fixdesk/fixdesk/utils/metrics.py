@@ -0,0 +1,246 @@
+"""
+Counters and latency histograms for hot paths (encryption, DEK cache).
+
+Hot paths create a Metric (name + tags) once and call .incr()/.observe() on
+it. Calls go to the backend named by settings.METRICS_BACKEND: any class with
+incr(name, value, tags) and observe(name, seconds, tags), tags being a tuple
+of (key, value) pairs, so a StatsD or Prometheus client can be dropped in.
+The default InMemoryMetrics keeps process-local totals; NullMetrics turns
+recording off.
+
+While MetricsMiddleware is handling a request, everything recorded in that
+request's thread is also summed per request for the debug output.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger("fixdesk.metrics")
+
+DEFAULT_BACKEND = "fixdesk.utils.metrics.InMemoryMetrics"
+
+# Histogram upper bounds in seconds; the last bucket is everything above
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+
+class NullMetrics:
+    def incr(self, name, value, tags):
+        pass
+
+    def observe(self, name, seconds, tags):
+        pass
+
+
+def _new_shard():
+    # counters: key -> value; histograms: key -> [bucket counts..., count, total seconds]
+    return defaultdict(int), {}
+
+
+def _merge(into, shard):
+    counters, histograms = into
+    shard_counters, shard_histograms = shard
+    # Copies: the owning thread may still be writing to a live shard
+    for k, v in dict(shard_counters).items():
+        counters[k] += v
+    for k, h in dict(shard_histograms).items():
+        total = histograms.setdefault(k, [0] * len(h))
+        for i, v in enumerate(list(h)):
+            total[i] += v
+
+
+class InMemoryMetrics:
+    """
+    Process-local totals. Each thread records into its own shard, so the hot
+    path takes no lock; snapshot() merges the shards. Shards of threads that
+    have exited (recycled pool threads) are folded into one retired total,
+    so memory follows the number of live threads, not every thread ever run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []  # [(thread, (counters, histograms))] for live threads
+        self._retired = _new_shard()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _new_shard()
+            with self._lock:
+                self._retire_exited()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_exited(self):
+        # Lock held. An exited thread no longer writes to its shard.
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = live
+
+    def reset(self):
+        with self._lock:
+            self._retired = _new_shard()
+            for _, (counters, histograms) in self._shards:
+                counters.clear()
+                histograms.clear()
+
+    def incr(self, name, value, tags):
+        self._shard()[0][(name, tags)] += value
+
+    def observe(self, name, seconds, tags):
+        histograms = self._shard()[1]
+        h = histograms.get((name, tags))
+        if h is None:
+            h = histograms[(name, tags)] = [0] * (len(BUCKETS) + 3)
+        h[bisect.bisect_left(BUCKETS, seconds)] += 1
+        h[-2] += 1
+        h[-1] += seconds
+
+    def snapshot(self):
+        """
+        {"counters": {label: value}, "histograms": {label: {...}}} where label
+        is "name{tag=value,...}".
+        """
+        total = _new_shard()
+        with self._lock:
+            self._retire_exited()
+            _merge(total, self._retired)
+            shards = [shard for _, shard in self._shards]
+
+        for shard in shards:
+            _merge(total, shard)
+        counters, histograms = total
+
+        def label(key):
+            name, tags = key
+            if not tags:
+                return name
+            return name + "{" + ",".join(f"{k}={v}" for k, v in tags) + "}"
+
+        return {
+            "counters": {label(k): v for k, v in sorted(counters.items())},
+            "histograms": {
+                label(k): {
+                    "count": h[-2],
+                    "total_ms": round(h[-1] * 1000, 3),
+                    "buckets": dict(zip([*BUCKETS, "inf"], h[:-2])),
+                }
+                for k, h in sorted(histograms.items())
+            },
+        }
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(getattr(settings, "METRICS_BACKEND", DEFAULT_BACKEND))()
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+class RequestMetrics:
+    """Per-request totals: name -> [calls, seconds]."""
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(lambda: [0, 0.0])
+
+    def __bool__(self):
+        return bool(self.counters or self.timings)
+
+    def summary(self):
+        parts = [f"{name}={calls}x/{seconds * 1000:.2f}ms" for name, (calls, seconds) in sorted(self.timings.items())]
+        parts += [f"{name}={value}" for name, value in sorted(self.counters.items())]
+        return " ".join(parts)
+
+    def server_timing(self):
+        # Server-Timing metric names are tokens, so no dots
+        return ", ".join(
+            f'{name.replace(".", "-")};dur={seconds * 1000:.3f};desc="{calls} calls"'
+            for name, (calls, seconds) in sorted(self.timings.items())
+        )
+
+
+_request_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+
+class Metric:
+    """
+    A metric name bound to fixed tags, e.g. Metric("crypto.decrypt",
+    field="User.first_name"). Built once so per-call cost stays low.
+    """
+    __slots__ = ("name", "tags", "request_key")
+
+    def __init__(self, name, **tags):
+        self.name = name
+        self.tags = tuple(tags.items())
+        self.request_key = ".".join([name, *map(str, tags.values())])
+
+    def incr(self, value=1):
+        (_backend or get_backend()).incr(self.name, value, self.tags)
+
+        req = _request_metrics.get()
+        if req is not None:
+            req.counters[self.request_key] += value
+
+    def observe(self, seconds):
+        (_backend or get_backend()).observe(self.name, seconds, self.tags)
+
+        req = _request_metrics.get()
+        if req is not None:
+            t = req.timings[self.request_key]
+            t[0] += 1
+            t[1] += seconds
+
+
+def incr(name, value=1, **tags):
+    Metric(name, **tags).incr(value)
+
+
+def observe(name, seconds, **tags):
+    Metric(name, **tags).observe(seconds)
+
+
+class MetricsMiddleware:
+    """
+    Debug aid (enabled with METRICS_MIDDLEWARE, off by default): logs the metrics recorded while handling
+    each request and returns them as a Server-Timing header, which browser
+    devtools show next to the request timeline.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestMetrics()
+        token = _request_metrics.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_metrics.reset(token)
+
+        if stats:
+            elapsed = (time.perf_counter() - start) * 1000
+            logger.info("%s %s %.1fms %s", request.method, request.path, elapsed, stats.summary())
+            response["Server-Timing"] = stats.server_timing()
+
+        return response
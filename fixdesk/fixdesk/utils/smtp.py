@@ -0,0 +1,251 @@
+"""
+Per-process pool of authenticated SMTP sessions for the mail senders.
+
+Opening a session costs a TCP connect, STARTTLS and AUTH; a pooled session
+only pays for the message itself. Sessions idle for NOOP_AFTER seconds are
+checked with NOOP before reuse, sessions idle longer than IDLE_TIMEOUT (or
+that have sent MAX_MESSAGES) are replaced, and a send that fails because the
+server dropped the session is retried once on a fresh one.
+"""
+import atexit
+import os
+import smtplib
+import ssl
+import threading
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from fixdesk.utils import metrics
+
+SMTP_PORT = 587
+SMTP_TIMEOUT = 30  # seconds, per socket operation
+
+POOL_SIZE = 2  # idle sessions kept per server/account
+IDLE_TIMEOUT = 120  # seconds; most servers drop idle sessions after a few minutes
+NOOP_AFTER = 15  # seconds idle before a session is health-checked
+MAX_MESSAGES = 100  # per session, then reconnect
+
+# Errors that mean the session itself is gone, not that the message was refused
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+_connects = metrics.Metric("smtp.connect")
+_reuses = metrics.Metric("smtp.session", result="reused")
+_stale = metrics.Metric("smtp.session", result="stale")
+_sends = metrics.Metric("smtp.send")
+
+
+def is_transient(error):
+    """
+    True for failures worth retrying later: dropped sessions and 4xx replies
+    (throttling, greylisting, mailbox busy). 5xx replies and any other
+    SMTPException are permanent; SMTPException subclasses OSError, so it is
+    ruled out before the catch-all for network errors.
+    """
+    if isinstance(error, CONNECTION_ERRORS):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+
+def failures(error, recipients):
+    """
+    {address: error} for the recipients of one message, given its outcome
+    from send_messages(); {} if every recipient was accepted. A (partial)
+    refusal fails only the refused addresses, each with its own reply, so
+    is_transient() can tell a busy mailbox from a missing one.
+    """
+    if error is None:
+        return {}
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return {address: smtplib.SMTPRecipientsRefused({address: reply}) for address, reply in error.recipients.items()}
+    return {address: error for address in recipients}
+
+
+class PooledSMTP:
+    def __init__(self, server):
+        self.server = server
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+
+
+class SMTPConnectionPool:
+    def __init__(self, host, port, username, password, size=POOL_SIZE, starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.starttls = starttls
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        start = time.perf_counter()
+        context = ssl.create_default_context()
+
+        if self.port == 465:
+            server = smtplib.SMTP_SSL(self.host, self.port, context=context, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            if self.starttls:
+                server.starttls(context=context)
+
+        if self.username:
+            server.login(self.username, self.password)
+        _connects.observe(time.perf_counter() - start)
+        return PooledSMTP(server)
+
+    def _healthy(self, conn):
+        idle = time.monotonic() - conn.last_used
+        if idle > IDLE_TIMEOUT or conn.messages >= MAX_MESSAGES:
+            return False
+        if idle > NOOP_AFTER:
+            try:
+                return conn.server.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                return False
+        return True
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if self._healthy(conn):
+                _reuses.incr()
+                return conn
+            _stale.incr()
+            conn.close()
+
+    def release(self, conn):
+        conn.last_used = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def send_message(self, msg):
+        error = self.send_messages([msg])[0]
+        if error is not None:
+            raise error
+
+    def send_messages(self, messages):
+        """
+        Sends messages back to back over one session and returns one outcome
+        per message: None if the server accepted every recipient, otherwise
+        the exception. When only some recipients are refused the outcome is
+        SMTPRecipientsRefused holding just those (see failures()). If the
+        session drops mid-batch, the message is retried once on a new
+        session; if no session can be opened, the rest fail with that error.
+        """
+        outcomes = []
+        conn = None
+        try:
+            for i, msg in enumerate(messages):
+                for attempt in range(2):
+                    if conn is None:
+                        try:
+                            conn = self.acquire()
+                        except Exception as e:
+                            outcomes.extend([e] * (len(messages) - i))
+                            return outcomes
+
+                    start = time.perf_counter()
+                    try:
+                        refused = conn.server.send_message(msg)
+                    except CONNECTION_ERRORS as e:
+                        # Dropped between the health check and DATA; retry on a new session
+                        conn.server.close()
+                        conn = None
+                        if attempt:
+                            outcomes.append(e)
+                        continue
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        # Refused message: the session is still usable
+                        outcomes.append(e)
+                        break
+                    except Exception as e:
+                        conn.server.close()
+                        conn = None
+                        outcomes.append(e)
+                        break
+
+                    conn.messages += 1
+                    _sends.observe(time.perf_counter() - start)
+                    # Accepted for some recipients; the rest were refused at RCPT
+                    outcomes.append(smtplib.SMTPRecipientsRefused(refused) if refused else None)
+                    break
+        finally:
+            if conn is not None:
+                self.release(conn)
+
+        return outcomes
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host=None, port=None, username=None, password=None):
+    """
+    Pool for the given server/account, defaulting to the SMTP_SERVER,
+    SMTP_PORT, EMAIL_USER and EMAIL_PASSWORD environment variables.
+    SMTP_STARTTLS=false skips STARTTLS (local sinks only).
+    """
+    host = host or os.getenv("SMTP_SERVER")
+    port = int(port or os.getenv("SMTP_PORT", SMTP_PORT))
+    username = username or os.getenv("EMAIL_USER")
+    password = password or os.getenv("EMAIL_PASSWORD")
+    starttls = os.getenv("SMTP_STARTTLS", "true").lower() not in ("0", "false", "no")
+
+    key = (host, port, username, starttls)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = SMTPConnectionPool(host, port, username, password, starttls=starttls)
+    return pool
+
+
+def send_message(msg):
+    return get_pool().send_message(msg)
+
+
+def send_messages(messages):
+    return get_pool().send_messages(messages)
+
+
+def close_all():
+    for pool in list(_pools.values()):
+        pool.close_all()
+
+
+def _forget_after_fork():
+    # A forked child (Celery prefork, gunicorn) must not share the parent's sockets
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_after_fork)
+atexit.register(close_all)
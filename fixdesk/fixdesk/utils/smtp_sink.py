@@ -0,0 +1,198 @@
+"""
+Local SMTP stand-in for benchmarks and manual testing.
+
+SMTPSink accepts any login and any recipient and throws the message away
+(or keeps the last few, with keep=N), counting connections, messages,
+recipients and bytes. It speaks just enough ESMTP for smtplib and the pool
+in fixdesk.utils.smtp: EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET,
+NOOP and QUIT; STARTTLS is refused, so point clients at it with
+SMTP_STARTTLS=false. latency adds a delay before every reply to stand in for
+a remote provider's round trip, and refuse ({address: code}) rejects RCPT
+for chosen addresses, e.g. 450 (throttled) or 550 (no such mailbox).
+
+Built on socketserver rather than aiosmtpd so it needs nothing beyond the
+standard library.
+"""
+import socketserver
+import threading
+import time
+from collections import deque
+from email import message_from_bytes
+
+HOSTNAME = "fixdesk-sink"
+
+
+class SinkStats:
+    def __init__(self, keep=0):
+        self._lock = threading.Lock()
+        self.messages_kept = deque(maxlen=keep) if keep else None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.active = 0
+            self.peak_active = 0
+            self.messages = 0
+            self.recipients = 0
+            self.bytes = 0
+            if self.messages_kept is not None:
+                self.messages_kept.clear()
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+    def disconnected(self):
+        with self._lock:
+            self.active -= 1
+
+    def received(self, recipients, data):
+        with self._lock:
+            self.messages += 1
+            self.recipients += len(recipients)
+            self.bytes += len(data)
+            if self.messages_kept is not None:
+                self.messages_kept.append((recipients, data))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "peak_connections": self.peak_active,
+                "messages": self.messages,
+                "recipients": self.recipients,
+                "bytes": self.bytes,
+            }
+
+    def kept(self):
+        """The kept messages as (recipients, email.message.Message)."""
+        with self._lock:
+            return [(rcpts, message_from_bytes(data)) for rcpts, data in self.messages_kept or ()]
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        stats = self.server.stats
+        stats.connected()
+        try:
+            self.session()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            stats.disconnected()
+
+    def session(self):
+        self.reply(f"220 {HOSTNAME} ESMTP")
+        recipients = []
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode("utf-8", "replace").rstrip("\r\n").partition(" ")
+            command = command.upper()
+
+            if command == "EHLO":
+                self.reply(f"250-{HOSTNAME}\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250-SMTPUTF8\r\n250 SIZE 52428800")
+            elif command == "HELO":
+                self.reply(f"250 {HOSTNAME}")
+            elif command == "AUTH":
+                mechanism, _, initial = arg.partition(" ")
+                if mechanism.upper() == "LOGIN":
+                    self.reply("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                elif not initial:
+                    self.reply("334 ")
+                    self.rfile.readline()
+                self.reply("235 2.7.0 Authentication successful")
+            elif command == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                address = arg.partition(":")[2].strip().strip("<>")
+                code = self.server.refuse.get(address)
+                if code:
+                    self.reply(f"{code} Recipient refused")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self.read_data()
+                self.server.stats.received(recipients, data)
+                recipients = []
+                self.reply("250 OK queued")
+            elif command == "RSET":
+                recipients = []
+                self.reply("250 OK")
+            elif command == "NOOP":
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            elif command == "STARTTLS":
+                self.reply("454 TLS not available")
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                return b"".join(lines)
+            if line.startswith(b".."):
+                line = line[1:]
+            lines.append(line)
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    sink = SMTPSink(port=0).start()   # port 0 picks a free port
+    ... send to sink.host, sink.port ...
+    sink.stop()
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, keep=0, refuse=None):
+        super().__init__((host, port), SMTPHandler)
+        self.latency = latency
+        self.refuse = refuse or {}
+        self.stats = SinkStats(keep)
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -9,8 +9,21 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/wsgi/
 
 import os
 
+from django.apps import apps
+from django.core.cache import caches
 from django.core.wsgi import get_wsgi_application
+from django.db import connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fixdesk.settings')
 
 application = get_wsgi_application()
+
+# Decode the master key and unwrap live DEKs at worker boot, not on the first request
+for label in ("fixdesk_api", "rugby"):
+    apps.get_app_config(label).warm_up()
+
+# With `gunicorn --preload` this module is imported once in the master and
+# forked; the keys stay warm in every worker, but the DB and cache sockets
+# warm_up opened must not be shared, so each worker reconnects on first use.
+connections.close_all()
+caches.close_all()
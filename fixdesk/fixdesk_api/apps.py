@@ -3,3 +3,33 @@ from django.apps import AppConfig
 
 class fixdeskApiConfig(AppConfig):
     name = 'fixdesk_api'
+
+    def ready(self):
+        from celery.signals import worker_init, worker_process_init
+
+        from . import tasks  # registers the notification templates (checked at startup)
+
+        # Prefork children are recycled every worker_max_tasks_per_child tasks;
+        # unwrap the keyring and compile the notification templates in each new
+        # child before it picks up work.
+        worker_process_init.connect(self.warm_up, weak=False, dispatch_uid="fixdesk_api.warm_up")
+        # The threads and solo pools run tasks in the main worker process,
+        # where worker_process_init never fires
+        worker_init.connect(self.warm_up_worker, weak=False, dispatch_uid="fixdesk_api.warm_up_worker")
+
+    def warm_up(self, **kwargs):
+        from fixdesk.utils import mail_templates
+        from .keys import warm_up
+
+        warm_up()
+        mail_templates.warm_up()
+
+    def warm_up_worker(self, **kwargs):
+        from django.core.cache import caches
+        from django.db import connections
+
+        self.warm_up()
+        # Prefork children are forked from this process after it; like
+        # wsgi.py, don't let them share the sockets warm_up opened
+        connections.close_all()
+        caches.close_all()
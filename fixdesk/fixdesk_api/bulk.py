@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import models
+
+from .fields import encrypted_fields
+from .keys import get_cipher
+from fixdesk.utils import metrics
+
+MAX_WORKERS = 4
+CHUNK_SIZE = 500
+
+# Below this many values a chunk is decrypted inline; thread hand-off costs more
+PARALLEL_MIN_VALUES = 64
+
+_bulk_decrypts = metrics.Metric("crypto.bulk_decrypt")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="decrypt")
+    return _executor
+
+
+def _decrypt_slice(jobs):
+    return [field.decode(cipher.decrypt(nonce, ct, aad), flags) for field, cipher, nonce, ct, aad, flags in jobs]
+
+
+def decrypt_values(items, max_workers=MAX_WORKERS):
+    """
+    Decrypts [(field, raw), ...] and returns the plaintexts in order (None
+    stays None). Values are grouped by key version so each cipher is looked
+    up once, then split across the shared thread pool.
+    """
+    start = time.perf_counter()
+    ciphers = {}
+    jobs = []
+    positions = []
+
+    for i, (field, raw) in enumerate(items):
+        if raw is None:
+            continue
+        version, nonce, ct, aad, flags = field.unpack(bytes(raw))
+        cipher = ciphers.get(version)
+        if cipher is None:
+            cipher = ciphers[version] = get_cipher(version)
+        jobs.append((field, cipher, nonce, ct, aad, flags))
+        positions.append(i)
+
+    results = [None] * len(items)
+
+    if len(jobs) < PARALLEL_MIN_VALUES or max_workers <= 1:
+        plaintexts = _decrypt_slice(jobs)
+    else:
+        step = -(-len(jobs) // max_workers)
+        slices = [jobs[i:i + step] for i in range(0, len(jobs), step)]
+        plaintexts = [pt for part in _get_executor().map(_decrypt_slice, slices) for pt in part]
+
+    for i, pt in zip(positions, plaintexts):
+        results[i] = pt
+
+    # Recorded here, in the caller's thread, so per-request totals see it
+    _bulk_decrypts.observe(time.perf_counter() - start)
+    for name, n in Counter(job[0].metric_field for job in jobs).items():
+        metrics.incr("crypto.bulk_decrypt.values", n, field=name)
+
+    return results
+
+
+def decrypt_bulk(queryset, fields=None, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS):
+    """
+    Iterates queryset like .iterator(), but loads encrypted fields as raw
+    ciphertext and decrypts each chunk in parallel with decrypt_values().
+    fields limits which encrypted fields are decrypted (default: all).
+    """
+    model = queryset.model
+    fields = [f for f in encrypted_fields(model) if fields is None or f.name in fields]
+    if not fields:
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    raw = {f"_raw_{f.name}": models.ExpressionWrapper(models.F(f.name), output_field=models.BinaryField()) for f in fields}
+    qs = queryset.defer(*[f.name for f in fields]).annotate(**raw)
+
+    chunk = []
+    for obj in qs.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield from _decrypt_chunk(chunk, fields, max_workers)
+            chunk = []
+
+    if chunk:
+        yield from _decrypt_chunk(chunk, fields, max_workers)
+
+
+def _decrypt_chunk(chunk, fields, max_workers):
+    items = [(f, obj.__dict__.pop(f"_raw_{f.name}")) for obj in chunk for f in fields]
+    plaintexts = iter(decrypt_values(items, max_workers=max_workers))
+
+    for obj in chunk:
+        for f in fields:
+            obj.__dict__[f.attname] = next(plaintexts)
+
+    return chunk
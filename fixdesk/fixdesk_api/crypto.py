@@ -1,4 +1,6 @@
 import os
+import hmac
+import hashlib
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 DEK_BYTES = 32
@@ -10,10 +12,17 @@ def new_dek() -> bytes:
 def new_nonce() -> bytes:
     return os.urandom(NONCE_BYTES)
 
-def encrypt_aead(dek: bytes, plaintext: bytes, *, aad: bytes) -> tuple[bytes, bytes]:
+def _aead(key) -> AESGCM:
+    # Accept a ready AESGCM (see keys.get_cipher) so hot paths skip the key schedule
+    return key if isinstance(key, AESGCM) else AESGCM(key)
+
+def encrypt_aead(dek, plaintext: bytes, *, aad: bytes) -> tuple[bytes, bytes]:
     nonce = new_nonce()
-    ct = AESGCM(dek).encrypt(nonce, plaintext, aad)
+    ct = _aead(dek).encrypt(nonce, plaintext, aad)
     return ct, nonce
 
-def decrypt_aead(dek: bytes, ciphertext: bytes, *, nonce: bytes, aad: bytes) -> bytes:
-    return AESGCM(dek).decrypt(nonce, ciphertext, aad)
+def decrypt_aead(dek, ciphertext: bytes, *, nonce: bytes, aad: bytes) -> bytes:
+    return _aead(dek).decrypt(nonce, ciphertext, aad)
+
+def blind_index(key: bytes, data: bytes) -> str:
+    return hmac.new(key, data, hashlib.sha256).hexdigest()
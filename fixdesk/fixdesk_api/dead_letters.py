@@ -0,0 +1,60 @@
+"""
+What a mail task does when a send fails: transient failures (see
+fixdesk.utils.smtp.is_transient) are retried with exponential backoff and
+jitter up to the task's max_retries; anything else, or a transient failure
+that is still failing after the last retry, is stored as a DeadLetter.
+"""
+import logging
+
+from kombu.utils import json
+
+from fixdesk.utils import delivery, metrics, smtp
+
+from .models import DeadLetter
+
+logger = logging.getLogger(__name__)
+
+_retried = metrics.Metric("mail.failure", outcome="retry")
+_dead = metrics.Metric("mail.failure", outcome="dead_letter")
+
+
+def can_retry(task, error):
+    return smtp.is_transient(error) and task.request.retries < task.max_retries
+
+
+def retry(task, kwargs, error):
+    """Raises Retry; kwargs replace the original call's (e.g. fewer recipients)."""
+    _retried.incr()
+    raise task.retry(kwargs=kwargs, countdown=delivery.backoff(task.request.retries), exc=error)
+
+
+def record(task, kwargs, error, recipient=""):
+    _dead.incr()
+    logger.error("Giving up on %s to %s after %d attempt(s): %s", task.name, recipient, task.request.retries + 1, error)
+    return DeadLetter.objects.create(
+        task=task.name,
+        recipient=recipient,
+        payload=json.dumps(kwargs),
+        error=str(error),
+        attempts=task.request.retries + 1,
+    )
+
+
+def fail_each(task, failures, kwargs_for):
+    """
+    For tasks that send to several addresses. failures maps address ->
+    error (see fixdesk.utils.smtp.failures) and kwargs_for(addresses) gives
+    the task's kwargs narrowed to those addresses. Permanent failures are
+    dead-lettered one address each; transient ones are retried together.
+    """
+    retry_addresses, retry_error = [], None
+    for address, error in failures.items():
+        if can_retry(task, error):
+            retry_addresses.append(address)
+            retry_error = error
+        else:
+            record(task, kwargs_for([address]), error, address)
+
+    if retry_addresses:
+        retry(task, kwargs_for(retry_addresses), retry_error)
+
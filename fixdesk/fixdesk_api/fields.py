@@ -1,57 +1,264 @@
 import struct
+import time
+import unicodedata
+import zlib
 from django.db import models
-from .crypto import encrypt_aead, decrypt_aead
-from .keys import get_current_version, get_dek
+from django.utils.functional import SimpleLazyObject, cached_property
+from .crypto import encrypt_aead, decrypt_aead, blind_index
+from .keys import get_current_version, get_cipher, get_index_key
+from fixdesk.utils import metrics
+
+# Stored layouts:
+#   legacy:   version (2 bytes) + nonce (12 bytes) + ciphertext
+#   envelope: magic (1) + flags (1) + version (2, or 4 with FLAG_WIDE_VERSION) + nonce (12) + ciphertext
+# A legacy value only starts with the magic byte from key version 0xE100 on.
+ENVELOPE_MAGIC = 0xE1
+FLAG_ZLIB = 0x01
+FLAG_WIDE_VERSION = 0x02  # versions are shared by all tenant keyrings and can pass 0xFFFF
+
+
+def normalize_text(value: str) -> str:
+    # Case-, width- and whitespace-insensitive form used by blind indexes
+    return " ".join(unicodedata.normalize("NFKC", value).casefold().split())
+
+
+def encrypted_fields(model):
+    # EncryptedTextField is duplicated per app, so match on behaviour
+    return [
+        f for f in model._meta.concrete_fields
+        if isinstance(f, models.BinaryField) and hasattr(f, "decrypt")
+    ]
+
+
+class EncryptedText(SimpleLazyObject):
+    """
+    String proxy returned by lazy EncryptedTextFields.
+    Decrypts on first use and memoizes; keeps the stored ciphertext so an
+    untouched value is written back as-is instead of being re-encrypted.
+    """
+
+    def __init__(self, field, ciphertext):
+        self.__dict__["ciphertext"] = ciphertext
+        self.__dict__["aad"] = field.aad
+        super().__init__(lambda: field.decrypt(ciphertext))
+
+    def __getattr__(self, name):
+        # The value is always a str, so attributes str lacks can be ruled out
+        # without decrypting (Django's save checks hasattr(value, "resolve_expression"))
+        if not hasattr(str, name):
+            raise AttributeError(name)
+        return super().__getattr__(name)
 
 
 class EncryptedTextField(models.BinaryField):
+    """
+    With tenant_field set (name of a ForeignKey to the tenant), values are
+    encrypted on save under that tenant's keyring; otherwise, and for rows
+    without a tenant, under the global one. Writes that skip pre_save
+    (QuerySet.update, bulk_update) use the global keyring.
+    """
     description = "AES-GCM encrypted text"
 
-    def get_prep_value(self, value):
-        if value is None:
-            return value
+    # "Model.field" tag for metrics; rebound once the field is bound to a model
+    metric_field = None
+    encrypt_metric = metrics.Metric("crypto.encrypt", field=None)
+    decrypt_metric = metrics.Metric("crypto.decrypt", field=None)
 
-        # Already encrypted (loading case)
-        if isinstance(value, (bytes, bytearray)):
-            return value
+    def __init__(self, *args, lazy=False, compress_over=None, tenant_field=None, **kwargs):
+        self.lazy = lazy
+        # Plaintexts of at least this many bytes are zlib-compressed first
+        self.compress_over = compress_over
+        self.tenant_field = tenant_field
+        super().__init__(*args, **kwargs)
 
-        version = get_current_version()
-        dek = get_dek(version)
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.lazy:
+            kwargs["lazy"] = True
+        if self.compress_over is not None:
+            kwargs["compress_over"] = self.compress_over
+        if self.tenant_field is not None:
+            kwargs["tenant_field"] = self.tenant_field
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super().contribute_to_class(cls, name, *args, **kwargs)
 
         # AAD binds to model + field
-        aad = f"{self.model.__name__}:{self.name}".encode()
+        self.aad = f"{self.model.__name__}:{self.name}".encode()
+        self.metric_field = f"{self.model.__name__}.{self.name}"
+        self.encrypt_metric = metrics.Metric("crypto.encrypt", field=self.metric_field)
+        self.decrypt_metric = metrics.Metric("crypto.decrypt", field=self.metric_field)
 
-        ciphertext, nonce = encrypt_aead(
-            dek,
-            value.encode("utf-8"),
-            aad=aad,
-        )
+    @cached_property
+    def tenant_attname(self):
+        return self.model._meta.get_field(self.tenant_field).attname
 
-        # Pack: version (2 bytes) + nonce (12 bytes) + ciphertext
-        return struct.pack(">H", version) + nonce + ciphertext
+    @staticmethod
+    def key_version(value) -> int:
+        if value[0] != ENVELOPE_MAGIC:
+            return struct.unpack(">H", value[:2])[0]
+        if value[1] & FLAG_WIDE_VERSION:
+            return struct.unpack(">I", value[2:6])[0]
+        return struct.unpack(">H", value[2:4])[0]
 
-    def from_db_value(self, value, expression, connection):
-        if value is None:
-            return value
+    def unpack(self, value):
+        """
+        Splits a stored value into (version, nonce, ciphertext, aad, flags).
+        Envelope flags are bound into the AAD so they cannot be flipped.
+        """
+        if value[0] == ENVELOPE_MAGIC:
+            flags = value[1]
+            aad = self.aad + bytes((ENVELOPE_MAGIC, flags))
+            if flags & FLAG_WIDE_VERSION:
+                version = struct.unpack(">I", value[2:6])[0]
+                return version, value[6:18], value[18:], aad, flags
+            version = struct.unpack(">H", value[2:4])[0]
+            return version, value[4:16], value[16:], aad, flags
 
         version = struct.unpack(">H", value[:2])[0]
-        nonce = value[2:14]
-        ciphertext = value[14:]
+        return version, value[2:14], value[14:], self.aad, 0
+
+    @staticmethod
+    def decode(plaintext: bytes, flags: int) -> str:
+        if flags & FLAG_ZLIB:
+            plaintext = zlib.decompress(plaintext)
+        return plaintext.decode("utf-8")
+
+    def encrypt(self, value: str, version: int = None) -> bytes:
+        start = time.perf_counter()
+        if version is None:
+            version = get_current_version()
 
-        dek = get_dek(version)
+        data = value.encode("utf-8")
+        flags = 0
 
-        aad = f"{self.model.__name__}:{self.name}".encode()
+        if self.compress_over is not None and len(data) >= self.compress_over:
+            packed = zlib.compress(data)
+            if len(packed) < len(data):
+                data, flags = packed, FLAG_ZLIB
+
+        if version > 0xFFFF:
+            flags |= FLAG_WIDE_VERSION
+            header = struct.pack(">BBI", ENVELOPE_MAGIC, flags, version)
+        else:
+            header = struct.pack(">BBH", ENVELOPE_MAGIC, flags, version)
+
+        ciphertext, nonce = encrypt_aead(
+            get_cipher(version),
+            data,
+            aad=self.aad + bytes((ENVELOPE_MAGIC, flags)),
+        )
+
+        self.encrypt_metric.observe(time.perf_counter() - start)
+        return header + nonce + ciphertext
+
+    def decrypt(self, value) -> str:
+        start = time.perf_counter()
+        version, nonce, ciphertext, aad, flags = self.unpack(value)
 
         plaintext = decrypt_aead(
-            dek,
+            get_cipher(version),
             ciphertext,
             nonce=nonce,
             aad=aad,
         )
 
-        return plaintext.decode("utf-8")
+        text = self.decode(plaintext, flags)
+        self.decrypt_metric.observe(time.perf_counter() - start)
+        return text
+
+    def pre_save(self, model_instance, add):
+        value = super().pre_save(model_instance, add)
+        if self.tenant_field is None or value is None:
+            return value
+
+        # Stored ciphertext (or untouched lazy value) goes through get_prep_value as-is
+        if type(value) is EncryptedText or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+
+        tenant = getattr(model_instance, self.tenant_attname)
+        return self.encrypt(str(value), get_current_version(tenant))
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+
+        # Unread (or unchanged) lazy value: keep the stored ciphertext
+        if type(value) is EncryptedText and value.aad == self.aad:
+            return bytes(value.ciphertext)
+
+        # Already encrypted (loading case)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+
+        return self.encrypt(str(value))
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+
+        if self.lazy:
+            return EncryptedText(self, value)
+
+        return self.decrypt(value)
 
     def to_python(self, value):
         if isinstance(value, str) or value is None:
             return value
         return self.from_db_value(value, None, None)
+
+
+class BlindIndexField(models.CharField):
+    """
+    Keyed HMAC of an EncryptedTextField on the same model, kept up to date on
+    save. With prefix_length set, only the first N normalized characters are
+    indexed, which supports startswith lookups (see filters.BlindIndexFilter).
+    """
+    description = "Blind index of an encrypted field"
+
+    def __init__(self, *args, source=None, prefix_length=None, **kwargs):
+        self.source = source
+        self.prefix_length = prefix_length
+        kwargs.setdefault("max_length", 64)
+        kwargs.setdefault("null", True)
+        kwargs.setdefault("blank", True)
+        kwargs.setdefault("editable", False)
+        kwargs.setdefault("db_index", True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["source"] = self.source
+        if self.prefix_length:
+            kwargs["prefix_length"] = self.prefix_length
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super().contribute_to_class(cls, name, *args, **kwargs)
+
+        # Label keeps indexes of different columns unlinkable
+        self.label = f"{self.model.__name__}:{self.source}"
+        if self.prefix_length:
+            self.label += f":p{self.prefix_length}"
+
+    def index_value(self, value):
+        if value is None:
+            return None
+
+        text = normalize_text(str(value))
+        if self.prefix_length:
+            text = text[:self.prefix_length]
+
+        return blind_index(get_index_key(), f"{self.label}:{text}".encode("utf-8"))
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.source)
+
+        # Untouched lazy value: the stored index is still valid, skip decrypting
+        if type(value) is EncryptedText and self.attname in model_instance.__dict__:
+            return getattr(model_instance, self.attname)
+
+        index = self.index_value(value)
+        setattr(model_instance, self.attname, index)
+        return index
@@ -0,0 +1,80 @@
+from django.core.exceptions import ValidationError
+from django_filters import rest_framework as filters
+from django_filters.constants import EMPTY_VALUES
+
+from .fields import normalize_text
+from .models import User, Organization
+
+
+class BlindIndexFilter(filters.CharFilter):
+    """
+    Filters an encrypted field through its BlindIndexField (field_name).
+    Exact indexes give equality; prefix indexes give startswith, narrowed by
+    the index and then checked against the decrypted candidates.
+
+    A prefix index only holds the first prefix_length normalized characters
+    (3 for the filters below), so it cannot narrow anything shorter: such a
+    value fails validation and the API answers 400.
+    """
+
+    @property
+    def field(self):
+        if not hasattr(self, "_field"):
+            prefix_length = self.model._meta.get_field(self.field_name).prefix_length
+            if prefix_length:
+                self.extra["validators"] = [*self.extra.get("validators", ()), self._min_length(prefix_length)]
+        return super().field
+
+    @staticmethod
+    def _min_length(prefix_length):
+        def validate(value):
+            if len(normalize_text(value)) < prefix_length:
+                raise ValidationError(
+                    "Enter at least %(limit)d characters to search by prefix.",
+                    code="min_length",
+                    params={"limit": prefix_length},
+                )
+        return validate
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+
+        index = qs.model._meta.get_field(self.field_name)
+
+        if not index.prefix_length:
+            return qs.filter(**{index.name: index.index_value(value)})
+
+        text = normalize_text(value)
+        # Already rejected by the form field when used through a FilterSet
+        self._min_length(index.prefix_length)(text)
+
+        candidates = qs.filter(**{index.name: index.index_value(text)})
+        if len(text) == index.prefix_length:
+            return candidates
+
+        matches = [
+            pk for pk, source in candidates.values_list("pk", index.source)
+            if source is not None and normalize_text(str(source)).startswith(text)
+        ]
+        return qs.filter(pk__in=matches)
+
+
+class OrganizationFilter(filters.FilterSet):
+    name = BlindIndexFilter(field_name="name_bidx")
+    name__startswith = BlindIndexFilter(field_name="name_prefix")
+
+    class Meta:
+        model = Organization
+        fields = ['slug']
+
+
+class UserFilter(filters.FilterSet):
+    first_name = BlindIndexFilter(field_name="first_name_bidx")
+    first_name__startswith = BlindIndexFilter(field_name="first_name_prefix")
+    last_name = BlindIndexFilter(field_name="last_name_bidx")
+    last_name__startswith = BlindIndexFilter(field_name="last_name_prefix")
+
+    class Meta:
+        model = User
+        fields = ['email']
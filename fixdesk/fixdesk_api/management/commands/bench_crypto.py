@@ -0,0 +1,122 @@
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from fixdesk.utils.benchmark import BenchmarkCommand, measure
+from fixdesk_api import keys
+from fixdesk_api.bulk import decrypt_bulk
+from fixdesk_api.fields import EncryptedTextField
+from fixdesk_api.models import User
+from fixdesk_api.rotation import reencrypt_model
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Benchmark the encryption hot path (field, row, 25-row page, cold/warm DEK cache, "
+        "rotation re-encrypt) against the configured database. All rows are rolled back."
+    )
+    suite = "crypto"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--rows", type=int, default=500, help="Users to create for page/rotation cases.")
+        parser.add_argument("--number", type=int, default=200, help="Calls per timing round.")
+        parser.add_argument("--skip-rotation", action="store_true", help="Skip the rotation re-encrypt case.")
+
+    def run(self, **options):
+        number = options["number"]
+        results = {}
+
+        first_name = User._meta.get_field("first_name")
+        last_name = User._meta.get_field("last_name")
+        index_fields = [User._meta.get_field(n) for n in ("first_name_bidx", "first_name_prefix", "last_name_bidx", "last_name_prefix")]
+
+        raw = first_name.encrypt("Adaeze")
+        version = first_name.key_version(raw)
+        # Unbound field standing in for a long free-text column
+        long_field = EncryptedTextField(compress_over=256)
+        long_field.aad = b"Bench:long_text"
+        long_text = "The projector in the main hall keeps flickering during assembly. " * 40
+        long_raw = long_field.encrypt(long_text)
+
+        # Field level (warm cache)
+        results["field.encrypt"] = measure(lambda: first_name.encrypt("Adaeze"), number=number)
+        results["field.decrypt"] = measure(lambda: first_name.decrypt(raw), number=number)
+        results["field.encrypt_long_compressed"] = measure(lambda: long_field.encrypt(long_text), number=number)
+        results["field.decrypt_long_compressed"] = measure(lambda: long_field.decrypt(long_raw), number=number)
+
+        # Row level: both names plus their blind indexes, as User.save() does
+        def encrypt_row():
+            first_name.encrypt("Adaeze")
+            last_name.encrypt("Okafor")
+            for f in index_fields:
+                f.index_value("Adaeze")
+
+        row_raw = (first_name.encrypt("Adaeze"), last_name.encrypt("Okafor"))
+        results["row.encrypt"] = measure(encrypt_row, number=number)
+        results["row.decrypt"] = measure(lambda: (first_name.decrypt(row_raw[0]), last_name.decrypt(row_raw[1])), number=number)
+
+        # DEK cache: cold drops both the process-local and the shared cache
+        def drop_caches():
+            keys.clear_local_cache()
+            cache.delete(keys._cache_key(version))
+
+        results["dek.cold"] = measure(lambda: keys.get_cipher(version), number=max(1, number // 10), setup=drop_caches)
+        keys.get_cipher(version)
+        results["dek.warm"] = measure(lambda: keys.get_cipher(version), number=number)
+
+        with transaction.atomic():
+            tag = uuid.uuid4().hex[:8]
+            User.objects.bulk_create([
+                User(email=f"bench-{tag}-{i}@example.com", first_name=f"First{i}", last_name=f"Last{i}")
+                for i in range(options["rows"])
+            ])
+            qs = User.objects.filter(email__startswith=f"bench-{tag}-").order_by("email")
+
+            def page():
+                for u in qs[:25]:
+                    str(u.first_name)
+                    str(u.last_name)
+
+            def page_bulk():
+                for u in decrypt_bulk(qs[:25]):
+                    pass
+
+            results["page25.load_and_decrypt"] = measure(page, number=max(1, number // 10))
+            results["page25.decrypt_bulk"] = measure(page_bulk, number=max(1, number // 10))
+            results["page25.load_only"] = measure(lambda: list(qs[:25]), number=max(1, number // 10))
+
+            if not options["skip_rotation"]:
+                results["rotation.reencrypt_row"] = self._rotation()
+
+            transaction.set_rollback(True)
+
+        return results
+
+    def _rotation(self):
+        # Runs inside the rolled-back transaction, so the new version never
+        # commits; drop anything cached for it afterwards. Its cipher is
+        # unwrapped before timing, as a committed rotation's would be by
+        # warm_up(), so the case measures re-encryption rather than one
+        # Keyring query and unwrap per row.
+        new_version = keys.rotate_key()
+        keys.get_cipher(new_version)
+        try:
+            start = time.perf_counter()
+            cp = reencrypt_model(User, target_version=new_version, restart=True)
+            elapsed = time.perf_counter() - start
+        finally:
+            cache.delete(keys._cache_key(new_version))
+            cache.delete(keys.CURRENT_VERSION_KEY)
+            keys.clear_local_cache()
+
+        per_row = elapsed / max(1, cp.rows_scanned)
+        return {
+            "us_per_op": round(per_row * 1e6, 3),
+            "median_us_per_op": round(per_row * 1e6, 3),
+            "ops_per_sec": round(1 / per_row, 1) if per_row else None,
+            "number": cp.rows_scanned,
+            "repeat": 1,
+        }
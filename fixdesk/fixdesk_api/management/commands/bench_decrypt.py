@@ -0,0 +1,69 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from fixdesk_api.bulk import decrypt_values, decrypt_bulk, MAX_WORKERS
+from fixdesk_api.models import User
+
+
+class Command(BaseCommand):
+    help = "Compare per-row decryption with the parallel bulk path (bulk.decrypt_values / decrypt_bulk)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--values", type=int, default=20000, help="Ciphertexts to decrypt in memory.")
+        parser.add_argument("--size", type=int, default=32, help="Plaintext size in bytes.")
+        parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+        parser.add_argument("--rows", type=int, default=0, help="Also time a queryset of this many users (rolled back).")
+
+    def handle(self, *args, **options):
+        field = User._meta.get_field("first_name")
+        raws = [field.encrypt("x" * options["size"]) for _ in range(options["values"])]
+        items = [(field, raw) for raw in raws]
+
+        serial = self._time(lambda: [field.decrypt(raw) for raw in raws])
+        single = self._time(lambda: decrypt_values(items, max_workers=1))
+        parallel = self._time(lambda: decrypt_values(items, max_workers=options["workers"]))
+
+        n = len(raws)
+        self.stdout.write(f"{n} values of {options['size']} bytes")
+        self.stdout.write(f"  per-row field.decrypt : {n / serial:12.0f} values/s")
+        self.stdout.write(f"  decrypt_values (1)    : {n / single:12.0f} values/s")
+        self.stdout.write(f"  decrypt_values ({options['workers']})    : {n / parallel:12.0f} values/s  ({serial / parallel:.2f}x)")
+
+        if options["rows"]:
+            self._bench_queryset(options["rows"], options["workers"])
+
+    def _bench_queryset(self, rows, workers):
+        with transaction.atomic():
+            tag = uuid.uuid4().hex[:8]
+            User.objects.bulk_create([
+                User(email=f"bench-{tag}-{i}@example.com", first_name=f"First{i}", last_name=f"Last{i}")
+                for i in range(rows)
+            ])
+            qs = User.objects.filter(email__startswith=f"bench-{tag}-")
+
+            def per_row():
+                for u in qs.iterator(chunk_size=500):
+                    str(u.first_name)
+                    str(u.last_name)
+
+            def bulk():
+                for u in decrypt_bulk(qs, max_workers=workers):
+                    pass
+
+            serial = self._time(per_row)
+            parallel = self._time(bulk)
+
+            self.stdout.write(f"{rows} users, 2 encrypted fields each")
+            self.stdout.write(f"  per-row iteration     : {rows / serial:12.0f} rows/s")
+            self.stdout.write(f"  decrypt_bulk ({workers})      : {rows / parallel:12.0f} rows/s  ({serial / parallel:.2f}x)")
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _time(fn):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
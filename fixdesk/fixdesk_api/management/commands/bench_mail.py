@@ -0,0 +1,165 @@
+import os
+import random
+import time
+import uuid
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from fixdesk.utils import smtp
+from fixdesk.utils.benchmark import BenchmarkCommand, percentile
+from fixdesk.utils.smtp_sink import SMTPSink
+from fixdesk_api.models import Comments, Organization, Tasks, User, VerificationCode
+from fixdesk_api.tasks import notify
+from rugby import tasks as rugby_tasks
+from rugby.models import Milestone
+
+
+def _emails(prefix, n):
+    return [f"{prefix}{i}@bench.fixdesk.ng" for i in range(n)]
+
+
+IT_DEPARTMENT = _emails("it", 40)
+TASK_TEAM = _emails("team", 10)
+
+
+def _seed():
+    """
+    The rows the events refer to, created in the caller's (rolled-back)
+    transactions: {event: ids}. Rugby's is a milestone, which has no user
+    foreign keys, so the rugby database can be a separate SQLite file.
+    """
+    tag = uuid.uuid4().hex[:8]
+    organization = Organization.objects.create(name="Bench", slug=f"bench-{tag}")
+
+    def user(email):
+        return User.objects.create(email=f"{tag}-{email}", first_name="Bench", last_name="User", organization=organization)
+
+    team = [user(email) for email in TASK_TEAM]
+    commenter = user("commenter@bench.fixdesk.ng")
+    task = Tasks.objects.create(organization=organization, title="Replace the projector", description="Main hall", assigned_by=commenter)
+    task.assigned_to.set(team)
+    comment = Comments.objects.create(organization=organization, task=task, message="Parts arrive Monday", commenter=commenter)
+    code = VerificationCode.objects.create(user=team[0], code=tag[:6])
+    milestone = Milestone.objects.create(title="Term starts")
+
+    return {
+        "comment.created": {"comment_id": str(comment.id)},
+        "verification.created": {"verification_code_id": str(code.id)},
+        "milestone.created": {"milestone_id": str(milestone.id)},
+    }
+
+
+def milestone_creation(ids):
+    # rugby: one message addressed to the whole IT department
+    rugby_tasks.send_event.apply(kwargs={
+        "event": "milestone.created",
+        "ids": ids["milestone.created"],
+        "to_email": IT_DEPARTMENT,
+        "type": "milestone",
+        "action": "creation",
+    }).get()
+    return 1
+
+
+def comment(ids):
+    # fixdesk_api: one message per assignee, rendered once
+    notify.apply(kwargs={"event": "comment.created", "ids": ids["comment.created"]}).get()
+    return len(TASK_TEAM)
+
+
+def verification(ids):
+    notify.apply(kwargs={"event": "verification.created", "ids": ids["verification.created"]}).get()
+    return 1
+
+
+# name -> [(weight, event)]
+SCENARIOS = {
+    "milestone_creation.it40": [(1, milestone_creation)],
+    "comment_storm.team10": [(1, comment)],
+    "verification": [(1, verification)],
+    "mixed": [(2, milestone_creation), (6, comment), (2, verification)],
+}
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Replay notification event mixes through the real mail tasks, hydrating each event "
+        "from rows created in a rolled-back transaction, against a local SMTP sink and "
+        "report messages/sec, per-event latency and SMTP connections opened."
+    )
+    suite = "mail"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--events", type=int, default=200, help="Events per scenario.")
+        parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Run only these (repeatable).")
+        parser.add_argument("--latency", type=float, default=0, help="Sink reply delay in ms, to stand in for a remote provider.")
+        parser.add_argument("--concurrency", type=int, default=None, help="Override MAIL_DELIVERY_CONCURRENCY.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def run(self, **options):
+        sink = SMTPSink(latency=options["latency"] / 1000).start()
+        overrides = {"SMTP_SERVER": sink.host, "SMTP_PORT": str(sink.port), "SMTP_STARTTLS": "false", "EMAIL_USER": "bench"}
+        saved = {key: os.environ.get(key) for key in overrides}
+        os.environ.update(overrides)
+
+        overridden = {"MAIL_RATE_LIMITS": {}}
+        if options["concurrency"]:
+            overridden["MAIL_DELIVERY_CONCURRENCY"] = options["concurrency"]
+
+        try:
+            rng = random.Random(options["seed"])
+            with override_settings(**overridden), transaction.atomic(), transaction.atomic(using="rugby"):
+                ids = _seed()
+                results = {
+                    name: self._scenario(sink, SCENARIOS[name], options["events"], rng, ids)
+                    for name in options["scenario"] or SCENARIOS
+                }
+                transaction.set_rollback(True, using="rugby")
+                transaction.set_rollback(True)
+                return results
+        finally:
+            smtp.close_all()
+            sink.stop()
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    def _scenario(self, sink, mix, events, rng, ids):
+        weights, handlers = zip(*mix)
+        plan = rng.choices(handlers, weights=weights, k=events)
+
+        # Start every scenario with an empty pool so connection counts are comparable
+        smtp.close_all()
+        sink.stats.reset()
+
+        latencies = []
+        messages = 0
+        start = time.perf_counter()
+        for event in plan:
+            t = time.perf_counter()
+            messages += event(ids)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+
+        stats = sink.stats.snapshot()
+        if stats["messages"] != messages:
+            raise CommandError(f"Sink received {stats['messages']} of {messages} messages")
+
+        per_message = elapsed / messages
+        return {
+            "us_per_op": round(per_message * 1e6, 3),
+            "median_us_per_op": round(per_message * 1e6, 3),
+            "ops_per_sec": round(messages / elapsed, 1),
+            "number": events,
+            "repeat": 1,
+            "messages": messages,
+            "recipients": stats["recipients"],
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "connections": stats["connections"],
+        }
@@ -0,0 +1,102 @@
+import uuid
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from fixdesk.utils.benchmark import BenchmarkCommand, measure
+from fixdesk_api.models import User
+from rugby import recipients, routing
+from rugby.approval_matrix import approval_matrix, attach_approvers_to_approval_info, extract_approval_emails
+from rugby.inclusion_matrix import users_inclusion_matrix
+
+DEPARTMENTS = (
+    "Non-Academic - IT",
+    "Non-Academic - HR",
+    "Non-Academic - Accounting",
+    "Non-Academic - Procurement",
+    "Senior Leadership Team",
+    "facilities",
+    "Mathematics",
+    "Sciences",
+)
+
+# (subject, action, requester department, requester role); events routed by
+# department only, so no per-object query is involved
+EVENTS = (
+    ("issue", "creation", "Mathematics", "staff"),
+    ("issue", "comment", "Non-Academic - IT", "team_lead"),
+    ("issue", "status_change", "Sciences", "staff"),
+    ("leaverequest", "creation", "Mathematics", "staff"),
+    ("leaverequest", "comment", "Non-Academic - HR", "team_lead"),
+    ("facilityrequest", "creation", "Sciences", "staff"),
+    ("procurementrequest", "status_change", "Mathematics", "team_lead"),
+)
+
+APPROVALS = (
+    ("leaverequest", "Mathematics", "staff"),
+    ("procurementrequest", "Non-Academic - Procurement", "staff"),
+)
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Benchmark notification routing: rule compilation, recipient index build, and "
+        "per-event inclusion and approval resolution. All rows are rolled back."
+    )
+    suite = "routing"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--users", type=int, default=400, help="Users to spread across the departments.")
+        parser.add_argument("--number", type=int, default=1000, help="Calls per timing round.")
+
+    def run(self, **options):
+        number = options["number"]
+        results = {}
+
+        results["rules.compile"] = measure(routing.load, number=max(1, number // 100))
+
+        with transaction.atomic():
+            tag = uuid.uuid4().hex[:8]
+            users = [
+                User(
+                    email=f"bench-{tag}-{i}@example.com",
+                    department=DEPARTMENTS[i % len(DEPARTMENTS)],
+                    role="team_lead" if i % 10 == 0 else "staff",
+                )
+                for i in range(options["users"])
+            ]
+            User.objects.bulk_create(users)
+            # bulk_create sends no post_save
+            recipients.invalidate()
+
+            results["index.build"] = measure(recipients.get_index, number=max(1, number // 100), setup=recipients.invalidate)
+            recipients.get_index()
+
+            requester = users[1]
+            for subject, action, department, role in EVENTS:
+                def route():
+                    return users_inclusion_matrix(requester.email, User, role, department, subject, action)
+                results[f"inclusion.{subject}.{action}"] = self._case(route, number)
+
+            for subject, department, role in APPROVALS:
+                requester = User(email=f"bench-{tag}-requester@example.com", department=department, role=role)
+
+                def approve():
+                    approval_info, _ = approval_matrix(subject, role, department)
+                    return extract_approval_emails(attach_approvers_to_approval_info(approval_info, requester, User))
+                results[f"approval.{subject}"] = self._case(approve, number)
+
+            transaction.set_rollback(True)
+
+        recipients.invalidate()
+        return results
+
+    def _case(self, fn, number):
+        fn()
+        with CaptureQueriesContext(connection) as queries:
+            recipients_found = fn()
+        result = measure(fn, number=number)
+        result["queries"] = len(queries)
+        result["recipients"] = len(recipients_found)
+        return result
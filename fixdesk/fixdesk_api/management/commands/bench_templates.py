@@ -0,0 +1,56 @@
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from fixdesk.utils import mail_templates
+from fixdesk.utils.benchmark import BenchmarkCommand, measure
+
+# Covers every variable the fixdesk_api and rugby notification templates use
+CONTEXT = {
+    'organization': "bench",
+    'id': "3f2",
+    'task_id': "TSK-3f2",
+    'user': "Adaeze Okafor",
+    'commenter': "Adaeze Okafor",
+    'comment': "Projector replaced, please confirm it works during assembly.",
+    'title': "Projector flickering in the main hall",
+    'description': "The projector in the main hall keeps flickering during assembly. " * 5,
+    'date': timezone.now(),
+    'due_date': timezone.now(),
+    'previous_status': "open",
+    'status': "in_progress",
+    'reported_by': "Chidi Nwosu",
+    'priority': "high",
+    'assigned_to': "Tunde Bello",
+    'action_url': "https://fixdesk.ng/bench",
+}
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Benchmark notification rendering: registry lookup plus render for every "
+        "registered template, against render_to_string with a fresh lookup."
+    )
+    suite = "templates"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--number", type=int, default=200, help="Renders per timing round.")
+
+    def run(self, **options):
+        number = options["number"]
+        registered = mail_templates.registered()
+        results = {}
+
+        mail_templates.clear()
+        results["registry.warm_up"] = measure(lambda: mail_templates.warm_up(), number=1, repeat=1, setup=mail_templates.clear)
+
+        for (app, type, action), name in sorted(registered.items(), key=lambda item: tuple(map(str, item[0]))):
+            case = ".".join(str(k) for k in (app, type, action) if k is not None)
+            results[f"registry.{case}"] = measure(lambda: mail_templates.render(app, type, action, CONTEXT), number=number)
+
+        # Baseline: what a render cost before the registry, for the largest template
+        app, type, action = max(registered, key=lambda key: len(mail_templates.render(*key, CONTEXT)))
+        results["render_to_string"] = measure(lambda: render_to_string(registered[(app, type, action)], CONTEXT), number=number)
+        results["registry"] = measure(lambda: mail_templates.render(app, type, action, CONTEXT), number=number)
+
+        return results
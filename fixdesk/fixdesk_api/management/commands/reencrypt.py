@@ -0,0 +1,72 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fixdesk_api.keys import rotate_key, get_current_version
+from fixdesk_api.models import Organization
+from fixdesk_api.rotation import reencrypt_all, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encrypt all EncryptedTextFields and SecretRecords under the current key version (resumable). "
+        "With --organization, only that tenant's keyring and rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organization", help="Organization id or slug; limits rotation and re-encryption to its keyring.")
+        parser.add_argument("--rotate", action="store_true", help="Rotate to a new key version first.")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--sleep", type=float, default=0, help="Seconds to pause between chunks.")
+        parser.add_argument("--max-seconds", type=float, default=None, help="Stop after this long; rerun to resume.")
+        parser.add_argument("--restart", action="store_true", help="Ignore saved checkpoints.")
+        parser.add_argument("--async", dest="run_async", action="store_true", help="Queue the Celery task instead.")
+
+    def _organization_id(self, value):
+        try:
+            lookup = {"pk": uuid.UUID(value)}
+        except ValueError:
+            lookup = {"slug": value}
+
+        org_id = Organization.objects.filter(**lookup).values_list("pk", flat=True).first()
+        if org_id is None:
+            raise CommandError(f"Organization {value!r} not found")
+        return org_id
+
+    def handle(self, *args, **options):
+        org_id = self._organization_id(options["organization"]) if options["organization"] else None
+        scope = f"organization {org_id}" if org_id else "global keyring"
+
+        if options["rotate"]:
+            self.stdout.write(f"Rotated {scope} to key version {rotate_key(org_id)}")
+
+        if options["run_async"]:
+            from fixdesk_api.tasks import reencrypt
+
+            result = reencrypt.apply_async(kwargs={
+                "organization_id": str(org_id) if org_id else None,
+                "chunk_size": options["chunk_size"],
+                "sleep": options["sleep"],
+            })
+            self.stdout.write(f"Queued re-encryption task {result.id}")
+            return
+
+        def progress(cp):
+            state = "done" if cp.completed_at else "running"
+            self.stdout.write(
+                f"{cp.label}: {cp.rows_scanned} scanned, {cp.rows_updated} re-encrypted -> v{cp.target_version} ({state})"
+            )
+
+        done = reencrypt_all(
+            organization_id=org_id,
+            chunk_size=options["chunk_size"],
+            sleep=options["sleep"],
+            max_seconds=options["max_seconds"],
+            restart=options["restart"],
+            progress=progress,
+        )
+
+        if done:
+            self.stdout.write(self.style.SUCCESS(f"All {scope} ciphertexts are on key version {get_current_version(org_id)}"))
+        else:
+            self.stdout.write(self.style.WARNING("Stopped early; run again to resume from the checkpoint"))
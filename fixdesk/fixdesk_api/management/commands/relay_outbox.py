@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fixdesk_api.models import OutboxMessage
+from fixdesk_api.outbox import BATCH_SIZE, relay
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish committed outbox rows to the broker. Runs once by default; "
+        "with --interval, keeps polling (for deployments without celery beat)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=None, help="Seconds between polls; runs until interrupted.")
+
+    def handle(self, *args, **options):
+        while True:
+            published = relay(options["batch_size"])
+            pending = OutboxMessage.objects.count()
+            if published or options["interval"] is None:
+                self.stdout.write(f"Published {published} message(s); {pending} pending")
+
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fixdesk.utils.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local SMTP sink that accepts and discards all mail, printing counts. "
+        "Point the app at it with SMTP_SERVER=127.0.0.1 SMTP_PORT=<port> SMTP_STARTTLS=false."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=1025)
+        parser.add_argument("--latency", type=float, default=0, help="Milliseconds to wait before each reply.")
+        parser.add_argument("--report-every", type=float, default=5, help="Seconds between stats lines.")
+
+    def handle(self, *args, **options):
+        sink = SMTPSink(options["host"], options["port"], latency=options["latency"] / 1000).start()
+        self.stdout.write(f"SMTP sink listening on {sink.host}:{sink.port}")
+
+        last = sink.stats.snapshot()
+        try:
+            while True:
+                time.sleep(options["report_every"])
+                now = sink.stats.snapshot()
+                if now != last:
+                    rate = (now["messages"] - last["messages"]) / options["report_every"]
+                    self.stdout.write(
+                        f"{now['messages']} messages to {now['recipients']} recipients over "
+                        f"{now['connections']} connections ({rate:.1f} msg/s)"
+                    )
+                    last = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.stop()
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:07
+
+import fixdesk_api.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixdesk_api', '0004_organization_allowed_email_domain_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='organization',
+            name='name',
+            field=fixdesk_api.fields.EncryptedTextField(lazy=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='first_name',
+            field=fixdesk_api.fields.EncryptedTextField(blank=True, lazy=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='last_name',
+            field=fixdesk_api.fields.EncryptedTextField(blank=True, lazy=True, null=True),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:08
+
+import fixdesk_api.fields
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+from fixdesk_api.crypto import decrypt_aead
+from fixdesk_api.keywrap_local import unwrap_dek
+
+
+def _deks(apps, db):
+    # The historical Keyring: the live one (and keys.get_dek) expects columns
+    # that later migrations add
+    Keyring = apps.get_model("fixdesk_api", "Keyring")
+    return {
+        version: unwrap_dek(bytes(wrapped), bytes(nonce))
+        for version, wrapped, nonce in Keyring.objects.using(db).values_list("version", "dek_wrapped", "dek_nonce")
+    }
+
+
+def backfill_blind_indexes(apps, schema_editor):
+    db = schema_editor.connection.alias
+    deks = None
+
+    for model_name in ("Organization", "User"):
+        Model = apps.get_model("fixdesk_api", model_name)
+        indexes = [f for f in Model._meta.concrete_fields if isinstance(f, fixdesk_api.fields.BlindIndexField)]
+        sources = {f.source: Model._meta.get_field(f.source) for f in indexes}
+
+        # Ciphertexts as stored (the cast skips the field's own decryption)
+        rows = Model.objects.using(db).values_list(
+            "pk", *(Cast(name, models.BinaryField()) for name in sources)
+        )
+        batch = []
+        for pk, *raws in rows.iterator(chunk_size=500):
+            if deks is None:
+                deks = _deks(apps, db)
+            plaintexts = {}
+            for (name, field), raw in zip(sources.items(), raws):
+                if raw is None:
+                    plaintexts[name] = None
+                    continue
+                version, nonce, ciphertext, aad, flags = field.unpack(bytes(raw))
+                plaintexts[name] = field.decode(decrypt_aead(deks[version], ciphertext, nonce=nonce, aad=aad), flags)
+
+            obj = Model(pk=pk)
+            for f in indexes:
+                setattr(obj, f.attname, f.index_value(plaintexts[f.source]))
+            batch.append(obj)
+
+            if len(batch) >= 500:
+                Model.objects.using(db).bulk_update(batch, [f.name for f in indexes])
+                batch = []
+
+        if batch:
+            Model.objects.using(db).bulk_update(batch, [f.name for f in indexes])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixdesk_api', '0005_lazy_encrypted_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='name_bidx',
+            field=fixdesk_api.fields.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, source='name'),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='name_prefix',
+            field=fixdesk_api.fields.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, prefix_length=3, source='name'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='first_name_bidx',
+            field=fixdesk_api.fields.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, source='first_name'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='first_name_prefix',
+            field=fixdesk_api.fields.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, prefix_length=3, source='first_name'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='last_name_bidx',
+            field=fixdesk_api.fields.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, source='last_name'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='last_name_prefix',
+            field=fixdesk_api.fields.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, prefix_length=3, source='last_name'),
+        ),
+        migrations.RunPython(backfill_blind_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:09
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixdesk_api', '0006_blind_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReencryptionCheckpoint',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('label', models.CharField(max_length=100, unique=True)),
+                ('target_version', models.PositiveIntegerField()),
+                ('last_pk', models.CharField(blank=True, default='', max_length=64)),
+                ('rows_scanned', models.PositiveIntegerField(default=0)),
+                ('rows_updated', models.PositiveIntegerField(default=0)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
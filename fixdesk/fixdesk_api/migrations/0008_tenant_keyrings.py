@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:17
+
+import django.db.models.deletion
+import fixdesk_api.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixdesk_api', '0007_reencryption_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keyring',
+            name='organization',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='keyrings', to='fixdesk_api.organization'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='first_name',
+            field=fixdesk_api.fields.EncryptedTextField(blank=True, lazy=True, null=True, tenant_field='organization'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='last_name',
+            field=fixdesk_api.fields.EncryptedTextField(blank=True, lazy=True, null=True, tenant_field='organization'),
+        ),
+    ]
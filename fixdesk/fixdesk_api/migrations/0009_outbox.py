@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:28
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixdesk_api', '0008_tenant_keyrings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('task', models.CharField(max_length=200)),
+                ('payload', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
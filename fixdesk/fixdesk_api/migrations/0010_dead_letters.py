@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:32
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixdesk_api', '0009_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('task', models.CharField(max_length=200)),
+                ('recipient', models.CharField(blank=True, db_index=True, default='', max_length=254)),
+                ('payload', models.TextField()),
+                ('error', models.TextField()),
+                ('attempts', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
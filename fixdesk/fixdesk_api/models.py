@@ -3,7 +3,7 @@ from django.contrib.auth.models import AbstractUser, BaseUserManager
 
 import uuid
 
-from .fields import EncryptedTextField
+from .fields import EncryptedTextField, BlindIndexField
     
 class UUIDModel(models.Model):
     id = models.UUIDField(
@@ -115,7 +115,9 @@ class Webhook(UUIDModel):
         return self.event
     
 class Organization(UUIDModel):
-    name = EncryptedTextField()
+    name = EncryptedTextField(lazy=True)
+    name_bidx = BlindIndexField(source="name")
+    name_prefix = BlindIndexField(source="name", prefix_length=3)
     subdomain = models.CharField(max_length=100, unique=True, null=True, blank=True)
     allowed_email_domain = models.CharField(max_length=255, null=True, blank=True
     )
@@ -128,7 +130,7 @@ class Organization(UUIDModel):
         ordering = ['-created_at']
 
     def __str__(self):
-        return self.name
+        return str(self.name)
     
 class User(AbstractUser):
     id = models.UUIDField(
@@ -139,8 +141,12 @@ class User(AbstractUser):
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='users', db_index=True, null=True, blank=True)
     username = None
     objects = UserManager()
-    first_name = EncryptedTextField(null=True, blank=True)
-    last_name = EncryptedTextField(null=True, blank=True)
+    first_name = EncryptedTextField(null=True, blank=True, lazy=True, tenant_field="organization")
+    last_name = EncryptedTextField(null=True, blank=True, lazy=True, tenant_field="organization")
+    first_name_bidx = BlindIndexField(source="first_name")
+    first_name_prefix = BlindIndexField(source="first_name", prefix_length=3)
+    last_name_bidx = BlindIndexField(source="last_name")
+    last_name_prefix = BlindIndexField(source="last_name", prefix_length=3)
     email = models.EmailField(unique=True, null=True, blank=True)
     role = models.CharField(max_length=10, default='staff', db_index=True)
     department = models.CharField(max_length=50, null=True, blank=True)
@@ -286,11 +292,44 @@ class Invitation(UUIDModel):
     def __str__(self):
         return f"Invitation for {self.email}"
 
+class OutboxMessage(UUIDModel):
+    # Task calls written in the same transaction as the row they are about;
+    # outbox.relay() publishes them to the broker once committed.
+    task = models.CharField(max_length=200)
+    payload = models.TextField()  # kombu JSON of the task kwargs
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.task} ({self.created_at})"
+
+class DeadLetter(UUIDModel):
+    # Mail that failed permanently or ran out of retries; payload is the
+    # task's kombu-JSON kwargs narrowed to this recipient, so it can be resent
+    task = models.CharField(max_length=200)
+    recipient = models.CharField(max_length=254, blank=True, default="", db_index=True)
+    payload = models.TextField()
+    error = models.TextField()
+    attempts = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.task} to {self.recipient}: {self.error[:40]}"
+
 # --------------------------------------------------------------------------------------------------------
 # Encryption
 
 class Keyring(UUIDModel):
-    # Store wrapped DEK for each version
+    # Store wrapped DEK for each version; organization=None is the global keyring.
+    # Versions are unique across organizations (see keys.py).
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='keyrings', null=True, blank=True, db_index=True)
     version = models.PositiveIntegerField(unique=True)
     dek_wrapped = models.BinaryField()
     dek_nonce = models.BinaryField()
@@ -303,4 +342,17 @@ class SecretRecord(UUIDModel):
     ciphertext = models.BinaryField()
     nonce = models.BinaryField()
     key_version = models.PositiveIntegerField()
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class ReencryptionCheckpoint(UUIDModel):
+    # Progress of rotation.reencrypt_model for one model, so runs can resume
+    label = models.CharField(max_length=100, unique=True)
+    target_version = models.PositiveIntegerField()
+    last_pk = models.CharField(max_length=64, blank=True, default="")
+    rows_scanned = models.PositiveIntegerField(default=0)
+    rows_updated = models.PositiveIntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.label} -> v{self.target_version}"
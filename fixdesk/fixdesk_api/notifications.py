@@ -0,0 +1,224 @@
+"""
+Notification events, hydrated in the worker.
+
+Views enqueue tasks.notify(event, ids) with an event name and the primary
+keys it concerns (see outbox.enqueue); the handler registered for the event
+loads the rows it needs in a few select_related/prefetch_related queries
+and returns the mails to send. Broker messages stay a few hundred bytes,
+hold nothing that JSON cannot carry, and mail always reflects the rows as
+committed rather than as the view saw them.
+"""
+from collections import namedtuple
+
+from .models import Comments, Conversations, Invitation, Issues, Tasks, User, VerificationCode
+
+# to: one address or a list; batch=True has tasks.notify send one message
+# per address, otherwise one message goes to all of them
+Mail = namedtuple("Mail", "subject to context type batch", defaults=(False,))
+
+EVENTS = {}
+
+
+class UnknownEvent(LookupError):
+    pass
+
+
+def event(name):
+    def register(handler):
+        EVENTS[name] = handler
+        return handler
+    return register
+
+
+def build(name, ids):
+    """The Mails for event `name`; [] when its rows are gone or nothing applies."""
+    try:
+        handler = EVENTS[name]
+    except KeyError:
+        raise UnknownEvent(name) from None
+    return [mail for mail in handler(**ids) if mail.to]
+
+
+def _name(user):
+    return f"{user.first_name} {user.last_name}"
+
+
+def _admin_emails(organization_id):
+    return list(User.objects.filter(organization_id=organization_id, role='admin').values_list('email', flat=True))
+
+
+def _ticket_id(issue):
+    return 'TK-' + str(issue.id)[:3]
+
+
+def _task_id(task):
+    return 'TSK-' + str(task.id)[:3]
+
+
+@event("issue.created")
+def issue_created(issue_id):
+    issue = Issues.objects.select_related('organization', 'reported_by').filter(id=issue_id).first()
+    if issue is None:
+        return []
+
+    context = {
+        'organization': issue.organization.slug,
+        'ticket_id': _ticket_id(issue),
+        'title': issue.title,
+        'description': issue.description,
+        'reported_by': _name(issue.reported_by),
+        'date': issue.created_at,
+    }
+    return [
+        Mail("New Issue Reported", _admin_emails(issue.organization_id), context, "admin"),
+        Mail("Issue Reported Successfully", issue.reported_by.email, context, "user"),
+    ]
+
+
+ISSUE_STATUS_SUBJECTS = {
+    'completed': 'Issue {ticket_id} Resolved',
+    'pending': 'Issue {ticket_id} Reopened',
+}
+
+
+@event("issue.status")
+def issue_status(issue_id):
+    issue = Issues.objects.select_related('organization', 'reported_by').filter(id=issue_id).first()
+    if issue is None or issue.status not in ISSUE_STATUS_SUBJECTS:
+        return []
+
+    context = {
+        'organization': issue.organization.slug,
+        'ticket_id': _ticket_id(issue),
+        'title': issue.title,
+        'description': issue.description,
+        'date': issue.created_at,
+        'status': issue.status,
+    }
+    subject = ISSUE_STATUS_SUBJECTS[issue.status].format(**context)
+    return [Mail(subject, issue.reported_by.email, context, "issue_status")]
+
+
+@event("conversation.created")
+def conversation_created(conversation_id):
+    conversation = (
+        Conversations.objects.select_related('organization', 'issue__reported_by', 'sender')
+        .filter(id=conversation_id).first()
+    )
+    if conversation is None:
+        return []
+
+    issue, sender = conversation.issue, conversation.sender
+    context = {
+        'organization': conversation.organization.slug,
+        'message': conversation.message,
+        'ticket_id': _ticket_id(issue),
+        'sender': _name(sender),
+    }
+    # Admin replies go to the reporter; everyone else's messages to the admins
+    to = [issue.reported_by.email] if sender.role == 'admin' else _admin_emails(issue.organization_id)
+    return [Mail(f"New Message on Issue (ID: {context['ticket_id']})", to, context, "message")]
+
+
+@event("task.created")
+def task_created(task_id):
+    task = (
+        Tasks.objects.select_related('organization', 'assigned_by').prefetch_related('assigned_to')
+        .filter(id=task_id).first()
+    )
+    if task is None:
+        return []
+
+    assigned_users = list(task.assigned_to.all())
+    context = {
+        'organization': task.organization.slug,
+        'assigned_by': _name(task.assigned_by) if task.assigned_by else '',
+        'assigned_to': ', '.join(_name(user) for user in assigned_users),
+        'task_id': _task_id(task),
+        'title': task.title,
+        'description': task.description,
+        'priority': task.priority,
+        'due_date': task.due_date,
+    }
+    return [Mail("New Task Assigned", [user.email for user in assigned_users], context, "task", batch=True)]
+
+
+TASK_STATUS_SUBJECTS = {
+    'completed': '{task_id} Completed',
+    'pending': 'Task {task_id} Reopened',
+}
+
+
+@event("task.status")
+def task_status(task_id):
+    task = Tasks.objects.select_related('organization').prefetch_related('assigned_to').filter(id=task_id).first()
+    if task is None or task.status not in TASK_STATUS_SUBJECTS:
+        return []
+
+    context = {
+        'organization': task.organization.slug,
+        'task_id': _task_id(task),
+        'title': task.title,
+        'description': task.description,
+        'due_date': task.due_date,
+        'status': task.status,
+    }
+    subject = TASK_STATUS_SUBJECTS[task.status].format(**context)
+    return [Mail(subject, [user.email for user in task.assigned_to.all()], context, "task_status", batch=True)]
+
+
+@event("comment.created")
+def comment_created(comment_id):
+    comment = (
+        Comments.objects.select_related('organization', 'task', 'commenter')
+        .prefetch_related('task__assigned_to', 'mentioned_users')
+        .filter(id=comment_id).first()
+    )
+    if comment is None:
+        return []
+
+    context = {
+        'organization': comment.organization.slug,
+        'comment': comment.message,
+        'task_id': _task_id(comment.task),
+        'commenter': _name(comment.commenter),
+    }
+    users = {user.id: user for user in [*comment.task.assigned_to.all(), *comment.mentioned_users.all()]}
+    users.pop(comment.commenter_id, None)
+    to = [user.email for user in users.values()]
+    return [Mail(f"New Comment on Task (ID: {context['task_id']})", to, context, "comment", batch=True)]
+
+
+@event("verification.created")
+def verification_created(verification_code_id, email=None):
+    code = VerificationCode.objects.select_related('user__organization').filter(id=verification_code_id).first()
+    if code is None:
+        return []
+
+    user = code.user
+    context = {
+        'organization': user.organization.slug if user and user.organization else None,
+        'verification_code': code.code,
+    }
+    if user:
+        return [Mail("Reset your Helpdesk Password", user.email, context, "verify")]
+    # No account yet: the code was requested for an address we do not store
+    return [Mail("Activate your account", email, context, "activate")]
+
+
+@event("invitation.created")
+def invitation_created(invitation_id):
+    invitation = Invitation.objects.select_related('organization').filter(id=invitation_id).first()
+    if invitation is None:
+        return []
+
+    organization = invitation.organization
+    context = {
+        'organization': organization.slug,
+        'email': invitation.email,
+        'role': invitation.role,
+        'department': invitation.department,
+        'token': invitation.token,
+        "link": f"https://fixdesk.ng/activate?token={invitation.token}",
+    }
+    return [Mail(f"Invitation to join {organization.name} on Helpdesk", invitation.email, context, "activate")]
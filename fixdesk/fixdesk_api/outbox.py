@@ -0,0 +1,82 @@
+"""
+Transactional outbox for Celery tasks.
+
+enqueue() writes the task call to OutboxMessage inside the caller's
+transaction instead of publishing it, so a rolled-back write sends nothing
+and the request never waits on the broker. relay() (run by the relay_outbox
+beat task or management command) publishes committed rows in batches,
+locking them with SELECT ... FOR UPDATE SKIP LOCKED so several relays can
+drain the table side by side, and deletes each row once the broker has it.
+"""
+import logging
+
+from celery import current_app
+from django.db import transaction
+from kombu.utils import json
+
+from fixdesk.utils import metrics
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+_published = metrics.Metric("outbox.publish", result="ok")
+_failed = metrics.Metric("outbox.publish", result="error")
+
+
+def enqueue(task, **kwargs):
+    """
+    Records task.apply_async(kwargs=kwargs) to run after the current
+    transaction commits. kwargs are serialized now with the same JSON
+    encoder the broker uses, so types round-trip as with apply_async.
+    """
+    name = task if isinstance(task, str) else task.name
+    return OutboxMessage.objects.create(task=name, payload=json.dumps(kwargs))
+
+
+def relay_batch(batch_size=BATCH_SIZE):
+    """
+    Publishes up to batch_size of the oldest rows; returns (published, failed).
+    Rows that fail stay in the table with attempts/last_error updated.
+    """
+    with transaction.atomic():
+        rows = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .order_by('created_at')[:batch_size]
+        )
+
+        published, failed = [], []
+        for row in rows:
+            try:
+                current_app.send_task(row.task, kwargs=json.loads(row.payload))
+            except Exception as e:
+                logger.warning("Outbox publish of %s failed: %s", row.task, e)
+                row.attempts += 1
+                row.last_error = str(e)
+                failed.append(row)
+            else:
+                published.append(row.id)
+
+        OutboxMessage.objects.filter(id__in=published).delete()
+        if failed:
+            OutboxMessage.objects.bulk_update(failed, ['attempts', 'last_error'])
+
+    _published.incr(len(published))
+    _failed.incr(len(failed))
+    return len(published), len(failed)
+
+
+def relay(batch_size=BATCH_SIZE):
+    """
+    Drains the outbox batch by batch; stops when it is empty or a batch hits
+    a publish error (the broker is likely down; the next run retries).
+    Returns the number of messages published.
+    """
+    total = 0
+    while True:
+        published, failed = relay_batch(batch_size)
+        total += published
+        if failed or published < batch_size:
+            return total
@@ -0,0 +1,186 @@
+import time
+
+from django.apps import apps
+from django.db import models, transaction
+from django.utils import timezone
+
+from .crypto import encrypt_aead, decrypt_aead
+from .fields import encrypted_fields, ENVELOPE_MAGIC
+from .keys import get_current_version, get_cipher
+from .services import _aad as secret_aad
+
+CHUNK_SIZE = 500
+
+SECRET_MODELS = ("fixdesk_api.SecretRecord", "rugby.SecretRecord")
+
+
+def _tenant_fields(model):
+    return [f for f in encrypted_fields(model) if f.tenant_field]
+
+
+def reencryption_targets(organization_id=None):
+    """
+    Models holding ciphertext under one keyring: the organization's (models
+    with tenant-keyed fields only), or the global one when organization_id
+    is None. A model's encrypted fields either all follow a tenant or none do.
+    """
+    if organization_id is not None:
+        return [m for m in apps.get_models() if _tenant_fields(m)]
+
+    targets = [m for m in apps.get_models() if encrypted_fields(m)]
+    targets += [apps.get_model(label) for label in SECRET_MODELS]
+    return targets
+
+
+def _checkpoint(label, target_version, restart=False):
+    Checkpoint = apps.get_model("fixdesk_api", "ReencryptionCheckpoint")
+
+    cp, _ = Checkpoint.objects.get_or_create(
+        label=label,
+        defaults={"target_version": target_version},
+    )
+
+    if restart or cp.target_version != target_version:
+        cp.target_version = target_version
+        cp.last_pk = ""
+        cp.rows_scanned = 0
+        cp.rows_updated = 0
+        cp.completed_at = None
+        cp.save()
+
+    return cp
+
+
+def _reencrypt_field_chunk(model, fields, qs, target_version, chunk_size):
+    # Read raw ciphertext through a plain BinaryField so nothing is decrypted
+    # unless its version header is behind the target (or in the legacy layout).
+    raw = {f"_raw_{f.name}": models.ExpressionWrapper(models.F(f.name), output_field=models.BinaryField()) for f in fields}
+    rows = list(qs.annotate(**raw).values_list("pk", *raw)[:chunk_size])
+
+    changed = []
+    for pk, *values in rows:
+        values = [bytes(v) if v is not None else None for v in values]
+        stale = False
+
+        obj = model(pk=pk)
+        for f, value in zip(fields, values):
+            if value is not None and (value[0] != ENVELOPE_MAGIC or f.key_version(value) != target_version):
+                value = f.encrypt(f.decrypt(value), version=target_version)
+                stale = True
+            setattr(obj, f.attname, value)
+
+        if stale:
+            changed.append(obj)
+
+    return rows, changed
+
+
+def _reencrypt_secret_chunk(model, qs, target_version, chunk_size):
+    rows = list(qs.exclude(key_version=target_version)[:chunk_size])
+    cipher = get_cipher(target_version)
+
+    for rec in rows:
+        pt = decrypt_aead(get_cipher(rec.key_version), bytes(rec.ciphertext), nonce=bytes(rec.nonce), aad=secret_aad(rec.id))
+        rec.ciphertext, rec.nonce = encrypt_aead(cipher, pt, aad=secret_aad(rec.id))
+        rec.key_version = target_version
+
+    return rows, rows
+
+
+def reencrypt_model(model, *, organization_id=None, target_version=None, chunk_size=CHUNK_SIZE, sleep=0, deadline=None, restart=False, progress=None):
+    """
+    Re-encrypts the rows of model under target_version (default: the current
+    version of the organization's keyring), pk chunk by chunk. For models with
+    tenant-keyed fields only that organization's rows are scanned; None means
+    rows without a tenant. Returns the checkpoint; completed_at is None if the
+    deadline cut it short.
+    """
+    if target_version is None:
+        target_version = get_current_version(organization_id)
+
+    fields = encrypted_fields(model)
+    qs = model._default_manager.order_by("pk")
+
+    label = model._meta.label
+    tenant_fields = _tenant_fields(model)
+    if tenant_fields:
+        qs = qs.filter(**{tenant_fields[0].tenant_attname: organization_id})
+        if organization_id is not None:
+            label = f"{label}@{organization_id}"
+
+    cp = _checkpoint(label, target_version, restart=restart)
+    if cp.completed_at:
+        return cp
+
+    update_fields = [f.name for f in fields] or ["ciphertext", "nonce", "key_version"]
+    db = qs.db
+
+    while True:
+        chunk_qs = qs.filter(pk__gt=cp.last_pk) if cp.last_pk else qs
+
+        # The chunk stays locked from read to write, so an edit committed in
+        # between cannot be overwritten with the re-encrypted old value
+        with transaction.atomic(using=db):
+            chunk_qs = chunk_qs.select_for_update()
+            if fields:
+                rows, changed = _reencrypt_field_chunk(model, fields, chunk_qs, target_version, chunk_size)
+                last_pk = rows[-1][0] if rows else None
+            else:
+                rows, changed = _reencrypt_secret_chunk(model, chunk_qs, target_version, chunk_size)
+                last_pk = rows[-1].pk if rows else None
+
+            if changed:
+                model._default_manager.using(db).bulk_update(changed, update_fields)
+
+        if not rows:
+            break
+
+        # Checkpoint after the data commit: a crash in between only repeats
+        # a chunk whose rows are then skipped as already current.
+        cp.last_pk = str(last_pk)
+        cp.rows_scanned += len(rows)
+        cp.rows_updated += len(changed)
+        cp.save(update_fields=["last_pk", "rows_scanned", "rows_updated", "updated_at"])
+
+        if progress:
+            progress(cp)
+
+        if deadline and time.monotonic() >= deadline:
+            return cp
+
+        if sleep:
+            time.sleep(sleep)
+
+    cp.completed_at = timezone.now()
+    cp.save(update_fields=["completed_at", "updated_at"])
+
+    if progress:
+        progress(cp)
+
+    return cp
+
+
+def reencrypt_all(*, organization_id=None, chunk_size=CHUNK_SIZE, sleep=0, max_seconds=None, restart=False, progress=None):
+    """
+    Runs reencrypt_model over every model holding ciphertext under one
+    keyring (the organization's, or the global one when None).
+    Returns True once all of it is on that keyring's current version.
+    """
+    target_version = get_current_version(organization_id)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+
+    for model in reencryption_targets(organization_id):
+        cp = reencrypt_model(
+            model,
+            organization_id=organization_id,
+            target_version=target_version,
+            chunk_size=chunk_size,
+            sleep=sleep,
+            deadline=deadline,
+            restart=restart,
+            progress=progress,
+        )
+        if not cp.completed_at:
+            return False
+
+    return True
@@ -1,24 +1,40 @@
+import time
+
 from .models import SecretRecord
 from .crypto import encrypt_aead, decrypt_aead
-from .keys import get_current_version, get_dek
+from .keys import get_current_version, get_cipher
+from fixdesk.utils import metrics
+
+_encrypt_metric = metrics.Metric("crypto.encrypt", field="SecretRecord.ciphertext")
+_decrypt_metric = metrics.Metric("crypto.decrypt", field="SecretRecord.ciphertext")
 
-def _aad(record_id: int) -> bytes:
+def _aad(record_id) -> bytes:
     return f"record={record_id}".encode()
 
+def _build_secret(cipher, version: int, plaintext: str) -> SecretRecord:
+    # UUID pk is generated client-side, so the AAD can bind to it before the insert
+    start = time.perf_counter()
+    rec = SecretRecord(key_version=version)
+    rec.ciphertext, rec.nonce = encrypt_aead(cipher, plaintext.encode("utf-8"), aad=_aad(rec.id))
+    _encrypt_metric.observe(time.perf_counter() - start)
+    return rec
+
 def create_secret(plaintext: str) -> SecretRecord:
     v = get_current_version()
-    dek = get_dek(v)
 
-    # create placeholder to get record_id for AAD binding
-    rec = SecretRecord.objects.create(ciphertext=b"", nonce=b"", key_version=v)
-
-    ct, nonce = encrypt_aead(dek, plaintext.encode("utf-8"), aad=_aad(rec.id))
-    rec.ciphertext = ct
-    rec.nonce = nonce
-    rec.save(update_fields=["ciphertext", "nonce"])
+    rec = _build_secret(get_cipher(v), v, plaintext)
+    rec.save(force_insert=True)
     return rec
 
+def create_secrets(plaintexts: list[str]) -> list[SecretRecord]:
+    v = get_current_version()
+    cipher = get_cipher(v)
+
+    records = [_build_secret(cipher, v, pt) for pt in plaintexts]
+    return SecretRecord.objects.bulk_create(records)
+
 def read_secret(rec: SecretRecord) -> str:
-    dek = get_dek(rec.key_version)
-    pt = decrypt_aead(dek, bytes(rec.ciphertext), nonce=bytes(rec.nonce), aad=_aad(rec.id))
+    start = time.perf_counter()
+    pt = decrypt_aead(get_cipher(rec.key_version), bytes(rec.ciphertext), nonce=bytes(rec.nonce), aad=_aad(rec.id))
+    _decrypt_metric.observe(time.perf_counter() - start)
     return pt.decode("utf-8")
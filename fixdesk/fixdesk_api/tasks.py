@@ -1,61 +1,174 @@
-import os
-
 from celery import shared_task
-import smtplib, ssl
 from email.message import EmailMessage
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from django.template.loader import render_to_string
-
-@shared_task
-def send_mail(subject, to_email, context, type):
-    port = 587
-    smtp_server =os.getenv('SMTP_SERVER')
-    username=os.getenv('EMAIL_USER')
-    password =os.getenv('EMAIL_PASSWORD')
-    
-    if type == "admin":
-        html_content = render_to_string('admin_notification.html', context)
-    elif type == "user":
-        html_content = render_to_string('user_notification.html', context)
-    elif type == "verify":
-        html_content = render_to_string('user_verification.html', context)
-    elif type == "activate":
-        html_content = render_to_string('user_activation.html', context)
-    elif type == "message":
-        html_content = render_to_string('message_notification.html', context)
-    elif type == "issue_status":
-        html_content = render_to_string('issue_status_notification.html', context)
-    elif type == "task":
-        html_content = render_to_string('task_notification.html', context)
-    elif type == "task_status":
-        html_content = render_to_string('task_status_notification.html', context)
-    elif type == "comment":
-        html_content = render_to_string('comment_notification.html', context)
+import logging
+
+from fixdesk.utils import delivery, mail_templates, smtp
+
+from . import dead_letters, notifications
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES = {
+    "admin": 'admin_notification.html',
+    "user": 'user_notification.html',
+    "verify": 'user_verification.html',
+    "activate": 'user_activation.html',
+    "message": 'message_notification.html',
+    "issue_status": 'issue_status_notification.html',
+    "task": 'task_notification.html',
+    "task_status": 'task_status_notification.html',
+    "comment": 'comment_notification.html',
+}
 
+mail_templates.register("fixdesk_api", {(type, None): name for type, name in TEMPLATES.items()})
+
+def _render(type, context):
+    try:
+        return mail_templates.render("fixdesk_api", type, None, context)
+    except mail_templates.UnknownTemplate:
+        logger.error("Skipping notification with unknown type %r", type)
+        return None
+
+def _message(subject, to_email, html_content, organization):
     msg = EmailMessage()
     msg['Subject'] = subject
-    msg['From'] = f"HelpDesk <{context.get('organization')}@fixdesk.ng>"
+    msg['From'] = f"HelpDesk <{organization}@fixdesk.ng>"
     msg['To'] = to_email
     msg.set_content(html_content, subtype='html')
-    
+    return msg
+
+MAX_RETRIES = 5
+
+# send_mail and send_batch are no longer enqueued: notify() builds and sends
+# every fixdesk_api mail. They stay only so that messages queued, written to
+# the outbox or retrying from before the switch are still delivered. Remove
+# them, with their celery_routing.ROUTES entries, once the mail queues and
+# OutboxMessage hold none of them.
+
+@shared_task(bind=True, max_retries=MAX_RETRIES, ignore_result=True)
+def send_mail(self, subject, to_email, context, type):
+    html_content = _render(type, context)
+    if html_content is None:
+        return False
+    msg = _message(subject, to_email, html_content, context.get('organization'))
+
+    # Reuses an authenticated session from the worker's pool, paced by the
+    # shared rate limit
+    error = delivery.deliver_sync([msg])[0]
+    failed = smtp.failures(error, [to_email] if isinstance(to_email, str) else to_email)
+    if not failed:
+        return True
+
+    # Only the refused addresses are retried or dead-lettered
+    dead_letters.fail_each(
+        self, failed, lambda to: {'subject': subject, 'to_email': to, 'context': context, 'type': type}
+    )
+    return False
+
+@shared_task(bind=True, max_retries=MAX_RETRIES, ignore_result=True)
+def send_batch(self, subject, recipients, context, type):
+    """
+    One task per event: renders the template once and sends one message per
+    recipient, several SMTP sessions at a time (see fixdesk.utils.delivery).
+    Recipients that fail transiently are retried later in one task with
+    backoff; permanent failures are dead-lettered. Returns per-recipient
+    outcomes of this attempt (logged by the worker, not stored):
+    {'sent': [emails], 'failed': {email: error}}.
+    """
+    recipients = list(dict.fromkeys(r for r in recipients if r))
+    html_content = _render(type, context)
+    if html_content is None:
+        return {'sent': [], 'failed': {email: f"unknown type {type!r}" for email in recipients}}
+    organization = context.get('organization')
+
+    messages = [_message(subject, email, html_content, organization) for email in recipients]
+    outcomes = delivery.deliver_sync(messages)
+
+    failed = {}
+    for email, error in zip(recipients, outcomes):
+        failed.update(smtp.failures(error, [email]))
+    result = {
+        'sent': [email for email in recipients if email not in failed],
+        'failed': {email: str(error) for email, error in failed.items()},
+    }
+
+    dead_letters.fail_each(
+        self, failed, lambda to: {'subject': subject, 'recipients': to, 'context': context, 'type': type}
+    )
+    return result
+
+@shared_task(bind=True, max_retries=MAX_RETRIES, ignore_result=True)
+def notify(self, event, ids, only=None):
+    """
+    Sends the mails for a notification event (see notifications.py), built
+    here from the rows in `ids`. Addresses that fail transiently are retried
+    as the same event restricted to them (`only`), rebuilt from fresh rows;
+    permanent failures are dead-lettered per address. Returns how many
+    addresses were sent to.
+    """
     try:
-        if port == 465:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                server.login(username, password)
-                server.send_message(msg)
-        elif port == 587:
-            with smtplib.SMTP(smtp_server, port) as server:
-                server.starttls()
-                server.login(username, password)
-                server.send_message(msg)
+        mails = notifications.build(event, ids)
+    except notifications.UnknownEvent:
+        logger.error("Skipping unknown notification event %r", event)
+        return 0
+
+    messages, targets = [], []
+    for mail in mails:
+        to = [mail.to] if isinstance(mail.to, str) else list(dict.fromkeys(a for a in mail.to if a))
+        if only is not None:
+            to = [address for address in to if address in only]
+        html_content = _render(mail.type, mail.context) if to else None
+        if html_content is None:
+            continue
+
+        organization = mail.context.get('organization')
+        if mail.batch:
+            for address in to:
+                messages.append(_message(mail.subject, address, html_content, organization))
+                targets.append([address])
         else:
-            print ("use 465 / 587 as port value")
-            exit()
-        return True
-    except Exception as e:
-        print (e)
-        return False
+            messages.append(_message(mail.subject, to, html_content, organization))
+            targets.append(to)
+
+    outcomes = delivery.deliver_sync(messages)
+
+    # Count only accepted addresses; refused ones are retried or dead-lettered
+    sent, failed = 0, {}
+    for to, error in zip(targets, outcomes):
+        refused = smtp.failures(error, to)
+        sent += len(to) - len(refused)
+        failed.update(refused)
+
+    dead_letters.fail_each(self, failed, lambda only: {'event': event, 'ids': ids, 'only': only})
+    return sent
+
+
+@shared_task(ignore_result=True)
+def relay_outbox(batch_size=100):
+    from .outbox import relay
+
+    return relay(batch_size)
+
+
+@shared_task(bind=True)
+def reencrypt(self, organization_id=None, chunk_size=500, sleep=0, max_seconds=600):
+    from .rotation import reencrypt_all
+
+    def progress(checkpoint):
+        self.update_state(state="PROGRESS", meta={
+            'model': checkpoint.label,
+            'target_version': checkpoint.target_version,
+            'rows_scanned': checkpoint.rows_scanned,
+            'rows_updated': checkpoint.rows_updated,
+        })
+
+    # Work in bounded slices (well under the broker visibility timeout) and
+    # continue from the checkpoint in a fresh task.
+    done = reencrypt_all(organization_id=organization_id, chunk_size=chunk_size, sleep=sleep, max_seconds=max_seconds, progress=progress)
+    if not done:
+        reencrypt.apply_async(kwargs={'organization_id': organization_id, 'chunk_size': chunk_size, 'sleep': sleep, 'max_seconds': max_seconds})
+    return done
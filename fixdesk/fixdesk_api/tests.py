@@ -1,3 +1,701 @@
-from django.test import TestCase
+import asyncio
+import os
+import smtplib
+import socket
+import struct
+import threading
+import time
+from email.message import EmailMessage
+from unittest import mock
 
-# Create your tests here.
+from cryptography.exceptions import InvalidTag
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.functions import Cast
+from django.test import SimpleTestCase, TestCase, override_settings
+from kombu.utils import json
+
+from fixdesk.utils import delivery, smtp
+from fixdesk.utils.smtp_sink import SMTPSink
+
+from . import keys, outbox
+from .crypto import encrypt_aead, new_dek
+from .fields import ENVELOPE_MAGIC, FLAG_WIDE_VERSION, FLAG_ZLIB, EncryptedText, EncryptedTextField
+from .filters import OrganizationFilter, UserFilter
+from .keywrap_local import wrap_dek
+from .models import DeadLetter, Keyring, Organization, OutboxMessage, ReencryptionCheckpoint, User
+from .rotation import reencrypt_model
+from .tasks import MAX_RETRIES, reencrypt, send_batch, send_mail
+
+
+class KeyringTestCase(TestCase):
+    # Keyrings are rolled back with each test, so cached versions and DEKs must go too
+    def setUp(self):
+        cache.clear()
+        keys.clear_local_cache()
+
+
+class BlindIndexFilterTests(KeyringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(email="alice@example.com", first_name="Alice", last_name="Okafor")
+        self.alina = User.objects.create(email="alina@example.com", first_name="Alina", last_name="Okoro")
+        self.bob = User.objects.create(email="bob@example.com", first_name="Bob", last_name="Okafor")
+
+    def filter(self, **data):
+        filterset = UserFilter(data=data, queryset=User.objects.all())
+        self.assertTrue(filterset.is_valid(), filterset.errors)
+        return set(filterset.qs)
+
+    def test_exact(self):
+        self.assertEqual(self.filter(first_name="Alice"), {self.alice})
+        self.assertEqual(self.filter(last_name="Okafor"), {self.alice, self.bob})
+        self.assertEqual(self.filter(first_name="Ali"), set())
+
+    def test_exact_is_case_width_and_whitespace_insensitive(self):
+        self.assertEqual(self.filter(first_name="  ALICE "), {self.alice})
+        self.assertEqual(self.filter(first_name="Ａｌｉｃｅ"), {self.alice})
+
+    def test_prefix_of_index_length(self):
+        self.assertEqual(self.filter(first_name__startswith="ali"), {self.alice, self.alina})
+        self.assertEqual(self.filter(last_name__startswith="OKA"), {self.alice, self.bob})
+
+    def test_longer_prefix_checks_decrypted_values(self):
+        # "alic" and "alin" share the "ali" index entry
+        self.assertEqual(self.filter(first_name__startswith="alic"), {self.alice})
+        self.assertEqual(self.filter(first_name__startswith="alina"), {self.alina})
+        self.assertEqual(self.filter(first_name__startswith="alinas"), set())
+
+    def test_prefix_shorter_than_index_is_rejected(self):
+        filterset = UserFilter(data={"first_name__startswith": "al"}, queryset=User.objects.all())
+        self.assertFalse(filterset.is_valid())
+        self.assertIn("at least 3 characters", filterset.errors["first_name__startswith"][0])
+        # Normalized length counts, not raw length
+        self.assertFalse(UserFilter(data={"first_name__startswith": " al "}, queryset=User.objects.all()).is_valid())
+
+    def test_indexes_follow_updates(self):
+        self.alice.first_name = "Beatrice"
+        self.alice.save()
+        self.assertEqual(self.filter(first_name__startswith="ali"), {self.alina})
+        self.assertEqual(self.filter(first_name="beatrice"), {self.alice})
+
+    def test_organization_name(self):
+        org = Organization.objects.create(name="Kings College", slug="kings")
+        filterset = OrganizationFilter(data={"name__startswith": "king"}, queryset=Organization.objects.all())
+        self.assertEqual(list(filterset.qs), [org])
+
+
+class EnvelopeTests(KeyringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.field = User._meta.get_field("first_name")
+        # Unbound field standing in for a long free-text column
+        self.long_field = EncryptedTextField(compress_over=64)
+        self.long_field.aad = b"Test:long_text"
+
+    def test_round_trip(self):
+        raw = self.field.encrypt("Adaeze")
+        self.assertEqual(raw[0], ENVELOPE_MAGIC)
+        self.assertEqual(raw[1], 0)
+        self.assertEqual(self.field.key_version(raw), keys.get_current_version())
+        self.assertEqual(self.field.decrypt(raw), "Adaeze")
+
+    def test_round_trip_through_the_database(self):
+        user = User.objects.create(email="ada@example.com", first_name="Adaeze")
+        self.assertEqual(str(User.objects.get(pk=user.pk).first_name), "Adaeze")
+
+    def test_compresses_long_values(self):
+        text = "The projector in the main hall keeps flickering. " * 20
+        raw = self.long_field.encrypt(text)
+        self.assertEqual(raw[1], FLAG_ZLIB)
+        self.assertLess(len(raw), len(text))
+        self.assertEqual(self.long_field.decrypt(raw), text)
+
+    def test_keeps_incompressible_values_plain(self):
+        # No repeats: zlib output would be longer than the input
+        text = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ-_"
+        raw = self.long_field.encrypt(text)
+        self.assertEqual(raw[1], 0)
+        self.assertEqual(self.long_field.decrypt(raw), text)
+
+    def test_short_values_are_not_compressed(self):
+        raw = self.long_field.encrypt("short")
+        self.assertEqual(raw[1], 0)
+        self.assertEqual(self.long_field.decrypt(raw), "short")
+
+    def test_reads_legacy_layout(self):
+        version = keys.get_current_version()
+        ciphertext, nonce = encrypt_aead(keys.get_cipher(version), "Adaeze".encode(), aad=self.field.aad)
+        raw = struct.pack(">H", version) + nonce + ciphertext
+        self.assertEqual(self.field.key_version(raw), version)
+        self.assertEqual(self.field.decrypt(raw), "Adaeze")
+
+    def test_flags_are_authenticated(self):
+        raw = bytearray(self.long_field.encrypt("x" * 200))
+        self.assertEqual(raw[1], FLAG_ZLIB)
+        raw[1] = 0
+        with self.assertRaises(InvalidTag):
+            self.long_field.decrypt(bytes(raw))
+
+    def test_aad_binds_model_and_field(self):
+        raw = self.field.encrypt("Adaeze")
+        with self.assertRaises(InvalidTag):
+            User._meta.get_field("last_name").decrypt(raw)
+
+    def test_wide_version_header(self):
+        nonce, ciphertext = bytes(12), b"ciphertext"
+        raw = struct.pack(">BBI", ENVELOPE_MAGIC, FLAG_WIDE_VERSION, 0x10002) + nonce + ciphertext
+        self.assertEqual(self.field.key_version(raw), 0x10002)
+        version, unpacked_nonce, unpacked, aad, flags = self.field.unpack(raw)
+        self.assertEqual((version, unpacked_nonce, unpacked, flags), (0x10002, nonce, ciphertext, FLAG_WIDE_VERSION))
+        self.assertEqual(aad, self.field.aad + bytes((ENVELOPE_MAGIC, FLAG_WIDE_VERSION)))
+
+
+class TenantKeyringTests(KeyringTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a = Organization.objects.create(name="Alpha", slug="alpha")
+            self.b = Organization.objects.create(name="Beta", slug="beta")
+            self.versions = {org: keys.get_current_version(org) for org in (None, self.a.id, self.b.id)}
+        self.field = User._meta.get_field("first_name")
+
+    def stored_version(self, user):
+        return self.field.key_version(User.objects.get(pk=user.pk).first_name.ciphertext)
+
+    def test_each_organization_has_its_own_keyring(self):
+        self.assertEqual(len(set(self.versions.values())), 3)
+        self.assertEqual(Keyring.objects.get(version=self.versions[self.a.id]).organization_id, self.a.id)
+        self.assertIsNone(Keyring.objects.get(version=self.versions[None]).organization_id)
+
+    def test_names_are_encrypted_under_their_organization(self):
+        ada = User.objects.create(email="ada@example.com", first_name="Ada", organization=self.a)
+        bea = User.objects.create(email="bea@example.com", first_name="Bea", organization=self.b)
+        solo = User.objects.create(email="solo@example.com", first_name="Solo")
+        self.assertEqual(self.stored_version(ada), self.versions[self.a.id])
+        self.assertEqual(self.stored_version(bea), self.versions[self.b.id])
+        self.assertEqual(self.stored_version(solo), self.versions[None])
+
+    def test_rotation_touches_one_keyring(self):
+        ada = User.objects.create(email="ada@example.com", first_name="Ada", organization=self.a)
+        with self.captureOnCommitCallbacks(execute=True):
+            new_version = keys.rotate_key(self.a.id)
+
+        self.assertEqual(keys.get_current_version(self.a.id), new_version)
+        self.assertEqual(keys.get_current_version(self.b.id), self.versions[self.b.id])
+        self.assertEqual(keys.get_current_version(), self.versions[None])
+        self.assertEqual(User.objects.get(pk=ada.pk).first_name, "Ada")
+
+    def test_version_alone_finds_the_dek(self):
+        ada = User.objects.create(email="ada@example.com", first_name="Ada", organization=self.a)
+        cache.clear()
+        keys.clear_local_cache()
+        # Decryption never needs the tenant: the version header names the DEK
+        self.assertEqual(User.objects.get(pk=ada.pk).first_name, "Ada")
+
+    def test_rolled_back_keyring_is_never_advertised(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                org = Organization.objects.create(name="Gamma", slug="gamma")
+                version = keys.get_current_version(org.id)
+                raise RuntimeError
+
+        self.assertIn(version, keys._pending)
+        self.assertNotIn(str(org.id), keys._current)
+        self.assertIsNone(cache.get(keys._current_version_key(str(org.id))))
+        # Another keyring must not reuse the number this connection held
+        self.assertGreater(keys.rotate_key(), version)
+
+
+class CommitAliasTests(SimpleTestCase):
+    def keyring_db(self, vendor):
+        connections = mock.MagicMock(databases={"default": {}, keys.KEYRING_DB: {}})
+        connections.__getitem__.return_value.vendor = vendor
+        return mock.patch.object(keys, "connections", connections)
+
+    def organization_visible(self, visible):
+        get_model = mock.MagicMock()
+        get_model.return_value.objects.using.return_value.filter.return_value.exists.return_value = visible
+        return mock.patch.object(keys.apps, "get_model", get_model)
+
+    def in_transaction(self, active=True):
+        connection = mock.MagicMock(in_atomic_block=active)
+        return mock.patch.object(keys.transaction, "get_connection", return_value=connection)
+
+    def test_autocommit_commits_on_default(self):
+        with self.in_transaction(False):
+            self.assertEqual(keys._commit_alias(None), "default")
+
+    def test_commits_on_the_keyring_connection(self):
+        with self.in_transaction(), self.keyring_db("postgresql"):
+            self.assertEqual(keys._commit_alias(None), keys.KEYRING_DB)
+            with self.organization_visible(True):
+                self.assertEqual(keys._commit_alias("org-id"), keys.KEYRING_DB)
+
+    def test_joins_the_transaction_when_the_organization_is_not_committed(self):
+        with self.in_transaction(), self.keyring_db("postgresql"), self.organization_visible(False):
+            self.assertIsNone(keys._commit_alias("org-id"))
+
+    def test_joins_the_transaction_on_sqlite(self):
+        with self.in_transaction(), self.keyring_db("sqlite"):
+            self.assertIsNone(keys._commit_alias(None))
+
+    def test_joins_the_transaction_without_a_keyring_database(self):
+        connections = mock.MagicMock(databases={"default": {}})
+        with self.in_transaction(), mock.patch.object(keys, "connections", connections):
+            self.assertIsNone(keys._commit_alias(None))
+
+
+class LazyDecryptionTests(KeyringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.field = User._meta.get_field("first_name")
+        self.user = User.objects.create(email="ada@example.com", first_name="Adaeze", last_name="Okafor")
+
+    def stored(self):
+        return User.objects.get(pk=self.user.pk).first_name.ciphertext
+
+    def test_decrypts_on_first_use_only(self):
+        with mock.patch.object(self.field, "decrypt", wraps=self.field.decrypt) as decrypt:
+            user = User.objects.get(pk=self.user.pk)
+            self.assertIs(type(user.first_name), EncryptedText)
+            decrypt.assert_not_called()
+
+            self.assertEqual(user.first_name, "Adaeze")
+            self.assertEqual(str(user.first_name), "Adaeze")
+            self.assertEqual(user.first_name.upper(), "ADAEZE")
+        self.assertEqual(decrypt.call_count, 1)
+
+    def test_unread_value_is_saved_as_stored(self):
+        ciphertext = self.stored()
+        user = User.objects.get(pk=self.user.pk)
+        with mock.patch.object(self.field, "encrypt") as encrypt, mock.patch.object(self.field, "decrypt") as decrypt:
+            user.save()
+        encrypt.assert_not_called()
+        decrypt.assert_not_called()
+        self.assertEqual(bytes(self.stored()), bytes(ciphertext))
+
+    def test_read_value_is_saved_as_stored(self):
+        ciphertext = self.stored()
+        user = User.objects.get(pk=self.user.pk)
+        str(user.first_name)
+        user.save()
+        self.assertEqual(bytes(self.stored()), bytes(ciphertext))
+
+    def test_assigned_value_is_encrypted(self):
+        ciphertext = self.stored()
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = "Chiamaka"
+        user.save()
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.first_name, "Chiamaka")
+        self.assertNotEqual(bytes(user.first_name.ciphertext), bytes(ciphertext))
+
+
+class CurrentVersionTests(KeyringTestCase):
+    def setUp(self):
+        super().setUp()
+        # A keyring created inside a transaction is only advertised once it commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.version = keys.get_current_version()
+
+    def test_held_in_memory_between_rechecks(self):
+        with mock.patch.object(keys, "cache", wraps=cache) as shared, self.assertNumQueries(0):
+            for _ in range(10):
+                self.assertEqual(keys.get_current_version(), self.version)
+        shared.get.assert_not_called()
+
+    def test_rechecks_the_shared_cache_after_the_interval(self):
+        # Another process rotated and published a new version
+        with self.captureOnCommitCallbacks(execute=True):
+            new_version = keys.rotate_key()
+        keys._current[None] = (self.version, time.monotonic())
+        self.assertEqual(keys.get_current_version(), self.version)
+
+        keys._current[None] = (self.version, time.monotonic() - keys.CURRENT_VERSION_RECHECK - 1)
+        self.assertEqual(keys.get_current_version(), new_version)
+
+    def test_rotation_is_published_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            new_version = keys.rotate_key()
+            self.assertEqual(keys.get_current_version(), self.version)
+            self.assertEqual(cache.get(keys.CURRENT_VERSION_KEY), self.version)
+
+        self.assertEqual(keys.get_current_version(), new_version)
+        self.assertEqual(cache.get(keys.CURRENT_VERSION_KEY), new_version)
+
+    def test_rolled_back_rotation_is_never_published(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                keys.rotate_key()
+                raise RuntimeError
+
+        keys._current.clear()
+        self.assertEqual(keys.get_current_version(), self.version)
+        self.assertEqual(cache.get(keys.CURRENT_VERSION_KEY), self.version)
+
+
+class PendingKeyTests(KeyringTestCase):
+    def setUp(self):
+        super().setUp()
+        keys.get_current_version()
+
+    def test_pending_cipher_is_cached_for_its_transaction(self):
+        version = keys.rotate_key()
+        with self.assertNumQueries(1):
+            ciphers = {id(keys.get_cipher(version)) for _ in range(10)}
+        self.assertEqual(len(ciphers), 1)
+        self.assertNotIn(version, keys._ciphers)
+
+    def test_commit_moves_the_pending_cipher_to_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            version = keys.rotate_key()
+            cipher = keys.get_cipher(version)
+
+        self.assertNotIn(version, keys._pending)
+        with self.assertNumQueries(0):
+            self.assertIs(keys.get_cipher(version), cipher)
+
+    def test_rollback_drops_the_pending_cipher(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                version = keys.rotate_key()
+                cipher = keys.get_cipher(version)
+                raise RuntimeError
+
+        # Another process may commit the freed number with a different DEK
+        wrapped, nonce = wrap_dek(new_dek())
+        Keyring.objects.create(version=version, dek_wrapped=wrapped, dek_nonce=nonce)
+
+        self.assertIsNot(keys.get_cipher(version), cipher)
+        self.assertNotIn(version, keys._pending_ciphers)
+
+
+class ReencryptionTests(KeyringTestCase):
+    databases = {"default", "rugby"}
+
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            User.objects.create(email=f"u{i}@example.com", first_name=f"First{i}")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.new_version = keys.rotate_key()
+
+    def versions(self):
+        field = User._meta.get_field("first_name")
+        raws = User.objects.annotate(raw=Cast("first_name", models.BinaryField())).values_list("raw", flat=True)
+        return sorted(field.key_version(bytes(raw)) for raw in raws)
+
+    def test_reencrypts_in_chunks(self):
+        cp = reencrypt_model(User, target_version=self.new_version, chunk_size=2)
+
+        self.assertIsNotNone(cp.completed_at)
+        self.assertEqual((cp.rows_scanned, cp.rows_updated), (5, 5))
+        self.assertEqual(self.versions(), [self.new_version] * 5)
+        keys.clear_local_cache()
+        self.assertEqual(sorted(str(u.first_name) for u in User.objects.all()), [f"First{i}" for i in range(5)])
+
+    def test_resumes_from_checkpoint(self):
+        # A deadline already passed stops after the first chunk
+        cp = reencrypt_model(User, target_version=self.new_version, chunk_size=2, deadline=time.monotonic())
+        self.assertIsNone(cp.completed_at)
+        self.assertEqual((cp.rows_scanned, cp.rows_updated), (2, 2))
+        self.assertEqual(self.versions().count(self.new_version), 2)
+
+        cp = reencrypt_model(User, target_version=self.new_version, chunk_size=2)
+        self.assertIsNotNone(cp.completed_at)
+        self.assertEqual((cp.rows_scanned, cp.rows_updated), (5, 5))
+        self.assertEqual(self.versions(), [self.new_version] * 5)
+
+    def test_skips_rows_already_current(self):
+        reencrypt_model(User, target_version=self.new_version)
+        cp = reencrypt_model(User, target_version=self.new_version, restart=True)
+        self.assertEqual((cp.rows_scanned, cp.rows_updated), (5, 0))
+
+    def test_new_target_restarts_the_checkpoint(self):
+        reencrypt_model(User, target_version=self.new_version)
+        with self.captureOnCommitCallbacks(execute=True):
+            newer = keys.rotate_key()
+        cp = reencrypt_model(User, target_version=newer, chunk_size=2)
+        self.assertEqual((cp.target_version, cp.rows_scanned, cp.rows_updated), (newer, 5, 5))
+
+    def test_task_requeues_itself_until_done(self):
+        with mock.patch.object(reencrypt, "apply_async") as requeue:
+            # max_seconds this short stops every model after its first chunk
+            self.assertFalse(reencrypt.apply(kwargs={"chunk_size": 2, "max_seconds": 1e-9}).get())
+            requeue.assert_called_once_with(kwargs={"organization_id": None, "chunk_size": 2, "sleep": 0, "max_seconds": 1e-9})
+            self.assertEqual(ReencryptionCheckpoint.objects.get(label="fixdesk_api.User").rows_scanned, 2)
+
+            requeue.reset_mock()
+            self.assertTrue(reencrypt.apply(kwargs={"chunk_size": 2}).get())
+            requeue.assert_not_called()
+        self.assertEqual(self.versions(), [self.new_version] * 5)
+
+
+def _message(to="someone@example.com"):
+    msg = EmailMessage()
+    msg["From"] = "fixdesk@example.com"
+    msg["To"] = to
+    msg["Subject"] = "Test"
+    msg.set_content("Hello")
+    return msg
+
+
+class SMTPPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.sink = SMTPSink(keep=10).start()
+        self.addCleanup(self.sink.stop)
+        self.pool = smtp.SMTPConnectionPool(self.sink.host, self.sink.port, "user", "secret", starttls=False)
+        self.addCleanup(self.pool.close_all)
+
+    def idle(self):
+        self.assertEqual(len(self.pool._idle), 1)
+        return self.pool._idle[0]
+
+    def test_reuses_one_session(self):
+        for _ in range(3):
+            self.pool.send_message(_message())
+        self.assertEqual(self.pool.send_messages([_message(), _message()]), [None, None])
+        self.assertEqual(self.sink.stats.snapshot()["connections"], 1)
+        self.assertEqual(self.sink.stats.snapshot()["messages"], 5)
+        self.assertEqual(self.idle().messages, 5)
+
+    def test_replaces_session_idle_too_long(self):
+        self.pool.send_message(_message())
+        self.idle().last_used -= smtp.IDLE_TIMEOUT + 1
+        self.pool.send_message(_message())
+        self.assertEqual(self.sink.stats.snapshot()["connections"], 2)
+
+    def test_replaces_session_after_max_messages(self):
+        self.pool.send_message(_message())
+        self.idle().messages = smtp.MAX_MESSAGES
+        self.pool.send_message(_message())
+        self.assertEqual(self.sink.stats.snapshot()["connections"], 2)
+        self.assertEqual(self.idle().messages, 1)
+
+    def test_checks_quiet_session_with_noop(self):
+        self.pool.send_message(_message())
+        conn = self.idle()
+        conn.last_used -= smtp.NOOP_AFTER + 1
+        self.pool.send_message(_message())
+        # Still alive: kept
+        self.assertIs(self.idle(), conn)
+
+        conn.last_used -= smtp.NOOP_AFTER + 1
+        conn.server.sock.shutdown(socket.SHUT_RDWR)
+        self.pool.send_message(_message())
+        self.assertIsNot(self.idle(), conn)
+        self.assertEqual(self.sink.stats.snapshot()["connections"], 2)
+        self.assertEqual(self.sink.stats.snapshot()["messages"], 3)
+
+    def test_retries_once_when_session_drops(self):
+        self.pool.send_message(_message())
+        # Dropped before NOOP_AFTER, so only the send notices
+        self.idle().server.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.pool.send_messages([_message(), _message()]), [None, None])
+        self.assertEqual(self.sink.stats.snapshot()["connections"], 2)
+        self.assertEqual(self.sink.stats.snapshot()["messages"], 3)
+
+    def test_fails_the_rest_when_no_session_opens(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        pool = smtp.SMTPConnectionPool("127.0.0.1", port, None, None, starttls=False)
+        outcomes = pool.send_messages([_message(), _message()])
+        self.assertEqual(len(outcomes), 2)
+        self.assertTrue(all(isinstance(e, ConnectionRefusedError) for e in outcomes))
+        self.assertTrue(smtp.is_transient(outcomes[0]))
+
+    def test_keeps_at_most_size_idle_sessions(self):
+        conns = [self.pool.acquire() for _ in range(self.pool.size + 1)]
+        for conn in conns:
+            self.pool.release(conn)
+        self.assertEqual(len(self.pool._idle), self.pool.size)
+
+
+class DeliveryTests(SimpleTestCase):
+    def setUp(self):
+        self.sink = SMTPSink(keep=20).start()
+        self.addCleanup(self.sink.stop)
+        self.pool = smtp.SMTPConnectionPool(self.sink.host, self.sink.port, "user", "secret", starttls=False)
+        self.addCleanup(self.pool.close_all)
+
+    def deliver(self, n):
+        return delivery.deliver_sync([_message() for _ in range(n)], pool=self.pool, concurrency=3)
+
+    def test_sends_every_message_in_order(self):
+        self.assertEqual(self.deliver(7), [None] * 7)
+        self.assertEqual(self.sink.stats.snapshot()["messages"], 7)
+        self.assertLessEqual(self.sink.stats.snapshot()["connections"], 3)
+
+    def test_batches_share_one_thread_pool(self):
+        self.deliver(3)
+        executor = delivery.get_executor()
+        threads = threading.active_count()
+        for _ in range(5):
+            self.deliver(3)
+        self.assertIs(delivery.get_executor(), executor)
+        self.assertLessEqual(threading.active_count(), threads)
+
+    def test_works_inside_a_running_event_loop(self):
+        async def handler():
+            return self.deliver(2)
+
+        self.assertEqual(asyncio.run(handler()), [None, None])
+
+
+class TransientErrorTests(SimpleTestCase):
+    def test_connection_errors_are_transient(self):
+        for error in (smtplib.SMTPServerDisconnected(), ConnectionRefusedError(), TimeoutError(), OSError()):
+            with self.subTest(error=error):
+                self.assertTrue(smtp.is_transient(error))
+
+    def test_4xx_replies_are_transient(self):
+        self.assertTrue(smtp.is_transient(smtplib.SMTPDataError(451, b"Try later")))
+        self.assertTrue(smtp.is_transient(smtplib.SMTPSenderRefused(421, b"Throttled", "fixdesk@example.com")))
+        self.assertTrue(smtp.is_transient(smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"Busy")})))
+
+    def test_5xx_replies_are_permanent(self):
+        self.assertFalse(smtp.is_transient(smtplib.SMTPDataError(554, b"Rejected")))
+        self.assertFalse(smtp.is_transient(smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"No such user")})))
+        # One permanent refusal makes the whole refusal permanent
+        self.assertFalse(smtp.is_transient(smtplib.SMTPRecipientsRefused({
+            "a@example.com": (450, b"Busy"),
+            "b@example.com": (550, b"No such user"),
+        })))
+
+    def test_other_errors_are_permanent(self):
+        self.assertFalse(smtp.is_transient(ValueError("bad header")))
+
+    def test_other_smtp_errors_are_permanent(self):
+        # SMTPException subclasses OSError but is not a network failure
+        for error in (smtplib.SMTPException("No recipients"), smtplib.SMTPNotSupportedError("SMTPUTF8")):
+            with self.subTest(error=error):
+                self.assertFalse(smtp.is_transient(error))
+
+    def test_failures_split_a_refusal_per_address(self):
+        error = smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"Busy"), "b@example.com": (550, b"No such user")})
+        failed = smtp.failures(error, ["a@example.com", "b@example.com", "c@example.com"])
+        self.assertEqual(set(failed), {"a@example.com", "b@example.com"})
+        self.assertTrue(smtp.is_transient(failed["a@example.com"]))
+        self.assertFalse(smtp.is_transient(failed["b@example.com"]))
+
+    def test_failures_of_a_failed_message_cover_every_recipient(self):
+        error = smtplib.SMTPServerDisconnected()
+        self.assertEqual(smtp.failures(error, ["a@example.com", "b@example.com"]), {"a@example.com": error, "b@example.com": error})
+        self.assertEqual(smtp.failures(None, ["a@example.com"]), {})
+
+
+@override_settings(MAIL_RATE_LIMITS={})
+class DeadLetterTests(TestCase):
+    def setUp(self):
+        self.sink = SMTPSink(keep=50, refuse={"gone@example.com": 550, "busy@example.com": 450}).start()
+        self.addCleanup(self.sink.stop)
+        self.addCleanup(smtp.close_all)
+        env = {"SMTP_SERVER": self.sink.host, "SMTP_PORT": str(self.sink.port), "SMTP_STARTTLS": "false", "EMAIL_USER": "user"}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def delivered(self):
+        return sorted(address for recipients, _ in self.sink.stats.kept() for address in recipients)
+
+    def dead_letters(self):
+        return {
+            letter.recipient: (letter.attempts, json.loads(letter.payload))
+            for letter in DeadLetter.objects.all()
+        }
+
+    def test_batch_retries_transient_and_dead_letters_permanent_failures(self):
+        with self.assertLogs("fixdesk_api.dead_letters", "ERROR") as logs:
+            send_batch.apply(kwargs={
+                "subject": "Hello",
+                "recipients": ["ok@example.com", "gone@example.com", "busy@example.com"],
+                "context": {"organization": "acme"},
+                "type": "user",
+            })
+        self.assertEqual(len(logs.records), 2)
+
+        # Delivered once, not resent with the retries
+        self.assertEqual(self.delivered(), ["ok@example.com"])
+        letters = self.dead_letters()
+        self.assertEqual(set(letters), {"gone@example.com", "busy@example.com"})
+        self.assertEqual(letters["gone@example.com"][0], 1)
+        self.assertEqual(letters["busy@example.com"][0], MAX_RETRIES + 1)
+        # Payloads are narrowed to the one recipient, ready to resend
+        self.assertEqual(letters["gone@example.com"][1]["recipients"], ["gone@example.com"])
+        self.assertEqual(letters["busy@example.com"][1]["recipients"], ["busy@example.com"])
+
+    def test_partly_refused_message_fails_only_the_refused_addresses(self):
+        with self.assertLogs("fixdesk_api.dead_letters", "ERROR"):
+            send_mail.apply(kwargs={
+                "subject": "Hello",
+                "to_email": ["ok@example.com", "gone@example.com"],
+                "context": {"organization": "acme"},
+                "type": "user",
+            })
+
+        self.assertEqual(self.delivered(), ["ok@example.com"])
+        letters = self.dead_letters()
+        self.assertEqual(set(letters), {"gone@example.com"})
+        self.assertEqual(letters["gone@example.com"][1]["to_email"], ["gone@example.com"])
+
+    def test_accepted_mail_leaves_no_dead_letter(self):
+        send_mail.apply(kwargs={"subject": "Hello", "to_email": "ok@example.com", "context": {}, "type": "user"})
+        self.assertEqual(self.delivered(), ["ok@example.com"])
+        self.assertFalse(DeadLetter.objects.exists())
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(outbox.current_app, "send_task")
+        self.send_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_relay_publishes_committed_calls(self):
+        outbox.enqueue(send_mail, subject="Hello", to_email=["a@example.com"], context={"n": 1}, type="user", action="creation")
+
+        self.assertEqual(outbox.relay(), 1)
+
+        self.send_task.assert_called_once_with("fixdesk_api.tasks.send_mail", kwargs={
+            "subject": "Hello", "to_email": ["a@example.com"], "context": {"n": 1}, "type": "user", "action": "creation",
+        })
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_rolled_back_calls_are_never_published(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.enqueue("fixdesk_api.tasks.send_mail", subject="Hello")
+            raise RuntimeError
+
+        self.assertEqual(outbox.relay(), 0)
+        self.send_task.assert_not_called()
+
+    def test_failed_publish_keeps_the_row_for_the_next_run(self):
+        outbox.enqueue("fixdesk_api.tasks.send_mail", subject="Hello")
+        self.send_task.side_effect = OSError("broker down")
+
+        with self.assertLogs("fixdesk_api.outbox", "WARNING"):
+            self.assertEqual(outbox.relay(), 0)
+
+        row = OutboxMessage.objects.get()
+        self.assertEqual(row.attempts, 1)
+        self.assertEqual(row.last_error, "broker down")
+
+        self.send_task.side_effect = None
+        self.assertEqual(outbox.relay(), 1)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_relay_drains_in_batches_and_locks_skipping_held_rows(self):
+        for n in range(5):
+            outbox.enqueue("fixdesk_api.tasks.send_mail", n=n)
+
+        select_for_update = OutboxMessage.objects.select_for_update
+        with mock.patch.object(OutboxMessage.objects, "select_for_update", wraps=select_for_update) as locked:
+            self.assertEqual(outbox.relay(batch_size=2), 5)
+
+        # Two full batches and a short one that ends the run
+        self.assertEqual(locked.call_count, 3)
+        locked.assert_called_with(skip_locked=True)
+        self.assertEqual([c.kwargs["kwargs"]["n"] for c in self.send_task.call_args_list], [0, 1, 2, 3, 4])
+        self.assertFalse(OutboxMessage.objects.exists())
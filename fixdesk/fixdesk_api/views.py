@@ -4,11 +4,14 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from .tasks import send_mail
+from . import notifications, outbox
+from .tasks import notify
+from .filters import UserFilter, OrganizationFilter
 
 import random
 import string
@@ -56,14 +59,14 @@ class OrganizationViewSet(viewsets.ModelViewSet):
     serializer_class = OrganizationSerializer
     http_method_names = ['get', 'post', 'put', 'patch']
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['slug']
+    filterset_class = OrganizationFilter
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     http_method_names = ['get', 'post', 'put', 'patch']
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['email']
+    filterset_class = UserFilter
 
 class IssuesViewSet(viewsets.ModelViewSet):
     queryset = Issues.objects.select_related('organization', 'reported_by')
@@ -72,6 +75,7 @@ class IssuesViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'reported_by']
 
+    @transaction.atomic
     def partial_update(self, request, *args, **kwargs):
         issue = self.get_object()
         new_status = request.data.get('status')
@@ -80,31 +84,8 @@ class IssuesViewSet(viewsets.ModelViewSet):
         if new_status and new_status != issue.status:
             issue.status = new_status
             issue.save(update_fields=['status'])
-
-            context = {
-                'organization': issue.organization.slug,
-                'ticket_id': f'TK-{issue.id[:3]}',
-                'title': issue.title,
-                'description': issue.description,
-                'date': issue.created_at,
-                'status': new_status
-            }
-
-            status_messages = {
-                'completed': (f'Issue TK-{issue.id[:3]} Resolved', 'issue_status'),
-                'pending': (f'Issue TK-{issue.id[:3]} Reopened', 'issue_status'),
-            }
-
-            if new_status in status_messages:
-                subject, mail_type = status_messages[new_status]
-                send_mail.apply_async(
-                    kwargs={
-                        'subject': subject,
-                        'to_email': issue.reported_by.email,
-                        'context': context,
-                        'type': mail_type
-                    }
-                )
+            if new_status in notifications.ISSUE_STATUS_SUBJECTS:
+                outbox.enqueue(notify, event="issue.status", ids={'issue_id': str(issue.id)})
 
         # Handle other fields separately
         data = {k: v for k, v in request.data.items() if k != 'status'}
@@ -116,46 +97,13 @@ class IssuesViewSet(viewsets.ModelViewSet):
 
         return Response({'status': 'updated'}, status=status.HTTP_200_OK)
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         response = super().create(request, *args, **kwargs)
-        issue = Issues.objects.select_related('organization', 'reported_by').get(id=response.data['id'])
-        
-        context = {
-            'organization': issue.organization.slug,
-            'ticket_id': 'TK-'+str(issue.id)[:3],
-            'title': issue.title,
-            'description': issue.description,
-            'reported_by': issue.reported_by.first_name + ' ' + issue.reported_by.last_name,
-            'date': issue.created_at,
-        }
-
-        # To Admins - Use values_list to avoid loading full User objects
-        admin_emails = list(User.objects.filter(
-            organization=issue.organization, 
-            role='admin'
-        ).values_list('email', flat=True))
-        
-        send_mail.apply_async(
-            kwargs={
-                'subject': "New Issue Reported",
-                'to_email': admin_emails,
-                'context': context,
-                'type': "admin"
-            }
-        )
-
-        # To User
-        send_mail.apply_async(
-            kwargs={
-                'subject': "Issue Reported Successfully",
-                'to_email': issue.reported_by.email,
-                'context': context,
-                'type': "user"
-            }
-        )
+        outbox.enqueue(notify, event="issue.created", ids={'issue_id': str(response.data['id'])})
 
         return response
 
@@ -166,52 +114,11 @@ class ConversationsViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['issue']
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
-        message = request.data.get('message')
-        issue = Issues.objects.select_related('organization', 'reported_by').get(id=request.data.get('issue'))
-        sender = User.objects.get(id=request.data.get('sender'))
-
-        if sender.role == 'admin':
-            context = {
-                'organization': issue.organization.slug,
-                'message': message,
-                'ticket_id': 'TK-'+str(issue.id)[:3],
-                'sender': sender.first_name + ' ' + sender.last_name,
-            }
-
-            send_mail.apply_async(
-                kwargs={
-                    'subject': f"New Message on Issue (ID: {context.get('ticket_id')})",
-                    'to_email': [issue.reported_by.email],
-                    'context': context,
-                    'type': "message"
-                }
-            )
-
-            return super().create(request, *args, **kwargs)
-
-        else:
-            context = {
-                'organization': issue.organization.slug,
-                'message': message,
-                'ticket_id': 'TK-'+str(issue.id)[:3],
-                'sender': sender.first_name + ' ' + sender.last_name,
-            }
-
-            admin_emails = list(User.objects.filter(
-                organization=issue.organization, 
-                role='admin'
-            ).values_list('email', flat=True))
-            
-            send_mail.apply_async(
-                kwargs={
-                    'subject': f"New Message on Issue (ID: {context.get('ticket_id')})",
-                    'to_email': admin_emails,
-                    'context': context,
-                    'type': "message"
-                }
-            )
-            return super().create(request, *args, **kwargs)
+        response = super().create(request, *args, **kwargs)
+        outbox.enqueue(notify, event="conversation.created", ids={'conversation_id': str(response.data['id'])})
+        return response
         
 class TasksViewSet(viewsets.ModelViewSet):
     queryset = Tasks.objects.select_related('organization').prefetch_related('assigned_to')
@@ -220,41 +127,17 @@ class TasksViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'assigned_to']
 
+    @transaction.atomic
     def partial_update(self, request, *args, **kwargs):
         task = self.get_object()
         new_status = request.data.get('status')
-        id = request.data.get('id')
 
         # Handle status change independently
         if new_status and new_status != task.status:
             task.status = new_status
             task.save(update_fields=['status'])
-
-        context = {
-            'organization': task.organization.slug,
-            'task_id': f'TSK-{id[:3]}',
-            'title': task.title,
-            'description': task.description,
-            'due_date': task.due_date,
-            'status': new_status
-        }
-
-        status_messages = {
-            'completed': (f'{context.get("task_id")} Completed', 'task_status'),
-            'pending': (f'Task {context.get("task_id")} Reopened', 'task_status'),
-        }
-
-        if new_status in status_messages:
-            subject, mail_type = status_messages[new_status]
-            for user in task.assigned_to.all():
-                send_mail.apply_async(
-                    kwargs={
-                        'subject': subject,
-                        'to_email': user.email,
-                        'context': context,
-                        'type': mail_type
-                    }
-                )
+            if new_status in notifications.TASK_STATUS_SUBJECTS:
+                outbox.enqueue(notify, event="task.status", ids={'task_id': str(task.id)})
 
         # Handle other fields separately
         data = {k: v for k, v in request.data.items() if k != 'status'}
@@ -266,34 +149,13 @@ class TasksViewSet(viewsets.ModelViewSet):
 
         return Response({'status': 'updated'}, status=status.HTTP_200_OK)
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         response = super().create(request, *args, **kwargs)
-        task = Tasks.objects.select_related('organization', 'assigned_by').prefetch_related('assigned_to').get(id=response.data['id'])
-        assigned_users = task.assigned_to.all()
-
-        context = {
-            'organization': task.organization.slug,
-            'assigned_by': task.assigned_by.first_name + ' ' + task.assigned_by.last_name,
-            'assigned_to': ', '.join([user.first_name + ' ' + user.last_name for user in assigned_users]),
-            'task_id': 'TSK-'+str(task.id)[:3],
-            'title': task.title,
-            'description': task.description,
-            'priority': task.priority,
-            'due_date': task.due_date,
-        }
-
-        for user in assigned_users:
-            send_mail.apply_async(
-                kwargs={
-                    'subject': "New Task Assigned",
-                    'to_email': user.email,
-                    'context': context,
-                    'type': "task"
-                }
-            )
+        outbox.enqueue(notify, event="task.created", ids={'task_id': str(response.data['id'])})
 
         return response
 
@@ -304,32 +166,11 @@ class CommentsViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['task', 'commenter']
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
-        comment_text = request.data.get('message')
-        task = Tasks.objects.select_related('organization').get(id=request.data.get('task'))
-        commenter = User.objects.get(id=request.data.get('commenter'))
-
-        context = {
-            'organization': task.organization.slug,
-            'comment': comment_text,
-            'task_id': 'TSK-'+str(task.id)[:3],
-            'commenter': commenter.first_name + ' ' + commenter.last_name,
-        }
-
-        all_users = set(task.assigned_to.values_list('id', flat=True)) | set(request.data.get('mentioned_users', []))
-        all_users = User.objects.filter(id__in=all_users)
-        for user in all_users:
-            if user.id != commenter.id:
-                send_mail.apply_async(
-                    kwargs={
-                        'subject': f"New Comment on Task (ID: {context.get('task_id')})",
-                        'to_email': user.email,
-                        'context': context,
-                        'type': "comment"
-                    }
-                )
-
-        return super().create(request, *args, **kwargs)
+        response = super().create(request, *args, **kwargs)
+        outbox.enqueue(notify, event="comment.created", ids={'comment_id': str(response.data['id'])})
+        return response
 
 def generate_verification_code():
     """Generates a unique 5-digit code for VerificationCode."""
@@ -352,6 +193,7 @@ class VerificationCodeViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['code']
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         # Generate a unique verification code
         code = generate_verification_code()
@@ -362,33 +204,17 @@ class VerificationCodeViewSet(viewsets.ModelViewSet):
         except User.DoesNotExist:
             user = None
 
-        context = {
-            'organization': user.organization.slug if user else None,
-            'verification_code': code
-        }
-
-        if user:
-            send_mail.apply_async(
-                kwargs={
-                    'subject': "Reset your Helpdesk Password",
-                    'to_email': user.email,
-                    'context': context,
-                    'type': "verify"
-                }
-            )
-        else:
-            send_mail.apply_async(
-                kwargs={
-                    'subject': "Activate your account",
-                    'to_email': email,
-                    'context': context,
-                    'type': "activate"
-                }
-            )
         if user:
             verification_code = VerificationCode.objects.create(user=user, code=code)
         else:
             verification_code = VerificationCode.objects.create(code=code)
+
+        # The address is passed along only when there is no user row to read it from
+        outbox.enqueue(
+            notify,
+            event="verification.created",
+            ids={'verification_code_id': str(verification_code.id), 'email': None if user else email}
+        )
         serializer = self.get_serializer(verification_code)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -399,6 +225,7 @@ class InvitationViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['email', 'organization']
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         email = request.data.get('email')
         organization_id = request.data.get('organization')
@@ -420,22 +247,6 @@ class InvitationViewSet(viewsets.ModelViewSet):
             token=token
         )
 
-        context = {
-            'organization': organization.slug,
-            'email': email,
-            'role': role,
-            'department': department,
-            'token': token,
-            "link": f"https://fixdesk.ng/activate?token={token}"
-        }
-
-        send_mail.apply_async(
-            kwargs={
-                'subject': f"Invitation to join {organization.name} on Helpdesk",
-                'to_email': email,
-                'context': context,
-                'type': "activate"
-            }
-        )
+        outbox.enqueue(notify, event="invitation.created", ids={'invitation_id': str(invitation.id)})
         serializer = self.get_serializer(invitation)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
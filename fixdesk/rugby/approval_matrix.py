@@ -1,40 +1,9 @@
-def approval_matrix(type, role, department):
-    APPROVAL_MATRIX = {
-        "procurementrequest": {
-            "Non-Academic - Procurement": {
-                "team_lead": ["Non-Academic - Accounting"],
-                "staff": ["Team Lead", "Non-Academic - Accounting"],
-            },
-            "*": {
-                "team_lead": ["Non-Academic - Procurement", "Non-Academic - Accounting"],
-                "staff": ["Team Lead", "Non-Academic - Procurement", "Non-Academic - Accounting"],
-            },
-        },
-        "leaverequest": {
-            "Non-Academic - HR": {
-                "team_lead": ["Senior Leadership Team"],
-                "staff": ["Team Lead", "Senior Leadership Team"],
-            },
-            "Senior Leadership Team": {
-                "team_lead": ["Non-Academic - HR"],
-                "staff": ["Team Lead", "Non-Academic - HR"],
-            },
-            "*": {
-                "team_lead": ["Non-Academic - HR", "Senior Leadership Team"],
-                "staff": ["Team Lead", "Non-Academic - HR", "Senior Leadership Team"],
-            },
-        },
-    }
-
-    type_rules = APPROVAL_MATRIX.get(type)
-    if not type_rules:
-        return {}, 0
+from . import routing
 
-    dept_rules = type_rules.get(department) or type_rules.get("*")
-    if not dept_rules:
-        return {}, 0
 
-    level_titles = dept_rules.get(role)
+def approval_matrix(type, role, department):
+    # Levels come from the approval rules in routing_rules.json
+    level_titles = routing.approval_levels(type, department, role)
     if not level_titles:
         return {}, 0
 
@@ -64,32 +33,7 @@ def resolve_approvers(title: str, requester, User_model) -> list[dict]:
     Returns a list of approvers for this level as:
     [{"id": <uuid>, "email": "<email>"}]
     """
-
-    def dept_team_leads(dept_name: str) -> list[dict]:
-        return list(
-            User_model.objects
-            .filter(department=dept_name, role="team_lead")
-            .values("id", "email")
-        )
-
-    title = title.strip().lower()
-
-    if title == "team lead":
-        return dept_team_leads(requester.department)
-
-    if title == "Non-Academic - HR":
-        return dept_team_leads("Non-Academic - HR")
-
-    if title == "Non-Academic - Procurement":
-        return dept_team_leads("Non-Academic - Procurement")
-
-    if title == "Non-Academic - Accounting":
-        return dept_team_leads("Non-Academic - Accounting")
-
-    if title == "Senior Leadership Team":
-        return dept_team_leads("Senior Leadership Team")
-
-    return []
+    return routing.approvers(title.strip(), requester.department)
 
 def attach_approvers_to_approval_info(approval_info: dict, requester, User_model) -> dict:
     for _, level_data in approval_info.items():
@@ -3,3 +3,51 @@ from django.apps import AppConfig
 
 class RugbyConfig(AppConfig):
     name = 'rugby'
+
+    def ready(self):
+        from celery.signals import worker_init, worker_process_init
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_save
+
+        from . import mailer  # registers the notification templates (checked at startup)
+        from . import recipients
+        from . import routing  # registers the routing rules check
+
+        # Keep routing's department/role recipient index in step with users
+        post_save.connect(recipients.user_saved, sender=settings.AUTH_USER_MODEL, dispatch_uid="rugby.recipients.saved")
+        post_delete.connect(recipients.user_deleted, sender=settings.AUTH_USER_MODEL, dispatch_uid="rugby.recipients.deleted")
+
+        # Prefork children are recycled every worker_max_tasks_per_child tasks;
+        # unwrap the keyring, compile the notification templates and routing
+        # rules and build the recipient index in each new child before it
+        # picks up work.
+        worker_process_init.connect(self.warm_up, weak=False, dispatch_uid="rugby.warm_up")
+        # The threads and solo pools run tasks in the main worker process,
+        # where worker_process_init never fires
+        worker_init.connect(self.warm_up_worker, weak=False, dispatch_uid="rugby.warm_up_worker")
+
+    def warm_up(self, **kwargs):
+        from django.db import DatabaseError
+
+        from fixdesk.utils import mail_templates
+        from . import recipients, routing
+        from .keys import warm_up
+
+        warm_up()
+        mail_templates.warm_up()
+        routing.rules()
+        try:
+            recipients.get_index()
+        except DatabaseError:
+            # Not migrated yet (e.g. during deploy); built on first use instead
+            pass
+
+    def warm_up_worker(self, **kwargs):
+        from django.core.cache import caches
+        from django.db import connections
+
+        self.warm_up()
+        # Prefork children are forked from this process after it; like
+        # wsgi.py, don't let them share the sockets warm_up opened
+        connections.close_all()
+        caches.close_all()
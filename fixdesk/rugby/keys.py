@@ -1,11 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+
 from django.core.cache import cache
-from django.db import transaction
+from django.db import connections, transaction, DatabaseError, IntegrityError, DEFAULT_DB_ALIAS
+from django.db.models import Max
 from django.apps import apps
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from .crypto import new_dek
-from .keywrap_local import wrap_dek, unwrap_dek
+from .keywrap_local import wrap_dek, unwrap_dek, derive_key
+from fixdesk.utils import metrics
 
 CACHE_TTL = 300  # seconds
 
+# Process-local cache of ready AESGCM objects, keyed by key version.
+# Saves the shared-cache round-trip and the AES key schedule per field.
+LOCAL_CACHE_TTL = CACHE_TTL  # seconds
+LOCAL_CACHE_MAX = 256  # versions, across all tenant keyrings
+
+_ciphers = OrderedDict()  # version -> (expires_at, AESGCM)
+_ciphers_lock = threading.Lock()
+
+# Current version per keyring is held in memory and only re-read from the
+# shared cache every CURRENT_VERSION_RECHECK seconds; rotate_key() publishes
+# new versions. Keyrings are per organization; None is the global keyring.
+# Versions are unique across all keyrings, so a ciphertext's version header
+# alone identifies its DEK and decryption never needs the tenant.
+CURRENT_VERSION_KEY = "keyring:current"
+CURRENT_VERSION_RECHECK = 30  # seconds
+
+_current = {}  # str(organization_id) or None -> (version, checked_at)
+
+# New keyrings are committed on their own, on this second connection to the
+# default database, so a caller's rollback cannot take away a DEK that other
+# writes (e.g. to the rugby database) already used. See ensure_keyring_initialized.
+KEYRING_DB = "keyring"
+
+# Versions created inside a caller's transaction that has not committed yet:
+# usable in that transaction but never cached or advertised, since a
+# rollback frees the version number for a different DEK.
+_pending = set()
+
+# Within the transaction that created a pending version, its cipher is
+# cached here rather than in _ciphers, so repeated encrypts don't each pay a
+# Keyring query and an unwrap. _holds remembers that transaction's connection
+# and on_commit callback; see _hold_is_open.
+_holds = {}  # version -> (connection, on_commit callback)
+_pending_ciphers = {}  # version -> AESGCM
+
+# Blind indexes must survive DEK rotation, so their key comes from the master key
+INDEX_KEY_LABEL = b"blind-index:v1"
+
+_index_key = None
+
+_cipher_hits = metrics.Metric("keys.cipher_cache", result="hit")
+_cipher_misses = metrics.Metric("keys.cipher_cache", result="miss")
+_dek_hits = metrics.Metric("keys.dek_cache", result="hit")
+_dek_misses = metrics.Metric("keys.dek_cache", result="miss")
+_unwraps = metrics.Metric("keys.unwrap")
+_current_lookups = metrics.Metric("keys.keyring_lookup", kind="current")
+_dek_lookups = metrics.Metric("keys.keyring_lookup", kind="dek")
+_warm_up_lookups = metrics.Metric("keys.keyring_lookup", kind="warm_up")
+
 
 def get_keyring_model():
     return apps.get_model("fixdesk_api", "Keyring")
@@ -15,26 +71,149 @@ def _cache_key(version: int) -> str:
     return f"dek:v{version}"
 
 
-@transaction.atomic
-def ensure_keyring_initialized():
+def _tenant(organization_id):
+    # UUID or str (e.g. from a task argument); one form for the cache keys
+    return None if organization_id is None else str(organization_id)
+
+
+def _current_version_key(tenant) -> str:
+    if tenant is None:
+        return CURRENT_VERSION_KEY
+    return f"{CURRENT_VERSION_KEY}:{tenant}"
+
+
+def _create_keyring(organization_id=None, using=DEFAULT_DB_ALIAS):
     Keyring = get_keyring_model()
 
-    kr = Keyring.objects.order_by("-version").first()
+    dek = new_dek()
+    wrapped, nonce = wrap_dek(dek)
+
+    # Next global version; retry if another process claimed it first. Skip
+    # past our own uncommitted versions, which another connection cannot see
+    # but would wait on.
+    for attempt in range(5):
+        version = max(Keyring.objects.using(using).aggregate(v=Max("version"))["v"] or 0, *_pending, 0) + 1
+        try:
+            with transaction.atomic(using=using):
+                return Keyring.objects.using(using).create(
+                    organization_id=organization_id,
+                    version=version,
+                    dek_wrapped=wrapped,
+                    dek_nonce=nonce
+                )
+        except IntegrityError:
+            if attempt == 4:
+                raise
+
+
+def _commit_alias(organization_id):
+    """
+    The connection a new keyring can be committed on right away, or None if
+    it has to join the caller's transaction.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        return DEFAULT_DB_ALIAS  # autocommit
+    # SQLite allows one writer, which the caller may already be
+    if KEYRING_DB not in connections.databases or connections[KEYRING_DB].vendor == "sqlite":
+        return None
+    # An organization created in the caller's transaction is not visible
+    # (and cannot be referenced) from another connection yet
+    if organization_id is not None:
+        Organization = apps.get_model("fixdesk_api", "Organization")
+        if not Organization.objects.using(KEYRING_DB).filter(id=organization_id).exists():
+            return None
+    return KEYRING_DB
+
+
+def _hold_until_commit(version: int, organization_id=None):
+    _pending.add(version)
+
+    def publish():
+        _pending.discard(version)
+        _holds.pop(version, None)
+        cipher = _pending_ciphers.pop(version, None)
+        if cipher is not None:
+            _remember_cipher(version, cipher, time.monotonic())
+        _publish_current_version(version, organization_id)
+
+    _holds[version] = (transaction.get_connection(), publish)
+    transaction.on_commit(publish)
+
+
+def _hold_is_open(version: int) -> bool:
+    """
+    True while the transaction that created pending `version` is still open
+    in this thread. Django has no rollback hook: a rollback (of the
+    transaction or of the savepoint the version was created in) shows as
+    our on_commit callback missing from the connection's queue, and drops
+    whatever was cached for the version.
+    """
+    hold = _holds.get(version)
+    if hold is None:
+        return False
+    connection, publish = hold
+    if connection is not transaction.get_connection():
+        return False  # another thread's transaction
+    if any(func is publish for _, func, _ in connection.run_on_commit):
+        return True
+    _holds.pop(version, None)
+    _pending_ciphers.pop(version, None)
+    return False
+
+
+def ensure_keyring_initialized(organization_id=None):
+    Keyring = get_keyring_model()
+
+    kr = Keyring.objects.filter(organization_id=organization_id).order_by("-version").first()
     if kr:
         return kr
 
-    dek = new_dek()
-    wrapped, nonce = wrap_dek(dek)
+    using = _commit_alias(organization_id)
+    if using is not None:
+        kr = _create_keyring(organization_id, using=using)
+        _pending.discard(kr.version)
+        return kr
+
+    # Lives and dies with the caller's transaction (e.g. together with the
+    # organization it belongs to); advertised only once that commits
+    kr = _create_keyring(organization_id)
+    _hold_until_commit(kr.version, organization_id)
+    return kr
 
-    return Keyring.objects.create(
-        version=1,
-        dek_wrapped=wrapped,
-        dek_nonce=nonce
-    )
 
+def _publish_current_version(version: int, organization_id=None):
+    tenant = _tenant(organization_id)
+    cache.set(_current_version_key(tenant), version, CACHE_TTL)
+    _current[tenant] = (version, time.monotonic())
 
-def get_current_version() -> int:
-    return ensure_keyring_initialized().version
+
+def get_current_version(organization_id=None) -> int:
+    now = time.monotonic()
+    tenant = _tenant(organization_id)
+    entry = _current.get(tenant)
+    if entry and now - entry[1] < CURRENT_VERSION_RECHECK:
+        return entry[0]
+
+    ck = _current_version_key(tenant)
+    version = cache.get(ck)
+    if version is None:
+        start = time.perf_counter()
+        version = ensure_keyring_initialized(organization_id).version
+        _current_lookups.observe(time.perf_counter() - start)
+        if version in _pending:
+            return version
+        cache.set(ck, version, CACHE_TTL)
+    else:
+        # Published, so committed (possibly reusing a rolled-back number)
+        _pending.discard(version)
+
+    _current[tenant] = (version, now)
+
+    # Rotated in by another process: load it now, not on the next encrypt
+    if entry and version != entry[0]:
+        warm_up()
+
+    return version
 
 
 def get_dek(version: int) -> bytes:
@@ -43,29 +222,129 @@ def get_dek(version: int) -> bytes:
     ck = _cache_key(version)
     dek = cache.get(ck)
     if dek:
+        _dek_hits.incr()
         return dek
 
+    _dek_misses.incr()
+    start = time.perf_counter()
     kr = Keyring.objects.get(version=version)
-    dek = unwrap_dek(bytes(kr.dek_wrapped), bytes(kr.dek_nonce))
+    _dek_lookups.observe(time.perf_counter() - start)
 
-    cache.set(ck, dek, CACHE_TTL)
+    dek = _unwrap(kr)
+    if version not in _pending:
+        cache.set(ck, dek, CACHE_TTL)
     return dek
 
 
-@transaction.atomic
-def rotate_key() -> int:
+def _unwrap(kr) -> bytes:
+    start = time.perf_counter()
+    dek = unwrap_dek(bytes(kr.dek_wrapped), bytes(kr.dek_nonce))
+    _unwraps.observe(time.perf_counter() - start)
+    return dek
+
+
+def get_cipher(version: int) -> AESGCM:
+    now = time.monotonic()
+
+    entry = _ciphers.get(version)
+    if entry and entry[0] > now:
+        _cipher_hits.incr()
+        return entry[1]
+
+    if version in _pending:
+        return _get_pending_cipher(version)
+
+    _cipher_misses.incr()
+    cipher = AESGCM(get_dek(version))
+    _remember_cipher(version, cipher, now)
+    return cipher
+
+
+def _get_pending_cipher(version: int) -> AESGCM:
+    if not _hold_is_open(version):
+        _cipher_misses.incr()
+        return AESGCM(get_dek(version))
+
+    cipher = _pending_ciphers.get(version)
+    if cipher is not None:
+        _cipher_hits.incr()
+        return cipher
+
+    _cipher_misses.incr()
+    cipher = _pending_ciphers[version] = AESGCM(get_dek(version))
+    return cipher
+
+
+def _remember_cipher(version: int, cipher: AESGCM, now: float):
+    with _ciphers_lock:
+        _ciphers[version] = (now + LOCAL_CACHE_TTL, cipher)
+        _ciphers.move_to_end(version)
+        while len(_ciphers) > LOCAL_CACHE_MAX:
+            _ciphers.popitem(last=False)
+
+
+def get_index_key() -> bytes:
+    global _index_key
+    if _index_key is None:
+        _index_key = derive_key(INDEX_KEY_LABEL)
+    return _index_key
+
+
+def warm_up() -> int:
+    """
+    Unwraps the current version of every keyring (newest first, up to
+    LOCAL_CACHE_MAX) into the process-local cache with a single Keyring
+    query, so a fresh web worker or Celery child doesn't pay for it on its
+    first request. Versions already cached are skipped, which makes it cheap
+    to call again after a rotation. Returns the number of versions unwrapped.
+    """
     Keyring = get_keyring_model()
+    latest = Keyring.objects.values("organization_id").annotate(v=Max("version")).values("v")
+    start = time.perf_counter()
+    try:
+        rows = list(Keyring.objects.filter(version__in=latest).order_by("-version")[:LOCAL_CACHE_MAX])
+    except DatabaseError:
+        # Not migrated yet (e.g. during deploy); the lazy path takes over
+        return 0
+    _warm_up_lookups.observe(time.perf_counter() - start)
 
-    current = ensure_keyring_initialized()
-    new_version = current.version + 1
+    now = time.monotonic()
+    loaded = 0
+    for kr in reversed(rows):
+        if kr.version in _pending:
+            continue
+        _current.setdefault(_tenant(kr.organization_id), (kr.version, now))
 
-    dek = new_dek()
-    wrapped, nonce = wrap_dek(dek)
+        entry = _ciphers.get(kr.version)
+        if entry and entry[0] > now:
+            continue
 
-    Keyring.objects.create(
-        version=new_version,
-        dek_wrapped=wrapped,
-        dek_nonce=nonce
-    )
+        dek = _unwrap(kr)
+        cache.set(_cache_key(kr.version), dek, CACHE_TTL)
+        _remember_cipher(kr.version, AESGCM(dek), now)
+        loaded += 1
+
+    get_index_key()
+    return loaded
+
+
+def clear_local_cache():
+    with _ciphers_lock:
+        _ciphers.clear()
+    _pending_ciphers.clear()
+    _current.clear()
+
+
+@transaction.atomic
+def rotate_key(organization_id=None) -> int:
+    """
+    Adds a new version to one keyring (the organization's, or the global
+    one) and makes it current for new writes. Other keyrings are untouched.
+    """
+    new_version = _create_keyring(organization_id).version
+
+    # Only advertise (or cache) the new version once the row is visible to other workers
+    _hold_until_commit(new_version, organization_id)
 
     return new_version
+
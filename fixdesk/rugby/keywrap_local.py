@@ -1,10 +1,15 @@
 import os, base64
+from functools import lru_cache
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from .crypto import new_nonce
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# Env var is read and decoded once per process; wrap/unwrap run on every DEK miss
+@lru_cache(maxsize=1)
 def _master_key() -> bytes:
     b64 = os.getenv("APP_MASTER_KEY")
     if not b64:
@@ -14,12 +19,18 @@ def _master_key() -> bytes:
         raise RuntimeError("Master key must be 32 bytes (after base64 decode).")
     return mk
 
+@lru_cache(maxsize=1)
+def _master_aead() -> AESGCM:
+    return AESGCM(_master_key())
+
 def wrap_dek(dek: bytes) -> tuple[bytes, bytes]:
-    mk = _master_key()
     nonce = new_nonce()
-    wrapped = AESGCM(mk).encrypt(nonce, dek, b"dek-wrap:v1")
+    wrapped = _master_aead().encrypt(nonce, dek, b"dek-wrap:v1")
     return wrapped, nonce
 
 def unwrap_dek(wrapped: bytes, nonce: bytes) -> bytes:
-    mk = _master_key()
-    return AESGCM(mk).decrypt(nonce, wrapped, b"dek-wrap:v1")
+    return _master_aead().decrypt(nonce, wrapped, b"dek-wrap:v1")
+
+def derive_key(label: bytes) -> bytes:
+    # Independent sub-key of the master key (e.g. for blind indexes)
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=label).derive(_master_key())
@@ -1,41 +1,52 @@
-import os
-import smtplib, ssl
 from email.message import EmailMessage
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from django.template.loader import render_to_string
+import logging
 
-def send_mail(subject, to_email, context, type, action):
-    port = 587
-    smtp_server =os.getenv('SMTP_SERVER')
-    username=os.getenv('EMAIL_USER')
-    password =os.getenv('EMAIL_PASSWORD')
-    
-    html_content = render_to_string(f'rugby/{type}/{action}.html', context)
+from fixdesk.utils import delivery, mail_templates
+
+logger = logging.getLogger(__name__)
+
+# (type, action) -> template; every notify() call site must have an entry here
+TEMPLATES = {
+    (type, action): f'rugby/{type}/{action}.html'
+    for type in ("issue", "task", "leaverequest", "facilityrequest", "procurementrequest")
+    for action in ("creation", "status", "comment")
+}
+TEMPLATES[("milestone", "creation")] = 'rugby/milestone/creation.html'
+TEMPLATES[("milestone", "status")] = 'rugby/milestone/status.html'
+TEMPLATES[("digest", None)] = 'rugby/digest.html'
+
+mail_templates.register("rugby", TEMPLATES)
+
+def build_message(subject, to_email, context, type, action):
+    try:
+        html_content = mail_templates.render("rugby", type, action, context)
+    except mail_templates.UnknownTemplate:
+        logger.error("Skipping %s/%s notification: no template registered", type, action)
+        return None
 
     msg = EmailMessage()
     msg['Subject'] = subject
     msg['From'] = f"HelpDesk <rugby@fixdesk.ng>"
     msg['To'] = to_email
     msg.set_content(html_content, subtype='html')
-    
-    try:
-        if port == 465:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                server.login(username, password)
-                server.send_message(msg)
-        elif port == 587:
-            with smtplib.SMTP(smtp_server, port) as server:
-                server.starttls()
-                server.login(username, password)
-                server.send_message(msg)
-        else:
-            print ("use 465 / 587 as port value")
-            exit()
-        return True
-    except Exception as e:
-        print (e)
+    return msg
+
+def deliver(msg):
+    # Reuses an authenticated session from the worker's pool, paced by the
+    # shared rate limit; returns None or the exception
+    return delivery.deliver_sync([msg])[0]
+
+def send_mail(subject, to_email, context, type, action):
+    msg = build_message(subject, to_email, context, type, action)
+    if msg is None:
+        return False
+
+    error = deliver(msg)
+    if error is not None:
+        logger.error("Sending %s/%s notification failed: %s", type, action, error)
         return False
+    return True
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:26
+
+import django.core.serializers.json
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rugby', '0002_facilityrequest_attachment_key_issues_attachment_key_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingNotification',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('recipient', models.EmailField(max_length=254)),
+                ('type', models.CharField(max_length=20)),
+                ('action', models.CharField(max_length=20)),
+                ('object_id', models.CharField(max_length=64)),
+                ('subject', models.CharField(max_length=200)),
+                ('context', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('flush_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['recipient', 'type', 'object_id'], name='rugby_pendi_recipie_b6adbb_idx')],
+            },
+        ),
+    ]
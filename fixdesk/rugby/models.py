@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import BaseUserManager
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 
 import uuid
 
@@ -211,6 +212,24 @@ class Comments_Requests(UUIDModel):
     def __str__(self):
         return f"{self.message[:25]}..."
 
+class PendingNotification(UUIDModel):
+    # Events held back for a digest; one open window per (recipient, type, object_id)
+    recipient = models.EmailField()
+    type = models.CharField(max_length=20)
+    action = models.CharField(max_length=20)
+    object_id = models.CharField(max_length=64)
+    subject = models.CharField(max_length=200)
+    context = models.JSONField(encoder=DjangoJSONEncoder)
+    flush_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['recipient', 'type', 'object_id'])]
+
+    def __str__(self):
+        return f"{self.recipient}: {self.subject}"
+
 # --------------------------------------------------------------------------------------------------------
 # Encryption
 
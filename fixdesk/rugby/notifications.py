@@ -0,0 +1,248 @@
+"""
+Rugby notification events, hydrated in the worker.
+
+Views call tasks.notify() with an event name, the primary keys it concerns
+and the recipients the inclusion matrix picked; the handler registered here
+loads the rows and returns the subject and template context. Broker
+messages carry ids rather than titles, descriptions and names, and the
+mail shows the rows as committed. Contexts come back flattened to
+JSON-safe values so a digest can buffer them (see tasks.buffer_digest).
+"""
+import datetime
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import models
+
+from .models import ActivityLog, Comments, Comments_Requests, FacilityRequest, Issues, LeaveRequest, Milestone, ProcurementRequest, Tasks
+
+Mail = namedtuple("Mail", "subject context")
+
+# Types kombu's json serializer round-trips; anything else is flattened to text
+JSON_SAFE_TYPES = (str, int, float, bool, datetime.datetime, datetime.date, uuid.UUID, Decimal)
+
+EVENTS = {}
+
+
+class UnknownEvent(LookupError):
+    pass
+
+
+def event(name):
+    def register(handler):
+        EVENTS[name] = handler
+        return handler
+    return register
+
+
+def build(name, ids):
+    """The Mail for event `name`, or None when its rows are gone."""
+    try:
+        handler = EVENTS[name]
+    except KeyError:
+        raise UnknownEvent(name) from None
+    mail = handler(**ids)
+    if mail is None:
+        return None
+    return mail._replace(context=mail_context(mail.context))
+
+
+def _display_name(user):
+    name = " ".join(str(n) for n in (user.first_name, user.last_name) if n)
+    return name or user.email
+
+
+def _plain(value):
+    # Exact type check: lazy EncryptedText proxies pass isinstance(value, str)
+    if value is None or type(value) in JSON_SAFE_TYPES:
+        return value
+    if isinstance(value, get_user_model()):
+        return _display_name(value)
+    if isinstance(value, models.Manager):
+        return ", ".join(_plain(v) for v in value.all())
+    return str(value)
+
+
+def mail_context(context):
+    return {key: _plain(value) for key, value in context.items()}
+
+
+def _name(user):
+    return f"{user.first_name} {user.last_name}"
+
+
+def _initials(user):
+    return f"{str(user.first_name or '')[:1]}{str(user.last_name or '')[:1]}"
+
+
+CASES = {
+    'issue': Issues,
+    'task': Tasks,
+    'facilityrequest': FacilityRequest,
+    'procurementrequest': ProcurementRequest,
+    'leaverequest': LeaveRequest,
+}
+
+# subject -> (model, title field, description field) for requests
+REQUESTS = {
+    'leaverequest': (LeaveRequest, 'reason', 'notes'),
+    'facilityrequest': (FacilityRequest, 'location', 'description'),
+    'procurementrequest': (ProcurementRequest, 'center_code', 'justification'),
+}
+
+REQUEST_SUBJECTS = {
+    'leaverequest': "New Leave Request",
+    'facilityrequest': "New Facility Request",
+    'procurementrequest': "New procurement Request",
+}
+
+ACTIVITY_SUBJECTS = {
+    'creation': 'New {label} Created',
+    'status': '{label} Status Update',
+    'assigned': '{label} Assigned to You',
+    'comment': 'New comment on {label}',
+}
+
+
+def _reporter(obj):
+    for field in ('reported_by', 'requested_by', 'requester'):
+        user = getattr(obj, field, None)
+        if user is not None:
+            return _name(user)
+    return None
+
+
+@event("activity.logged")
+def activity_logged(activity_log_id, subject, action, object_id, previous_status=None):
+    activity_log = ActivityLog.objects.filter(id=activity_log_id).first()
+    obj = CASES[subject].objects.filter(id=object_id).first()
+    if activity_log is None or obj is None:
+        return None
+
+    context = {
+        'id': str(object_id)[:3],
+        'user': _name(activity_log.user),
+        'title': getattr(obj, 'title', None),
+        'description': getattr(obj, 'description', None),
+        'date': activity_log.timestamp,
+        'due_date': getattr(obj, 'due_date', None),
+        'previous_status': previous_status,
+        'status': getattr(obj, 'status', None),
+        'reported_by': _reporter(obj),
+        'priority': getattr(obj, 'priority', None),
+        'assigned_to': getattr(obj, 'assigned_to', None),
+    }
+    return Mail(ACTIVITY_SUBJECTS[action].format(label=subject.capitalize()), context)
+
+
+@event("milestone.created")
+def milestone_created(milestone_id):
+    milestone = Milestone.objects.filter(id=milestone_id).first()
+    if milestone is None:
+        return None
+
+    context = {
+        'id': str(milestone.id)[:3],
+        'title': milestone.title,
+        'date': milestone.due_date,
+    }
+    return Mail("New Milestone Created", context)
+
+
+@event("milestone.status")
+def milestone_status(milestone_id, previous_status=None):
+    milestone = Milestone.objects.filter(id=milestone_id).first()
+    if milestone is None:
+        return None
+
+    context = {
+        'id': str(milestone.id)[:3],
+        'title': milestone.title,
+        'previous_status': previous_status,
+        'status': milestone.status,
+    }
+    return Mail("Milestone Updated", context)
+
+
+@event("issue.created")
+def issue_created(issue_id):
+    issue = Issues.objects.filter(id=issue_id).first()
+    if issue is None:
+        return None
+
+    context = {
+        'id': str(issue.id)[:3],
+        'title': issue.title,
+        'description': issue.description,
+        'date': issue.created_at,
+    }
+    return Mail("New Issue Created", context)
+
+
+@event("task.created")
+def task_created(task_id):
+    task = Tasks.objects.filter(id=task_id).first()
+    if task is None:
+        return None
+
+    context = {
+        'id': str(task.id)[:3],
+        'title': task.title,
+        'description': task.description,
+        'date': task.created_at,
+    }
+    return Mail("New Task Created", context)
+
+
+@event("request.created")
+def request_created(request_id, subject):
+    model, title, description = REQUESTS[subject]
+    obj = model.objects.filter(id=request_id).first()
+    if obj is None:
+        return None
+
+    context = {
+        'id': str(obj.id)[:3],
+        'title': getattr(obj, title),
+        'description': getattr(obj, description),
+        'date': obj.created_at,
+    }
+    return Mail(REQUEST_SUBJECTS[subject], context)
+
+
+def _comment_context(comment, case_id, title):
+    return {
+        'id': str(case_id)[:3],
+        'title': title,
+        'description': comment.message,
+        'date': comment.timestamp,
+        'commenter': _name(comment.commenter),
+        'commenter_initial': _initials(comment.commenter),
+    }
+
+
+@event("comment.created")
+def comment_created(comment_id, subject):
+    comment = Comments.objects.select_related('case').filter(id=comment_id).first()
+    if comment is None:
+        return None
+
+    context = _comment_context(comment, comment.case_id, comment.case.title)
+    return Mail(f"New Comment on {subject}", context)
+
+
+@event("request_comment.created")
+def request_comment_created(comment_id, subject):
+    comment = Comments_Requests.objects.filter(id=comment_id).first()
+    if comment is None:
+        return None
+
+    model, title, _ = REQUESTS[subject]
+    request = model.objects.filter(id=comment.request_id).first()
+    if request is None:
+        return None
+
+    context = _comment_context(comment, comment.request_id, getattr(request, title))
+    return Mail(f"New Comment on {subject}", context)
@@ -0,0 +1,131 @@
+"""
+Department/role recipient index for notification routing (routing.py).
+
+Every user's email is indexed under (department, None) and under
+(department, role), departments lowercased to match the matrix's
+case-insensitive lookups. The index is built with one query and held in
+process memory, so resolving an event's recipients is set arithmetic.
+
+User post_save/post_delete (connected in RugbyConfig.ready) drop the local
+copy and publish a new version to the cache once the transaction commits.
+Users are saved in web workers but routing runs in Celery workers, so this
+relies on the cache being shared (Redis, see fixdesk/utils/caches.py):
+other processes then compare versions every VERSION_RECHECK seconds and
+rebuild when it has moved. On a per-process cache (LocMemCache in dev) they
+never see the bump, and only LOCAL_MAX_AGE bounds how stale they get.
+queryset.update() and raw SQL send no signals, so the index is also rebuilt
+at least every MAX_AGE seconds.
+"""
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from fixdesk.utils import caches, metrics
+
+VERSION_KEY = "rugby:recipients:version"
+VERSION_RECHECK = 5  # seconds
+MAX_AGE = 300  # seconds
+LOCAL_MAX_AGE = 30  # seconds, when the cache is not shared between processes
+
+# User fields the index is built from; saves touching none of them (e.g.
+# update_last_login) leave it alone
+INDEXED_FIELDS = {"email", "department", "role"}
+
+EMPTY = frozenset()
+
+_index = None  # (version, built_at, checked_at, {(department, role): frozenset})
+_lock = threading.Lock()
+
+_hits = metrics.Metric("rugby.recipient_index", result="hit")
+_builds = metrics.Metric("rugby.recipient_index", result="build")
+
+
+class RecipientIndex:
+    def __init__(self, entries):
+        self._entries = entries
+
+    def department(self, department):
+        """Everyone in `department` (any case)."""
+        return self._entries.get(((department or "").lower(), None), EMPTY)
+
+    def role(self, department, role):
+        """Users in `department` with exactly `role`, e.g. "team_lead"."""
+        return self._entries.get(((department or "").lower(), role), EMPTY)
+
+
+def build():
+    entries = defaultdict(set)
+    # No address, nothing to send to; no department, never matched by a
+    # department lookup (department__iexact never matches NULL)
+    users = (
+        get_user_model().objects
+        .exclude(email="").exclude(email__isnull=True).exclude(department__isnull=True)
+        .values_list("department", "role", "email")
+    )
+    for department, role, email in users.iterator():
+        department = department.lower()
+        entries[(department, None)].add(email)
+        entries[(department, role)].add(email)
+    return {key: frozenset(emails) for key, emails in entries.items()}
+
+
+def _shared_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Never published, or evicted: claim a fresh one (first writer wins)
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_index():
+    global _index
+
+    now = time.monotonic()
+    current = _index
+    if current is not None:
+        version, built_at, checked_at, entries = current
+        if now - built_at < (MAX_AGE if caches.is_shared() else LOCAL_MAX_AGE):
+            if now - checked_at < VERSION_RECHECK:
+                _hits.incr()
+                return RecipientIndex(entries)
+            if _shared_version() == version:
+                _index = (version, built_at, now, entries)
+                _hits.incr()
+                return RecipientIndex(entries)
+
+    with _lock:
+        if _index is not current and _index is not None:
+            # Another thread rebuilt it while we waited
+            return RecipientIndex(_index[3])
+        version = _shared_version()
+        entries = build()
+        _builds.incr()
+        _index = (version, now, now, entries)
+        return RecipientIndex(entries)
+
+
+def invalidate():
+    """
+    Drops this process's copy now, and every other process's within
+    VERSION_RECHECK when the cache is shared (LOCAL_MAX_AGE otherwise).
+    """
+    global _index
+
+    _index = None
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def user_saved(sender, instance, update_fields=None, using=None, **kwargs):
+    if update_fields is not None and not INDEXED_FIELDS & set(update_fields):
+        return
+    transaction.on_commit(invalidate, using=using)
+
+
+def user_deleted(sender, instance, using=None, **kwargs):
+    transaction.on_commit(invalidate, using=using)
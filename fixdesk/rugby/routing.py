@@ -0,0 +1,236 @@
+"""
+Notification and approval routing, compiled from routing_rules.json.
+
+The rules file declares who hears about an event and who approves a
+request, per (subject, action, department, role). Any of the four may be a
+list, or left out to match anything; approval rules have no action. Rules
+are compiled once per process into a dict keyed by the 4-tuple (lowercased
+for inclusion rules; approval rules match case-sensitively), and a lookup
+probes at most four keys, most specific first:
+
+    (department, role), (department, *), (*, role), (*, *)
+
+An inclusion rule's "notify" entries select recipients:
+
+    {"department": D}                    everyone in D
+    {"department": D, "role": R}         users in D with role R
+    {"department": "$requester", ...}    the same, in the acting user's department
+    {"field": F}                         the emails on the event's object via F
+                                         (e.g. "assigned_to"), one query
+
+and "self" ("include"/"exclude") adds or removes the acting user last.
+Department lookups read the cached index in recipients.py.
+
+"approval_levels" maps each level title to the group that approves it. The
+group's department is matched exactly, as the approval matrix always has,
+and a level whose group is null is listed but resolves to no approvers.
+
+A new request type needs its model under "subjects" and its rules; no code.
+check_rules() is a system check that fails startup on a malformed file.
+"""
+import json
+from collections import namedtuple
+from pathlib import Path
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core import checks
+
+from .recipients import get_index
+
+RULES_FILE = Path(__file__).with_name("routing_rules.json")
+
+ANY = "*"
+REQUESTER = "$requester"
+APPROVAL = "approval"
+
+EMPTY = frozenset()
+
+
+class RoutingRulesError(ValueError):
+    pass
+
+
+# department is lowercased (kept as written for approval levels), or
+# REQUESTER; role None selects the whole department
+Group = namedtuple("Group", "department role")
+
+
+class Inclusion:
+    def __init__(self, groups, fields, self_action, model):
+        self.groups = groups
+        self.fields = fields
+        self.self_action = self_action
+        self.model = model
+
+    def recipients(self, email, department, id=None):
+        index = get_index()
+        recipients = set()
+        for group in self.groups:
+            dept = department if group.department == REQUESTER else group.department
+            recipients |= index.department(dept) if group.role is None else index.role(dept, group.role)
+
+        if self.fields and id:
+            rows = self.model.objects.filter(id=id).values_list(*(f"{field}__email" for field in self.fields))
+            recipients.update(email for row in rows for email in row)
+
+        if self.self_action == "include":
+            recipients.add(email)
+        elif self.self_action == "exclude":
+            recipients.discard(email)
+        return recipients
+
+
+Rules = namedtuple("Rules", "inclusion approval levels")
+
+_rules = None
+
+
+def _values(rule, name, default=ANY, fold_case=True):
+    value = rule.get(name, default)
+    values = value if isinstance(value, list) else [value]
+    if not values or not all(isinstance(v, str) for v in values):
+        raise RoutingRulesError(f"{name!r} must be a string or a list of strings: {rule}")
+    return [v.lower() if fold_case and v != ANY else v for v in values]
+
+
+def _keys(rule, action=None, fold_case=True):
+    actions = [action] if action else _values(rule, "action")
+    return [
+        (subject, act, department, role)
+        for subject in _values(rule, "subject", None, fold_case)
+        for act in actions
+        for department in _values(rule, "department", ANY, fold_case)
+        for role in _values(rule, "role", ANY, fold_case)
+    ]
+
+
+def _add(table, keys, value, rule):
+    for key in keys:
+        if key in table:
+            raise RoutingRulesError(f"More than one rule for {key}: {rule}")
+        table[key] = value
+
+
+def _group(selector, fold_case=True):
+    if set(selector) - {"department", "role"} or "department" not in selector:
+        raise RoutingRulesError(f"A group needs a department and at most a role: {selector}")
+    department = selector["department"]
+    if fold_case and department != REQUESTER:
+        department = department.lower()
+    return Group(department, selector.get("role"))
+
+
+def _model(subjects, subject):
+    try:
+        return apps.get_model(subjects[subject])
+    except KeyError:
+        raise RoutingRulesError(f"Subject {subject!r} has no model under 'subjects'") from None
+    except (LookupError, ValueError) as e:
+        raise RoutingRulesError(f"Subject {subject!r}: {e}") from None
+
+
+def compile_rules(data):
+    subjects = {subject.lower(): label for subject, label in data.get("subjects", {}).items()}
+
+    inclusion = {}
+    for rule in data.get("inclusion", []):
+        groups, fields = [], []
+        for selector in rule.get("notify", []):
+            if "field" in selector:
+                fields.append(selector["field"])
+            else:
+                groups.append(_group(selector))
+        self_action = rule.get("self")
+        if self_action not in (None, "include", "exclude"):
+            raise RoutingRulesError(f"'self' must be 'include' or 'exclude': {rule}")
+
+        keys = _keys(rule)
+        # One compiled rule per subject: field lookups need the subject's model
+        for subject in {key[0] for key in keys}:
+            model = _model(subjects, subject) if fields else None
+            compiled = Inclusion(tuple(groups), tuple(fields), self_action, model)
+            _add(inclusion, [key for key in keys if key[0] == subject], compiled, rule)
+
+    # Titles are stored on each request's approval_info and matched in any case
+    levels = {
+        title.lower(): None if selector is None else _group(selector, fold_case=False)
+        for title, selector in data.get("approval_levels", {}).items()
+    }
+
+    approval = {}
+    for rule in data.get("approval", []):
+        titles = tuple(rule.get("levels", []))
+        unknown = [title for title in titles if title.lower() not in levels]
+        if unknown:
+            raise RoutingRulesError(f"Approval levels not under 'approval_levels': {unknown}")
+        _add(approval, _keys(rule, APPROVAL, fold_case=False), titles, rule)
+
+    return Rules(inclusion, approval, levels)
+
+
+def load(path=RULES_FILE):
+    with open(path) as f:
+        return compile_rules(json.load(f))
+
+
+def rules():
+    global _rules
+
+    if _rules is None:
+        _rules = load()
+    return _rules
+
+
+def clear():
+    global _rules
+
+    _rules = None
+
+
+def lookup(table, subject, action, department, role, fold_case=True):
+    department, role = department or "", role or ""
+    if fold_case:
+        subject, action = subject.lower(), action.lower()
+        department, role = department.lower(), role.lower()
+    for key in (
+        (subject, action, department, role),
+        (subject, action, department, ANY),
+        (subject, action, ANY, role),
+        (subject, action, ANY, ANY),
+    ):
+        if key in table:
+            return table[key]
+    return None
+
+
+def inclusion(subject, action, department, role):
+    """The compiled Inclusion rule for an event, or None if nobody is notified."""
+    return lookup(rules().inclusion, subject, action, department, role)
+
+
+def approval_levels(subject, department, role):
+    """The approval level titles for a request, in order; () if it needs none."""
+    return lookup(rules().approval, subject, APPROVAL, department, role, fold_case=False) or ()
+
+
+def approvers(title, department):
+    """[{"id": ..., "email": ...}] who can approve level `title` for a requester in `department`."""
+    group = rules().levels.get(title.lower())
+    if group is None:
+        # Unknown title, or a level with no approver selector
+        return []
+    dept = department if group.department == REQUESTER else group.department
+    users = get_user_model().objects.filter(department=dept)
+    if group.role is not None:
+        users = users.filter(role=group.role)
+    return list(users.values("id", "email"))
+
+
+@checks.register()
+def check_rules(app_configs=None, **kwargs):
+    try:
+        load()
+    except (OSError, json.JSONDecodeError, RoutingRulesError) as e:
+        return [checks.Error(f"Invalid routing rules: {e}", obj=str(RULES_FILE), id="rugby.E001")]
+    return []
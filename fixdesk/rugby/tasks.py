@@ -1,55 +1,198 @@
-import os
+import datetime
+import logging
 
 from celery import shared_task
-import smtplib, ssl
-from email.message import EmailMessage
-
-from dotenv import load_dotenv
-load_dotenv()
-
-from django.template.loader import render_to_string
-
-@shared_task
-def send_mail(subject, to_email, context, type):
-    port = 587
-    smtp_server =os.getenv('SMTP_SERVER')
-    username=os.getenv('EMAIL_USER')
-    password =os.getenv('EMAIL_PASSWORD')
-    
-    if type == "admin":
-        html_content = render_to_string('admin_notification.html', context)
-    elif type == "user":
-        html_content = render_to_string('user_notification.html', context)
-    elif type == "issue_status":
-        html_content = render_to_string('issue_status_notification.html', context)
-    elif type == "task":
-        html_content = render_to_string('task_notification.html', context)
-    elif type == "task_status":
-        html_content = render_to_string('task_status_notification.html', context)
-    elif type == "comment":
-        html_content = render_to_string('comment_notification.html', context)
-
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = f"HelpDesk <rugby@fixdesk.ng>"
-    msg['To'] = to_email
-    msg.set_content(html_content, subtype='html')
-    
-    try:
-        if port == 465:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                server.login(username, password)
-                server.send_message(msg)
-        elif port == 587:
-            with smtplib.SMTP(smtp_server, port) as server:
-                server.starttls()
-                server.login(username, password)
-                server.send_message(msg)
-        else:
-            print ("use 465 / 587 as port value")
-            exit()
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from fixdesk.utils import delivery, smtp
+from fixdesk_api import dead_letters
+from fixdesk_api.tasks import MAX_RETRIES
+
+from . import mailer, notifications
+from .models import PendingNotification
+
+logger = logging.getLogger(__name__)
+
+
+def _send(task, subject, to_email, context, type, action, kwargs_for):
+    msg = mailer.build_message(subject, to_email, context, type, action)
+    if msg is None:
+        return False
+
+    error = mailer.deliver(msg)
+    failed = smtp.failures(error, to_email)
+    if not failed:
         return True
-    except Exception as e:
-        print (e)
+
+    # Only the refused addresses are retried or dead-lettered
+    dead_letters.fail_each(task, failed, kwargs_for)
+    return False
+
+
+@shared_task(bind=True, max_retries=MAX_RETRIES, ignore_result=True)
+def send_event(self, event, ids, to_email, type, action):
+    """
+    Sends the notification for `event` (see notifications.py), hydrated
+    here from the rows in `ids`. Retries rebuild it from fresh rows.
+    """
+    try:
+        mail = notifications.build(event, ids)
+    except notifications.UnknownEvent:
+        logger.error("Skipping unknown notification event %r", event)
         return False
+    if mail is None:
+        return False
+
+    return _send(
+        self, mail.subject, to_email, mail.context, type, action,
+        lambda to: {"event": event, "ids": ids, "to_email": to, "type": type, "action": action},
+    )
+
+
+@shared_task(bind=True, max_retries=MAX_RETRIES, ignore_result=True)
+def send_mail(self, subject, to_email, context, type, action):
+    """Sends a mail built already: digests, whose contexts are buffered snapshots."""
+    return _send(
+        self, subject, to_email, context, type, action,
+        lambda to: {"subject": subject, "to_email": to, "context": context, "type": type, "action": action},
+    )
+
+
+def digest_window(type, action):
+    return getattr(settings, "RUGBY_DIGEST_WINDOWS", {}).get(f"{type}_{action}", 0)
+
+
+def notify(event, ids, to_email, type, action, object_id=None, using="rugby"):
+    """
+    Queues send_event for after the current transaction on `using` commits
+    (right away outside a transaction), so the response never waits on SMTP
+    and a rolled-back write sends nothing. Only the event name, its ids and
+    the recipients go to the broker; the worker loads the rest.
+
+    Events with a digest window (RUGBY_DIGEST_WINDOWS) about a known object
+    are built now and buffered instead, since a digest lists the state at
+    each event; see buffer_digest().
+    """
+    window = digest_window(type, action) if object_id else 0
+    if window:
+        mail = notifications.build(event, ids)
+        if mail is None:
+            return None
+        return buffer_digest(mail.subject, to_email, mail.context, type, action, str(object_id), window, using=using)
+
+    kwargs = {
+        "event": event,
+        "ids": ids,
+        "to_email": list(to_email),
+        "type": type,
+        "action": action,
+    }
+    transaction.on_commit(lambda: send_event.apply_async(kwargs=kwargs), using=using)
+
+
+def buffer_digest(subject, to_email, context, type, action, object_id, window, using="rugby"):
+    """
+    Stores the event per recipient in the same transaction as the write that
+    caused it. The first event for a (recipient, type, object) opens a window
+    of `window` seconds and schedules flush_digest for when it closes; later
+    events join the open window. A window counts as open until its flush_at,
+    so an event arriving while a flush runs starts a new window.
+    """
+    now = timezone.now()
+    recipients = list(dict.fromkeys(r for r in to_email if r))
+    pending = PendingNotification.objects.using(using)
+
+    open_windows = dict(
+        pending.filter(recipient__in=recipients, type=type, object_id=object_id, flush_at__gt=now)
+        .values_list("recipient", "flush_at")
+    )
+    flush_at = now + datetime.timedelta(seconds=window)
+
+    pending.bulk_create([
+        PendingNotification(
+            recipient=recipient,
+            type=type,
+            action=action,
+            object_id=object_id,
+            subject=subject,
+            context=context,
+            flush_at=open_windows.get(recipient, flush_at),
+        )
+        for recipient in recipients
+    ])
+
+    for recipient in recipients:
+        if recipient not in open_windows:
+            transaction.on_commit(
+                lambda recipient=recipient: flush_digest.apply_async(args=(recipient, type, object_id), eta=flush_at),
+                using=using,
+            )
+
+
+# Buffered events still waiting this long after their window closed lost
+# their flush (e.g. the broker was down); flush_overdue_digests picks them up.
+DIGEST_OVERDUE_AFTER = 300  # seconds
+
+
+def _digest_mail(recipient, type, events):
+    if len(events) == 1:
+        e = events[0]
+        return {"subject": e.subject, "to_email": [recipient], "context": e.context, "type": e.type, "action": e.action}
+
+    latest = events[-1].context
+    context = {
+        "id": latest.get("id"),
+        "title": latest.get("title"),
+        "type_label": type,
+        "since": events[0].created_at,
+        "events": [{**e.context, "subject": e.subject, "date": e.created_at} for e in events],
+    }
+    subject = f"{len(events)} updates on {latest.get('title') or type}"
+    return {"subject": subject, "to_email": [recipient], "context": context, "type": "digest", "action": None}
+
+
+@shared_task(bind=True, max_retries=MAX_RETRIES, ignore_result=True)
+def flush_digest(self, recipient, type, object_id):
+    """
+    Queues send_mail for everything buffered for (recipient, type,
+    object_id) whose window has closed: a lone event as its usual
+    notification, several as one digest. The mail is published before the
+    rows are deleted, in the same transaction, so a failed publish keeps
+    them buffered; at worst a crash between publish and commit mails the
+    same events twice.
+    """
+    try:
+        with transaction.atomic(using="rugby"):
+            events = list(
+                PendingNotification.objects.using("rugby").select_for_update()
+                .filter(recipient=recipient, type=type, object_id=object_id, flush_at__lte=timezone.now())
+                .order_by("created_at")
+            )
+            if not events:
+                return False
+
+            send_mail.apply_async(kwargs=_digest_mail(recipient, type, events))
+            PendingNotification.objects.using("rugby").filter(id__in=[e.id for e in events]).delete()
+    except Exception as e:
+        # Broker unreachable or the delete failed: everything is still buffered
+        raise self.retry(countdown=delivery.backoff(self.request.retries), exc=e)
+    return True
+
+
+@shared_task(ignore_result=True)
+def flush_overdue_digests():
+    """Re-queues flush_digest for buffered events whose flush never ran."""
+    overdue = (
+        PendingNotification.objects.using("rugby")
+        .filter(flush_at__lte=timezone.now() - datetime.timedelta(seconds=DIGEST_OVERDUE_AFTER))
+        .order_by()
+        .values_list("recipient", "type", "object_id")
+        .distinct()
+    )
+    count = 0
+    for recipient, type, object_id in overdue:
+        flush_digest.apply_async(args=(recipient, type, object_id))
+        count += 1
+    return count
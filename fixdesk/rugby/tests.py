@@ -1,3 +1,614 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from fixdesk_api.models import User
+
+from . import recipients, routing, tasks
+from .approval_matrix import approval_matrix, attach_approvers_to_approval_info, build_approval_structure
+from .inclusion_matrix import users_inclusion_matrix
+from .models import FacilityRequest, Issues, LeaveRequest, Milestone, PendingNotification, ProcurementRequest, Tasks
+from .recipients import get_index
+
+DEPARTMENTS = (
+    "Non-Academic - IT",
+    "Non-Academic - HR",
+    "Non-Academic - Accounting",
+    "Non-Academic - Procurement",
+    "Senior Leadership Team",
+    "facilities",
+    "Mathematics",
+)
+SUBJECTS = ("issue", "task", "leaverequest", "facilityrequest", "procurementrequest", "Issue", "payment")
+ACTIONS = ("creation", "status_change", "comment", "assigned", "Comment", "approval")
+ROLES = ("staff", "team_lead", "admin", "Team_Lead")
+
+
+# The inclusion and approval matrices as they were before routing_rules.json,
+# kept verbatim so the compiled rules can be checked against them.
+
+def legacy_inclusion_matrix(
+    email,
+    User_model,
+    role,
+    department,
+    subject,
+    action,
+    id=None
+):
+    # -----------------------------
+    # Normalize inputs
+    # -----------------------------
+    role = role.lower()
+    department = department.lower()
+    subject = subject.lower()
+    action = action.lower()
+
+    # -----------------------------
+    # Helper functions
+    # -----------------------------
+    def dept_users(dept):
+        return set(
+            User_model.objects.filter(department__iexact=dept)
+            .values_list("email", flat=True)
+        )
+
+    def team_leads(dept):
+        return set(
+            User_model.objects.filter(
+                department__iexact=dept,
+                role="team_lead"
+            ).values_list("email", flat=True)
+        )
+
+    def assigned_issue_users():
+        if not id:
+            return set()
+        return set(
+            Issues.objects.filter(id=id)
+            .values_list("assigned_to__email", flat=True)
+        )
+
+    def issue_reporter():
+        if not id:
+            return set()
+        return set(
+            Issues.objects.filter(id=id)
+            .values_list("reported_by__email", flat=True)
+        )
+
+    def assigned_task_users():
+        if not id:
+            return set()
+        return set(
+            Tasks.objects.filter(id=id)
+            .values_list("assigned_to__email", flat=True)
+        )
+
+    def assigned_facility_users():
+        if not id:
+            return set()
+        return set(
+            FacilityRequest.objects.filter(id=id)
+            .values_list("assigned_to__email", flat=True)
+        )
+
+    def assigned_procurement_users():
+        if not id:
+            return set()
+        return set(
+            ProcurementRequest.objects.filter(id=id)
+            .values_list("assigned_to__email", flat=True)
+        )
+
+    def assigned_leave_users():
+        if not id:
+            return set()
+        return set(
+            LeaveRequest.objects.filter(id=id)
+            .values_list("assigned_to__email", flat=True)
+        )
+
+    recipients = set()
+
+    # ==========================================================
+    # SUBJECT DISPATCH
+    # ==========================================================
+
+    # ==========================================================
+    # ISSUE
+    # ==========================================================
+    if subject == "issue":
+
+        if action == "creation":
+            if department == "Non-Academic - IT":
+                recipients |= dept_users("Non-Academic - IT")
+                if role == "staff":
+                    recipients -= {email}
+                else:
+                    recipients |= {email}
+
+            elif department == "Non-Academic - HR":
+                recipients |= dept_users("Non-Academic - IT")
+                recipients |= team_leads("Non-Academic - HR")
+                recipients |= {email}
+
+            elif department == "facilities":
+                recipients |= dept_users("Non-Academic - IT")
+                recipients |= team_leads("facilities")
+
+            else:
+                recipients |= dept_users("Non-Academic - IT")
+                recipients |= {email}
+
+        elif action == "status_change":
+            recipients |= dept_users("Non-Academic - IT")
+            recipients |= {email}
+
+        elif action == "comment":
+            recipients |= dept_users("Non-Academic - IT")
+
+            if role == "team_lead" and department == "Non-Academic - IT":
+                recipients |= issue_reporter()
+
+            recipients -= {email}
+
+        elif action == "assigned":
+            recipients |= assigned_issue_users()
+
+        return recipients
+
+    # ==========================================================
+    # TASK
+    # ==========================================================
+    if subject == "task":
+
+        if action == "creation":
+            if role == "team_lead":
+                recipients |= assigned_task_users()
+
+        elif action == "status_change":
+            recipients |= assigned_task_users()
+            recipients |= {email}
+
+        elif action == "comment":
+            recipients |= assigned_task_users()
+            recipients -= {email}
+
+        elif action == "assigned":
+            recipients |= assigned_task_users()
+
+        return recipients
+
+    # ==========================================================
+    # LEAVE REQUEST
+    # ==========================================================
+    if subject == "leaverequest":
+
+        if action in ["creation", "status_change"]:
+            recipients |= team_leads(department)
+            recipients |= dept_users("Non-Academic - HR")
+            recipients |= team_leads("Senior Leadership Team")
+            recipients |= {email}
+
+        elif action == "comment":
+            recipients |= team_leads(department)
+            recipients |= dept_users("Non-Academic - HR")
+            recipients |= team_leads("Senior Leadership Team")
+            recipients -= {email}
+
+        elif action == "assigned":
+            recipients |= assigned_leave_users()
+
+        return recipients
+
+    # ==========================================================
+    # FACILITY REQUEST
+    # ==========================================================
+    if subject == "facilityrequest":
+
+        if action in ["creation", "status_change"]:
+            recipients |= team_leads(department)
+            recipients |= dept_users("facilities")
+            recipients |= dept_users("Non-Academic - Accounting")
+            recipients |= team_leads("Senior Leadership Team")
+            recipients |= {email}
+
+        elif action == "comment":
+            recipients |= team_leads(department)
+            recipients |= dept_users("facilities")
+            recipients |= dept_users("Non-Academic - Accounting")
+            recipients |= team_leads("Senior Leadership Team")
+            recipients -= {email}
+
+        elif action == "assigned":
+            recipients |= assigned_facility_users()
+
+        return recipients
+
+    # ==========================================================
+    # PROCUREMENT REQUEST
+    # ==========================================================
+    if subject == "procurementrequest":
+
+        if action in ["creation", "status_change"]:
+            recipients |= team_leads(department)
+            recipients |= dept_users("Non-Academic - Procurement")
+            recipients |= dept_users("Non-Academic - Accounting")
+            recipients |= team_leads("Senior Leadership Team")
+            recipients |= {email}
+
+        elif action == "comment":
+            recipients |= team_leads(department)
+            recipients |= dept_users("Non-Academic - Procurement")
+            recipients |= dept_users("Non-Academic - Accounting")
+            recipients |= team_leads("Senior Leadership Team")
+            recipients -= {email}
+
+        elif action == "assigned":
+            recipients |= assigned_procurement_users()
+
+        return recipients
+
+    # ==========================================================
+    # DEFAULT FALLBACK
+    # ==========================================================
+    return set()
+
+
+def legacy_approval_matrix(type, role, department):
+    APPROVAL_MATRIX = {
+        "procurementrequest": {
+            "Non-Academic - Procurement": {
+                "team_lead": ["Non-Academic - Accounting"],
+                "staff": ["Team Lead", "Non-Academic - Accounting"],
+            },
+            "*": {
+                "team_lead": ["Non-Academic - Procurement", "Non-Academic - Accounting"],
+                "staff": ["Team Lead", "Non-Academic - Procurement", "Non-Academic - Accounting"],
+            },
+        },
+        "leaverequest": {
+            "Non-Academic - HR": {
+                "team_lead": ["Senior Leadership Team"],
+                "staff": ["Team Lead", "Senior Leadership Team"],
+            },
+            "Senior Leadership Team": {
+                "team_lead": ["Non-Academic - HR"],
+                "staff": ["Team Lead", "Non-Academic - HR"],
+            },
+            "*": {
+                "team_lead": ["Non-Academic - HR", "Senior Leadership Team"],
+                "staff": ["Team Lead", "Non-Academic - HR", "Senior Leadership Team"],
+            },
+        },
+    }
+
+    type_rules = APPROVAL_MATRIX.get(type)
+    if not type_rules:
+        return {}, 0
+
+    dept_rules = type_rules.get(department) or type_rules.get("*")
+    if not dept_rules:
+        return {}, 0
+
+    level_titles = dept_rules.get(role)
+    if not level_titles:
+        return {}, 0
+
+    approval_info = build_approval_structure(level_titles)
+    number_of_levels = len(level_titles)
+
+    return approval_info, number_of_levels
+
+
+def legacy_resolve_approvers(title: str, requester, User_model) -> list[dict]:
+    """
+    Returns a list of approvers for this level as:
+    [{"id": <uuid>, "email": "<email>"}]
+    """
+
+    def dept_team_leads(dept_name: str) -> list[dict]:
+        return list(
+            User_model.objects
+            .filter(department=dept_name, role="team_lead")
+            .values("id", "email")
+        )
+
+    title = title.strip().lower()
+
+    if title == "team lead":
+        return dept_team_leads(requester.department)
+
+    if title == "Non-Academic - HR":
+        return dept_team_leads("Non-Academic - HR")
+
+    if title == "Non-Academic - Procurement":
+        return dept_team_leads("Non-Academic - Procurement")
+
+    if title == "Non-Academic - Accounting":
+        return dept_team_leads("Non-Academic - Accounting")
+
+    if title == "Senior Leadership Team":
+        return dept_team_leads("Senior Leadership Team")
+
+    return []
+
+
+class RoutingEquivalenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = []
+        for i, department in enumerate(DEPARTMENTS + ("non-academic - it", "MATHEMATICS", None)):
+            for role in ("staff", "team_lead"):
+                for n in range(2):
+                    users.append(User(email=f"u{i}-{role}-{n}@example.com", department=department, role=role))
+        User.objects.bulk_create(users)
+        cls.emails = [user.email for user in users] + ["outsider@example.com"]
+
+    def setUp(self):
+        routing.clear()
+        recipients.invalidate()
+
+    def test_inclusion_matches_legacy_matrix(self):
+        departments = DEPARTMENTS + tuple(department.lower() for department in DEPARTMENTS) + ("",)
+        for subject in SUBJECTS:
+            for action in ACTIONS:
+                for department in departments:
+                    for role in ROLES:
+                        for email in (self.emails[0], self.emails[3], "outsider@example.com"):
+                            with self.subTest(subject=subject, action=action, department=department, role=role, email=email):
+                                self.assertEqual(
+                                    users_inclusion_matrix(email, User, role, department, subject, action),
+                                    legacy_inclusion_matrix(email, User, role, department, subject, action),
+                                )
+
+    def test_approval_matches_legacy_matrix(self):
+        departments = DEPARTMENTS + tuple(department.lower() for department in DEPARTMENTS) + ("", None, "*")
+        for subject in SUBJECTS:
+            for department in departments:
+                for role in ROLES + (None,):
+                    with self.subTest(subject=subject, department=department, role=role):
+                        approval_info, levels = approval_matrix(subject, role, department)
+                        self.assertEqual((approval_info, levels), legacy_approval_matrix(subject, role, department))
+
+                        requester = User(email="requester@example.com", department=department, role=role)
+                        attach_approvers_to_approval_info(approval_info, requester, User)
+                        for level in approval_info.values():
+                            self.assertCountEqual(level["approvers"], legacy_resolve_approvers(level["title"], requester, User))
+
+
+class RecipientIndexTests(TestCase):
+    def setUp(self):
+        self.lead = User.objects.create(email="lead@example.com", department="Non-Academic - IT", role="team_lead")
+        self.staff = User.objects.create(email="staff@example.com", department="non-academic - it", role="staff")
+        recipients.invalidate()
+
+    def test_built_with_one_query_then_served_from_memory(self):
+        with self.assertNumQueries(1):
+            index = get_index()
+        self.assertEqual(index.department("NON-ACADEMIC - IT"), {"lead@example.com", "staff@example.com"})
+        self.assertEqual(index.role("Non-Academic - IT", "team_lead"), {"lead@example.com"})
+
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                get_index().department("Non-Academic - IT")
+
+    def test_skips_users_without_email_or_department(self):
+        User.objects.create(email=None, department="Non-Academic - IT", role="team_lead")
+        User.objects.create(email="", department="Non-Academic - IT", role="staff")
+        User.objects.create(email="nodept@example.com", department=None, role="staff")
+        recipients.invalidate()
+
+        index = get_index()
+        self.assertEqual(index.department("Non-Academic - IT"), {"lead@example.com", "staff@example.com"})
+        self.assertEqual(index.department(""), set())
+
+    def test_user_save_shows_after_commit(self):
+        get_index()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            User.objects.create(email="new@example.com", department="Non-Academic - IT", role="staff")
+            # Not committed yet: the index still serves the old users, without a query
+            with self.assertNumQueries(0):
+                self.assertNotIn("new@example.com", get_index().department("Non-Academic - IT"))
+        self.assertEqual(len(callbacks), 1)
+
+        with self.assertNumQueries(1):
+            self.assertIn("new@example.com", get_index().department("Non-Academic - IT"))
+
+    def test_user_delete_shows_after_commit(self):
+        get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            # delete() would cascade to rugby tables, which a separate SQLite
+            # test database cannot reach; send the signal it sends instead
+            User.objects.filter(pk=self.staff.pk)._raw_delete("default")
+            post_delete.send(sender=User, instance=self.staff, using="default")
+        self.assertEqual(get_index().department("Non-Academic - IT"), {"lead@example.com"})
+
+    def test_saves_of_unindexed_fields_keep_the_index(self):
+        get_index()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.staff.save(update_fields=["last_login"])
+        self.assertEqual(callbacks, [])
+
+    def test_warm_up_builds_the_index(self):
+        apps.get_app_config("rugby").warm_up()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_index().role("non-academic - it", "staff"), {"staff@example.com"})
+
+
+class NotifyTests(TestCase):
+    databases = {"default", "rugby"}
+
+    def setUp(self):
+        self.milestone = Milestone.objects.create(title="Kick-off", status="unchecked")
+
+    def test_enqueues_event_and_ids_only(self):
+        with mock.patch.object(tasks.send_event, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(using="rugby", execute=True):
+                tasks.notify(
+                    "milestone.created", {"milestone_id": str(self.milestone.id)},
+                    to_email={"a@example.com"}, type="milestone", action="creation",
+                )
+
+        apply_async.assert_called_once_with(kwargs={
+            "event": "milestone.created",
+            "ids": {"milestone_id": str(self.milestone.id)},
+            "to_email": ["a@example.com"],
+            "type": "milestone",
+            "action": "creation",
+        })
+
+    def test_worker_hydrates_committed_rows(self):
+        Milestone.objects.filter(id=self.milestone.id).update(title="Kick-off (moved)")
+
+        with mock.patch.object(tasks.mailer, "deliver", return_value=None) as deliver:
+            sent = tasks.send_event.apply(kwargs={
+                "event": "milestone.created",
+                "ids": {"milestone_id": str(self.milestone.id)},
+                "to_email": ["a@example.com"],
+                "type": "milestone",
+                "action": "creation",
+            }).get()
+
+        self.assertTrue(sent)
+        msg = deliver.call_args.args[0]
+        self.assertEqual(msg["Subject"], "New Milestone Created")
+        self.assertIn("Kick-off (moved)", msg.get_content())
+
+    def test_skips_rows_deleted_before_the_worker_ran(self):
+        milestone_id = str(self.milestone.id)
+        self.milestone.delete()
+
+        with mock.patch.object(tasks.mailer, "deliver") as deliver:
+            sent = tasks.send_event.apply(kwargs={
+                "event": "milestone.created",
+                "ids": {"milestone_id": milestone_id},
+                "to_email": ["a@example.com"],
+                "type": "milestone",
+                "action": "creation",
+            }).get()
+
+        self.assertFalse(sent)
+        deliver.assert_not_called()
+
+
+@override_settings(RUGBY_DIGEST_WINDOWS={"milestone_status": 60})
+class DigestTests(TestCase):
+    databases = {"default", "rugby"}
+
+    def setUp(self):
+        self.milestone = Milestone.objects.create(title="Kick-off", status="unchecked")
+        self.object_id = str(self.milestone.id)
+
+    def notify(self, previous_status, to_email=("a@example.com",)):
+        tasks.notify(
+            "milestone.status", {"milestone_id": self.object_id, "previous_status": previous_status},
+            to_email=to_email, type="milestone", action="status", object_id=self.milestone.id,
+        )
+
+    def close_windows(self):
+        PendingNotification.objects.update(flush_at=timezone.now() - datetime.timedelta(seconds=1))
+
+    def flush(self):
+        with mock.patch.object(tasks.send_mail, "apply_async") as apply_async:
+            flushed = tasks.flush_digest.apply(args=("a@example.com", "milestone", self.object_id)).get()
+        return flushed, apply_async
+
+    def test_buffers_and_schedules_one_flush_per_window(self):
+        with mock.patch.object(tasks.flush_digest, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(using="rugby", execute=True):
+                self.notify("unchecked", to_email=("a@example.com", "b@example.com"))
+            with self.captureOnCommitCallbacks(using="rugby", execute=True):
+                self.notify("checked")
+
+        # The second event joins a's open window: no new flush for it
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(
+            {c.kwargs["args"] for c in apply_async.call_args_list},
+            {("a@example.com", "milestone", self.object_id), ("b@example.com", "milestone", self.object_id)},
+        )
+        events = PendingNotification.objects.filter(recipient="a@example.com")
+        self.assertEqual(events.count(), 2)
+        self.assertEqual(len({e.flush_at for e in events}), 1)
+
+    def test_nothing_is_buffered_on_rollback(self):
+        with mock.patch.object(tasks.flush_digest, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(using="rugby", execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic(using="rugby"):
+                    self.notify("unchecked")
+                    raise RuntimeError
+
+        apply_async.assert_not_called()
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_open_window_is_not_flushed(self):
+        with mock.patch.object(tasks.flush_digest, "apply_async"):
+            self.notify("unchecked")
+
+        flushed, apply_async = self.flush()
+
+        self.assertFalse(flushed)
+        apply_async.assert_not_called()
+        self.assertEqual(PendingNotification.objects.count(), 1)
+
+    def test_lone_event_sends_the_usual_mail(self):
+        with mock.patch.object(tasks.flush_digest, "apply_async"):
+            self.notify("unchecked")
+        self.close_windows()
+
+        flushed, apply_async = self.flush()
+
+        self.assertTrue(flushed)
+        mail = apply_async.call_args.kwargs["kwargs"]
+        self.assertEqual(mail["subject"], "Milestone Updated")
+        self.assertEqual(mail["to_email"], ["a@example.com"])
+        self.assertEqual((mail["type"], mail["action"]), ("milestone", "status"))
+        self.assertEqual(mail["context"]["previous_status"], "unchecked")
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_several_events_send_one_digest(self):
+        with mock.patch.object(tasks.flush_digest, "apply_async"):
+            self.notify("unchecked")
+            self.notify("checked")
+        self.close_windows()
+
+        flushed, apply_async = self.flush()
+
+        self.assertTrue(flushed)
+        apply_async.assert_called_once()
+        mail = apply_async.call_args.kwargs["kwargs"]
+        self.assertEqual(mail["subject"], "2 updates on Kick-off")
+        self.assertEqual(mail["type"], "digest")
+        self.assertEqual([e["previous_status"] for e in mail["context"]["events"]], ["unchecked", "checked"])
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_failed_publish_keeps_the_events(self):
+        with mock.patch.object(tasks.flush_digest, "apply_async"):
+            self.notify("unchecked")
+        self.close_windows()
+
+        with mock.patch.object(tasks.send_mail, "apply_async", side_effect=OSError("broker down")):
+            result = tasks.flush_digest.apply(args=("a@example.com", "milestone", self.object_id))
+
+        self.assertTrue(result.failed())
+        self.assertEqual(PendingNotification.objects.count(), 1)
+
+    def test_overdue_digests_are_requeued(self):
+        with mock.patch.object(tasks.flush_digest, "apply_async"):
+            self.notify("unchecked", to_email=("a@example.com", "b@example.com"))
+            self.notify("checked")
+        PendingNotification.objects.filter(recipient="a@example.com").update(
+            flush_at=timezone.now() - datetime.timedelta(seconds=tasks.DIGEST_OVERDUE_AFTER + 1)
+        )
+
+        with mock.patch.object(tasks.flush_digest, "apply_async") as apply_async:
+            count = tasks.flush_overdue_digests()
+
+        self.assertEqual(count, 1)
+        apply_async.assert_called_once_with(args=("a@example.com", "milestone", self.object_id))
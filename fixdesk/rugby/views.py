@@ -10,10 +10,12 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
 from fixdesk_api.models import Organization
+from fixdesk_api.filters import UserFilter
 from fixdesk.utils.microsoft import verify_microsoft_token
 
 import boto3
 from django.conf import settings
+from django.db import transaction
 import uuid
 
 from dotenv import load_dotenv
@@ -22,8 +24,7 @@ load_dotenv()
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
-# from .tasks import send_mail
-from .mailer import send_mail
+from .tasks import notify
 
 from .models import Issues, Payment, Tasks, Comments, Departments, ActivityLog, Milestone, LeaveRequest, FacilityRequest, ProcurementRequest, Comments_Requests
 
@@ -139,7 +140,7 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     http_method_names = ['get', 'post', 'put', 'patch']
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['email']
+    filterset_class = UserFilter
     
 class DepartmentsViewSet(viewsets.ModelViewSet):
     queryset = Departments.objects.all()
@@ -161,6 +162,7 @@ class ActivityLogViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', 'post', 'put', 'patch']
     filter_backends = [DjangoFilterBackend]
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -187,37 +189,21 @@ class ActivityLogViewSet(viewsets.ModelViewSet):
 
         hasher[type].objects.get(id=id).activity.add(activity_log)
 
-        obj = hasher[type].objects.get(id=id)
-
-        context = {
-            'id': f'{id[:3]}',
-            'user': activity_log.user.first_name + ' ' + activity_log.user.last_name,
-            'title': getattr(obj, 'title', None),
-            'description': getattr(obj, 'description', None),
-            'date': activity_log.timestamp,
-            'due_date': getattr(obj, 'due_date', None),
-            'previous_status': request.data.get('previous_status', None),
-            'status': getattr(obj, 'status', None),
-            'reported_by': obj.reported_by.first_name or obj.requested_by.first_name + ' ' + obj.reported_by.last_name or obj.requested_by.last_name,
-            'priority': getattr(obj, 'priority', None),
-            'assigned_to': getattr(obj, 'assigned_to', None)
-        }
-
-        subject_hash = {
-            f'{type}_creation': f'New {type.capitalize()} Created',
-            f'{type}_status': f'{type.capitalize()} Status Update',
-            f'{type}_assigned': f'{type.capitalize()} Assigned to You',
-            f'{type}_comment': f'New comment on {type.capitalize()}',
-        }
-
         print (type, action)
 
-        send_mail(
-                subject=subject_hash[f'{type}_{action}'],
+        notify(
+                "activity.logged",
+                {
+                    'activity_log_id': str(activity_log.id),
+                    'subject': type,
+                    'action': action,
+                    'object_id': id,
+                    'previous_status': request.data.get('previous_status', None),
+                },
                 to_email=list(users),
-                context=context,
                 type=type,
-                action=action
+                action=action,
+                object_id=id
         )
 
         return Response(
@@ -225,6 +211,7 @@ class ActivityLogViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
     
+    @transaction.atomic(using="rugby")
     def partial_update(self, request, *args, **kwargs):
         response = super().partial_update(request, *args, **kwargs)
 
@@ -242,41 +229,19 @@ class ActivityLogViewSet(viewsets.ModelViewSet):
             id=id
         )
 
-        hasher = {'issue': Issues,
-                'task': Tasks,
-                'facilityrequest': FacilityRequest,
-                'procurementrequest': ProcurementRequest,
-                'leaverequest': LeaveRequest}
-
-        related_obj = hasher[type].objects.get(id=id)
-
-        context = {
-            'id': f'{id[:3]}',
-            'user': activity_log.user.first_name + ' ' + activity_log.user.last_name,
-            'title': related_obj.title,
-            'description': related_obj.description,
-            'date': activity_log.timestamp,
-            'due_date': getattr(related_obj, 'due_date', None),
-            'previous_status': request.data.get('previous_status', None),
-            'status': getattr(related_obj, 'status', None),
-            'reported_by': related_obj.reported_by.first_name + ' ' + related_obj.reported_by.last_name,
-            'priority': getattr(related_obj, 'priority', None),
-            'assigned_to': getattr(related_obj, 'assigned_to', None)
-        }
-
-        subject_hash = {
-            f'{type}_creation': f'New {type.capitalize()} Created',
-            f'{type}_status': f'{type.capitalize()} Status Update',
-            f'{type}_assigned': f'{type.capitalize()} Assigned to You',
-            f'{type}_comment': f'New comment on {type.capitalize()}',
-        }
-
-        send_mail(
-                subject=subject_hash[f'{type}_{action}'],
+        notify(
+                "activity.logged",
+                {
+                    'activity_log_id': str(activity_log.id),
+                    'subject': type,
+                    'action': action,
+                    'object_id': id,
+                    'previous_status': request.data.get('previous_status', None),
+                },
                 to_email=list(users),
-                context=context,
                 type=type,
-                action=action
+                action=action,
+                object_id=id
         )
 
         return response
@@ -288,6 +253,7 @@ class MilestoneViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status']
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -318,15 +284,13 @@ class MilestoneViewSet(viewsets.ModelViewSet):
             id=id
         )
 
-        context = {
-        }
-
         # send email to users
-        send_mail(
-                subject=f"New Milestone Created",
+        notify(
+                "milestone.created",
+                {'milestone_id': str(milestone.id)},
                 to_email=list(users),
-                context=context,
-                type="milestone"
+                type="milestone",
+                action="creation"
         )
 
         return Response(
@@ -334,6 +298,7 @@ class MilestoneViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
 
+    @transaction.atomic(using="rugby")
     def partial_update(self, request, *args, **kwargs):
         response = super().partial_update(request, *args, **kwargs)
 
@@ -362,15 +327,13 @@ class MilestoneViewSet(viewsets.ModelViewSet):
             id=id
         )
 
-        context = {
-        }
-
         # send email to users
-        send_mail(
-                subject=f"Milestone Updated",
+        notify(
+                "milestone.status",
+                {'milestone_id': str(milestone.id), 'previous_status': request.data.get('previous_status', None)},
                 to_email=list(users),
-                context=context,
-                type="milestone"
+                type="milestone",
+                action="status"
         )
 
         return response
@@ -382,6 +345,7 @@ class IssuesViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['reported_by', 'status', 'priority', 'type']
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -411,18 +375,11 @@ class IssuesViewSet(viewsets.ModelViewSet):
             id=id
         )
 
-        context = {
-            'id': f'{id[:3]}',
-            'title': issue.title,
-            'description': issue.description,
-            'date': issue.created_at
-        }
-
         # send email to users
-        send_mail(
-                subject=f"New Issue Created",
+        notify(
+                "issue.created",
+                {'issue_id': id},
                 to_email=list(users),
-                context=context,
                 type="issue",
                 action="creation"
         )
@@ -439,6 +396,7 @@ class TasksViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'priority']
     
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -448,7 +406,7 @@ class TasksViewSet(viewsets.ModelViewSet):
         activity_log = ActivityLog.objects.create(
             user=task.assigned_by,
             type=f'task_creation_{task.id}',
-            text=f"Created task and assigned to {', '.join([user.first_name for user in task.assigned_to.all()])}"
+            text=f"Created task and assigned to {', '.join([str(user.first_name) for user in task.assigned_to.all()])}"
         )
 
         task.activity.add(activity_log)
@@ -472,17 +430,10 @@ class TasksViewSet(viewsets.ModelViewSet):
             id=id
         )
 
-        context = {
-            'id': f'{id[:3]}',
-            'title': task.title,
-            'description': task.description,
-            'date': task.created_at
-        }
-
-        send_mail(
-                subject=f"New Task Created",
+        notify(
+                "task.created",
+                {'task_id': id},
                 to_email=list(users),
-                context=context,
                 type="task",
                 action="creation"
         )
@@ -499,6 +450,7 @@ class CommentsViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['commenter__email']
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -533,21 +485,13 @@ class CommentsViewSet(viewsets.ModelViewSet):
 
         hasher[subject].objects.get(id=id).activity.add(activity_log)
 
-        context = {
-            'id': f'{id[:3]}',
-            'title': comment.case.title,
-            'description': comment.message,
-            'date': comment.timestamp,
-            'commenter': f'{comment.commenter.first_name} {comment.commenter.last_name}',
-            'commenter_initial': f'{comment.commenter.first_name[0]}{comment.commenter.last_name[0]}'
-        }
-
-        send_mail(
-                subject=f"New Comment on {subject}",
+        notify(
+                "comment.created",
+                {'comment_id': str(comment.id), 'subject': subject},
                 to_email=list(users),
-                context=context,
                 type=subject,
-                action="comment"
+                action="comment",
+                object_id=id
         )
 
         return Response(
@@ -562,6 +506,7 @@ class Comments_RequestsViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['commenter__email']
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -597,21 +542,13 @@ class Comments_RequestsViewSet(viewsets.ModelViewSet):
 
         hasher[subject].objects.get(id=id).activity.add(activity_log)
 
-        context = {
-            'id': f'{id[:3]}',
-            'title': comment.request.reason,
-            'description': comment.message,
-            'date': comment.timestamp,
-            'commenter': f'{comment.commenter.first_name} {comment.commenter.last_name}',
-            'commenter_initial': f'{comment.commenter.first_name[0]}{comment.commenter.last_name[0]}'
-        }
-
-        send_mail(
-                subject=f"New Comment on {subject}",
+        notify(
+                "request_comment.created",
+                {'comment_id': str(comment.id), 'subject': subject},
                 to_email=list(users),
-                context=context,
                 type=subject,
-                action=action
+                action=action,
+                object_id=id
         )
 
         return Response(
@@ -626,6 +563,7 @@ class LeaveRequestViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'type']
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -684,17 +622,10 @@ class LeaveRequestViewSet(viewsets.ModelViewSet):
 
         print (users)
 
-        context = {
-            'id': f'{id[:3]}',
-            'title': leaveRequest.reason,
-            'description': leaveRequest.notes,
-            'date': leaveRequest.created_at
-        }
-
-        send_mail(
-                subject=f"New Leave Request",
+        notify(
+                "request.created",
+                {'request_id': id, 'subject': "leaverequest"},
                 to_email=list(users),
-                context=context,
                 type="leaverequest",
                 action="creation"
         )
@@ -711,6 +642,7 @@ class FacilityRequestViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'type']
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -742,17 +674,10 @@ class FacilityRequestViewSet(viewsets.ModelViewSet):
             id=id
         )
 
-        context = {
-            'id': f'{id[:3]}',
-            'title': facilityRequest.location,
-            'description': facilityRequest.description,
-            'date': facilityRequest.created_at
-        }
-
-        send_mail(
-                subject=f"New Facility Request",
+        notify(
+                "request.created",
+                {'request_id': id, 'subject': "facilityrequest"},
                 to_email=list(users),
-                context=context,
                 type="facilityrequest",
                 action="creation"
         )
@@ -769,6 +694,7 @@ class ProcurementRequestViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'type']
 
+    @transaction.atomic(using="rugby")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -825,17 +751,10 @@ class ProcurementRequestViewSet(viewsets.ModelViewSet):
             id=id
         )
 
-        context = {
-            'id': f'{id[:3]}',
-            'title': procurementRequest.center_code,
-            'description': procurementRequest.justification,
-            'date': procurementRequest.created_at
-        }
-
-        send_mail(
-                subject=f"New procurement Request",
+        notify(
+                "request.created",
+                {'request_id': id, 'subject': "procurementrequest"},
                 to_email=list(users),
-                context=context,
                 type="procurementrequest",
                 action="creation"
         )